@@ -12,11 +12,14 @@ from datetime import date, timedelta, datetime
 # Importar las funciones desde los archivos de lógica
 from funciones.analisis import (obtener_kpi_multiskill, obtener_kpi_mantencion, obtener_kpi_provision, get_company_list,
 obtener_resumen_general_rt, obtener_distribucion_reincidencias,  obtener_resumen_general_ft, obtener_resumen_rt_por_empresa, 
-obtener_detalle_rt, obtener_historial_rodante_rt, obtener_resumen_ft_por_empresa, obtener_detalle_ft, obtener_historial_rodante_ft,
+obtener_detalle_rt, obtener_historiales_rodantes, historial_de_tecnico, obtener_matriz_mensual, obtener_resumen_ft_por_empresa, obtener_detalle_ft,
 obtener_kpi_certificacion, obtener_certificacion_por_tecnico, obtener_mantenimiento_por_tecnico, obtener_provision_por_tecnico,
 obtener_ranking_tecnicos, obtener_ranking_por_empresa, obtener_ranking_empresas, obtener_reparaciones_por_comuna,
-obtener_instalaciones_por_comuna, obtener_stats_calidad_por_comuna, obtener_datos_duracion, obtener_opciones_filtros,
-obtener_tiempos_promedio_empresa, obtener_datos_causa_falla, buscar_actividades )
+obtener_instalaciones_por_comuna, obtener_stats_calidad_por_comuna, obtener_opciones_filtros, buscar_actividades,
+obtener_resumen_causa_falla, obtener_estadisticas_duracion, estadisticas_por )
+from funciones.conexion import crear_engine, url_conexion
+from funciones.consultas_paralelas import PlanificadorConsultas
+from funciones.kpi_ratios import porcentaje, clasificar, colores_umbral
 
 
 
@@ -81,21 +84,15 @@ def get_db_engine():
         # Esto funcionará automáticamente cuando despliegues en Streamlit Community Cloud.
         connection_string = st.secrets["DB_CONNECTION_STRING"]
         # st.info("Conectando a la base de datos en la nube (Producción)...") # Opcional
-        engine = sa.create_engine(connection_string)
 
     except Exception:
         # --- SI FALLA, SE CONECTA A LOCAL (DESARROLLO) ---
         # Si no encuentra el archivo secrets.toml o la clave DB_CONNECTION_STRING,
-        # usa las credenciales locales como respaldo.
-        
-        USER = "postgres"
-        # ¡IMPORTANTE! Asegúrate de que esta sea tu contraseña LOCAL de PostgreSQL
-        PASSWORD = "postgres" 
-        HOST = "localhost"
-        PORT = "5432"
-        DB_NAME = "entelrm"
-        connection_string = f"postgresql+psycopg2://{USER}:{PASSWORD}@{HOST}:{PORT}/{DB_NAME}"
-        engine = sa.create_engine(connection_string)
+        # usa la variable de entorno DB_CONNECTION_STRING o la BD local (ver funciones/conexion.py).
+        connection_string = url_conexion()
+
+    # Pool, pre-ping y statement_timeout se configuran en funciones/conexion.py
+    engine = crear_engine(connection_string, application_name="dashboard_app")
 
     # Bloque final para verificar que la conexión (sea cual sea) fue exitosa
     try:
@@ -112,15 +109,15 @@ engine = get_db_engine()
 
 # --- 3. Funciones de Estilo ---
 def style_porcentaje(columna, umbral):
-    return [f'color: #D32F2F' if valor > umbral else 'color: #388E3C' for valor in columna]
+    return colores_umbral(columna, umbral, mayor_es_mejor=False)
 
 # --- 3. Funciones de Estilo ---
 def style_porcentaje_efectividad(columna, umbral=90):
-    return ['color: #388E3C' if valor >= umbral else 'color: #D32F2F' for valor in columna]
+    return colores_umbral(columna, umbral)
 
 def style_porcentaje_kpi(columna, umbral):
     """Aplica color verde si es >= umbral, si no, rojo."""
-    return ['color: #388E3C' if valor >= umbral else 'color: #D32F2F' for valor in columna]
+    return colores_umbral(columna, umbral)
 
 
 def format_timedelta(td: timedelta) -> str:
@@ -135,8 +132,29 @@ def format_timedelta(td: timedelta) -> str:
 # --- 4. Renderizadores de cada Página/Sección ---
 # ==============================================================================
 
+# --- CONSULTAS EN PARALELO ---
+def seccion_diferida(plan: PlanificadorConsultas, mensaje: str, funcion, dibujar, **kwargs):
+    """
+    Deja un marcador en la posición actual de la página y lanza la consulta en segundo plano.
+    Cuando llega el resultado, dibujar(df) rellena el marcador; si la consulta falla, el
+    marcador muestra el error y el resto de la página sigue cargando.
+    """
+    marcador = st.empty()
+    marcador.info(f"⏳ {mensaje}")
+
+    def al_terminar(resultado):
+        with marcador.container():
+            dibujar(resultado)
+
+    def al_fallar(error):
+        marcador.error(f"❌ No se pudo completar: {mensaje} ({error})")
+
+    plan.enviar(funcion.__name__, funcion, engine, al_terminar=al_terminar, al_fallar=al_fallar, **kwargs)
+
+
 def render_vista_general():
-    
+    plan = PlanificadorConsultas()
+
 # --- Contenedor para los filtros ---
     with st.container(border=True):
         col1, col2 = st.columns(2)
@@ -163,9 +181,7 @@ def render_vista_general():
                 )
 
     # --- Carga y filtrado de datos ---
-    with st.spinner("Calculando KPI Multiskill..."):
-        df_kpi_base = obtener_kpi_multiskill(engine, fecha_inicio=f_inicio_kpi, fecha_fin=f_fin_kpi)
-        
+    def dibujar_kpi_multiskill(df_kpi_base):
         if filtrar_propietario and propietarios_seleccionados:
             df_kpi = df_kpi_base[df_kpi_base['Propietario de Red'].str.lower().isin(propietarios_seleccionados)].copy()
         else:
@@ -176,72 +192,71 @@ def render_vista_general():
                 total_asignadas=('total_asignadas', 'sum'),
                 total_finalizadas=('total_finalizadas', 'sum')
             ).reset_index()
-            df_kpi_grouped['pct_efectividad'] = df_kpi_grouped.apply(
-                lambda row: (row['total_finalizadas'] / row['total_asignadas'] * 100) if row['total_asignadas'] > 0 else 0,
-                axis=1
-            )
+            df_kpi_grouped['pct_efectividad'] = porcentaje(df_kpi_grouped['total_finalizadas'], df_kpi_grouped['total_asignadas'])
         else:
             df_kpi_grouped = pd.DataFrame()
 
 
-    # --- Visualización ---
-    if df_kpi_grouped.empty:
-        st.info("No hay datos disponibles para los filtros seleccionados.")
-    else:
-        st.subheader("Efectividad por Empresa")
+        # --- Visualización ---
+        if df_kpi_grouped.empty:
+            st.info("No hay datos disponibles para los filtros seleccionados.")
+        else:
+            st.subheader("Efectividad por Empresa")
         
-        # --- INICIO DE LA CORRECIÓN ---
+            # --- INICIO DE LA CORRECIÓN ---
 
-        # 1. Ordenamos el DataFrame UNA SOLA VEZ y lo guardamos
-        df_kpi_sorted = df_kpi_grouped.sort_values(by="pct_efectividad", ascending=False)
+            # 1. Ordenamos el DataFrame UNA SOLA VEZ y lo guardamos
+            df_kpi_sorted = df_kpi_grouped.sort_values(by="pct_efectividad", ascending=False)
         
-        # Limpiamos el nombre de la empresa en el DataFrame ya ordenado
-        df_kpi_sorted["empresa_limpia"] = df_kpi_sorted["Empresa"].str.replace("(?i)data_diaria[_\\-]*", "", regex=True)
+            # Limpiamos el nombre de la empresa en el DataFrame ya ordenado
+            df_kpi_sorted["empresa_limpia"] = df_kpi_sorted["Empresa"].str.replace("(?i)data_diaria[_\\-]*", "", regex=True)
         
-        # 2. Usamos el DataFrame ORDENADO para crear las tarjetas de métricas
-        empresas = df_kpi_sorted.to_dict('records')
+            # 2. Usamos el DataFrame ORDENADO para crear las tarjetas de métricas
+            empresas = df_kpi_sorted.to_dict('records')
         
-        # --- FIN DE LA CORRECIÓN ---
-
-        cols_por_fila = 4
-        filas = math.ceil(len(empresas) / cols_por_fila)
-
-        for i in range(filas):
-            chunk = empresas[i * cols_por_fila : (i + 1) * cols_por_fila]
-            cols = st.columns(len(chunk))
-            for col, data_empresa in zip(cols, chunk):
-                with col:
-                    pct = data_empresa["pct_efectividad"]
-                    color = "#388E3C" if pct >= 95 else "#F57C00" if pct >= 90 else "#D32F2F"
-                    st.markdown(f"""
-                    <div class="metric-card">
-                        <div class="metric-card-title">{data_empresa["empresa_limpia"]}</div>
-                        <div class="metric-card-value">{data_empresa["total_finalizadas"]:,} / {data_empresa["total_asignadas"]:,}</div>
-                        <div class="metric-card-delta" style="color:{color};">{pct:.1f}%</div>
-                    </div>
-                    """, unsafe_allow_html=True)
+            # --- FIN DE LA CORRECIÓN ---
+
+            cols_por_fila = 4
+            filas = math.ceil(len(empresas) / cols_por_fila)
+
+            for i in range(filas):
+                chunk = empresas[i * cols_por_fila : (i + 1) * cols_por_fila]
+                cols = st.columns(len(chunk))
+                for col, data_empresa in zip(cols, chunk):
+                    with col:
+                        pct = data_empresa["pct_efectividad"]
+                        color = "#388E3C" if pct >= 95 else "#F57C00" if pct >= 90 else "#D32F2F"
+                        st.markdown(f"""
+                        <div class="metric-card">
+                            <div class="metric-card-title">{data_empresa["empresa_limpia"]}</div>
+                            <div class="metric-card-value">{data_empresa["total_finalizadas"]:,} / {data_empresa["total_asignadas"]:,}</div>
+                            <div class="metric-card-delta" style="color:{color};">{pct:.1f}%</div>
+                        </div>
+                        """, unsafe_allow_html=True)
         
-        st.markdown("---")
-        st.subheader("Gráfico Comparativo de Efectividad Multiskill")
-
-        # --- INICIO DE LA CORRECIÓN ---
-        # 3. Usamos el DataFrame ORDENADO para el gráfico y para las etiquetas de texto
-        fig_kpi = px.bar(
-            df_kpi_sorted, # <-- Usamos el DF ordenado
-            x="empresa_limpia", 
-            y="pct_efectividad",
-            text=df_kpi_sorted["pct_efectividad"].apply(lambda x: f"{x:.2f}%"), # <-- Usamos el DF ordenado
-            color="empresa_limpia", 
-            title="📈 Porcentaje de Efectividad Multiskill por Empresa",
-            color_discrete_sequence=px.colors.qualitative.Plotly
-        )
-        # --- FIN DE LA CORRECIÓN ---
+            st.markdown("---")
+            st.subheader("Gráfico Comparativo de Efectividad Multiskill")
+
+            # --- INICIO DE LA CORRECIÓN ---
+            # 3. Usamos el DataFrame ORDENADO para el gráfico y para las etiquetas de texto
+            fig_kpi = px.bar(
+                df_kpi_sorted, # <-- Usamos el DF ordenado
+                x="empresa_limpia", 
+                y="pct_efectividad",
+                text=df_kpi_sorted["pct_efectividad"].apply(lambda x: f"{x:.2f}%"), # <-- Usamos el DF ordenado
+                color="empresa_limpia", 
+                title="📈 Porcentaje de Efectividad Multiskill por Empresa",
+                color_discrete_sequence=px.colors.qualitative.Plotly
+            )
+            # --- FIN DE LA CORRECIÓN ---
 
-        fig_kpi.update_traces(textposition="outside")
-        fig_kpi.update_layout(xaxis_title=None, yaxis_title="% Efectividad", showlegend=False, yaxis=dict(range=[0, 105]))
-        st.plotly_chart(fig_kpi, use_container_width=True)
+            fig_kpi.update_traces(textposition="outside")
+            fig_kpi.update_layout(xaxis_title=None, yaxis_title="% Efectividad", showlegend=False, yaxis=dict(range=[0, 105]))
+            st.plotly_chart(fig_kpi, use_container_width=True)
 ############################ Mantencion y Provision General ####################################################################
-        st.markdown("---")
+            st.markdown("---")
+    seccion_diferida(plan, "Calculando KPI Multiskill...", obtener_kpi_multiskill, dibujar_kpi_multiskill,
+                     fecha_inicio=f_inicio_kpi, fecha_fin=f_fin_kpi)
     col_mant, col_prov = st.columns(2, gap="large")
     # --- KPI 2: VOLUMEN DE MANTENIMIENTO ---
     with col_mant:
@@ -254,45 +269,46 @@ def render_vista_general():
                 with col1: f_inicio_mant = st.date_input("Fecha inicio", value=datetime(2025, 1, 1), key="mant_start").strftime("%Y-%m-%d")
                 with col2: f_fin_mant = st.date_input("Fecha fin", value=datetime(2025, 12, 31), key="mant_end").strftime("%Y-%m-%d")
             
-            with st.spinner("Calculando KPI de Mantenimiento..."):
-                df_mantenimiento = obtener_kpi_mantencion (engine, fecha_inicio=f_inicio_mant, fecha_fin=f_fin_mant)
+            def dibujar_mantenimiento(df_mantenimiento):
             
-            if df_mantenimiento.empty:
-                st.info("No hay datos de mantenimiento para los filtros seleccionados.")
-            else:
-                df_mantenimiento["empresa_limpia"] = df_mantenimiento["empresa"].str.replace("(?i)data_diaria[_\\-]*", "", regex=True)
+                if df_mantenimiento.empty:
+                    st.info("No hay datos de mantenimiento para los filtros seleccionados.")
+                else:
+                    df_mantenimiento["empresa_limpia"] = df_mantenimiento["empresa"].str.replace("(?i)data_diaria[_\\-]*", "", regex=True)
                 
-                st.write("**Tabla de Efectividad por Empresa**")
-                # Aplicamos estilo a la tabla
-                styled_df = df_mantenimiento.style.apply(
-                    style_porcentaje_efectividad, 
-                    subset=['pct_efectividad']
-                ).format({
-                    'pct_efectividad': '{:.2f}%',
-                    'total_asignadas': '{:,}',
-                    'total_finalizadas': '{:,}'
-                })
-                st.dataframe(styled_df, use_container_width=True, hide_index=True)
-
-                st.write("**Gráfico Comparativo de Efectividad**")
-                # Creamos una columna para el color del gráfico
-                df_mantenimiento['color_efectividad'] = df_mantenimiento['pct_efectividad'].apply(lambda x: 'Sobre 90%' if x >= 90 else 'Bajo 90%')
-                # Justo antes de la línea fig_rec = px.bar(...)
+                    st.write("**Tabla de Efectividad por Empresa**")
+                    # Aplicamos estilo a la tabla
+                    styled_df = df_mantenimiento.style.apply(
+                        style_porcentaje_efectividad, 
+                        subset=['pct_efectividad']
+                    ).format({
+                        'pct_efectividad': '{:.2f}%',
+                        'total_asignadas': '{:,}',
+                        'total_finalizadas': '{:,}'
+                    })
+                    st.dataframe(styled_df, use_container_width=True, hide_index=True)
+
+                    st.write("**Gráfico Comparativo de Efectividad**")
+                    # Creamos una columna para el color del gráfico
+                    df_mantenimiento['color_efectividad'] = clasificar(df_mantenimiento['pct_efectividad'], 90, 'Sobre 90%', 'Bajo 90%')
+                    # Justo antes de la línea fig_rec = px.bar(...)
                 
-                fig_mant = px.bar(
-                    df_mantenimiento.sort_values("pct_efectividad", ascending=False),
-                    x="empresa_limpia", y="pct_efectividad",
-                    text=df_mantenimiento["pct_efectividad"].apply(lambda x: f"{x:.1f}%"),
-                    color='color_efectividad', # Usamos la nueva columna para el color
-                    color_discrete_map={ # Definimos los colores
-                        'Sobre 90%': '#388E3C',
-                        'Bajo 90%': '#D32F2F'
-                    },
-                    title="🔧 % de Efectividad en Mantenimiento por Empresa",
-                    labels={"empresa_limpia": "Empresa", "pct_efectividad": "% Efectividad"}
-                )
-                fig_mant.update_layout(yaxis={'range': [0,105]}, legend_title_text='Rendimiento')
-                st.plotly_chart(fig_mant, use_container_width=True)
+                    fig_mant = px.bar(
+                        df_mantenimiento.sort_values("pct_efectividad", ascending=False),
+                        x="empresa_limpia", y="pct_efectividad",
+                        text=df_mantenimiento["pct_efectividad"].apply(lambda x: f"{x:.1f}%"),
+                        color='color_efectividad', # Usamos la nueva columna para el color
+                        color_discrete_map={ # Definimos los colores
+                            'Sobre 90%': '#388E3C',
+                            'Bajo 90%': '#D32F2F'
+                        },
+                        title="🔧 % de Efectividad en Mantenimiento por Empresa",
+                        labels={"empresa_limpia": "Empresa", "pct_efectividad": "% Efectividad"}
+                    )
+                    fig_mant.update_layout(yaxis={'range': [0,105]}, legend_title_text='Rendimiento')
+                    st.plotly_chart(fig_mant, use_container_width=True)
+            seccion_diferida(plan, "Calculando KPI de Mantenimiento...", obtener_kpi_mantencion, dibujar_mantenimiento,
+                             fecha_inicio=f_inicio_mant, fecha_fin=f_fin_mant)
 
     with col_prov:
         st.subheader("Efectividad de Provisión")
@@ -304,40 +320,41 @@ def render_vista_general():
                 with col1: f_inicio_prov = st.date_input("Fecha inicio", value=datetime(2025, 1, 1), key="prov_start").strftime("%Y-%m-%d")
                 with col2: f_fin_prov = st.date_input("Fecha fin", value=datetime(2025, 12, 31), key="prov_end").strftime("%Y-%m-%d")
             
-            with st.spinner("Calculando KPI de Provisión..."):
-                df_provision = obtener_kpi_provision (engine, fecha_inicio=f_inicio_prov, fecha_fin=f_fin_prov)
+            def dibujar_provision(df_provision):
             
-            if df_provision.empty:
-                st.info("No hay datos de provisión para los filtros seleccionados.")
-            else:
-                df_provision["empresa_limpia"] = df_provision["empresa"].str.replace("(?i)data_diaria[_\\-]*", "", regex=True)
+                if df_provision.empty:
+                    st.info("No hay datos de provisión para los filtros seleccionados.")
+                else:
+                    df_provision["empresa_limpia"] = df_provision["empresa"].str.replace("(?i)data_diaria[_\\-]*", "", regex=True)
                 
-                st.write("**Tabla de Efectividad por Empresa**")
-                styled_df = df_provision.style.apply(
-                    style_porcentaje_kpi, 
-                    umbral=80, 
-                    subset=['pct_efectividad']
-                ).format({
-                    'pct_efectividad': '{:.2f}%',
-                    'total_asignadas': '{:,}',
-                    'total_finalizadas': '{:,}'
-                })
-                st.dataframe(styled_df, use_container_width=True, hide_index=True)
-
-                st.write("**Gráfico Comparativo de Efectividad**")
-                df_provision['color_efectividad'] = df_provision['pct_efectividad'].apply(lambda x: 'Sobre 80%' if x >= 80 else 'Bajo 80%')
+                    st.write("**Tabla de Efectividad por Empresa**")
+                    styled_df = df_provision.style.apply(
+                        style_porcentaje_kpi, 
+                        umbral=80, 
+                        subset=['pct_efectividad']
+                    ).format({
+                        'pct_efectividad': '{:.2f}%',
+                        'total_asignadas': '{:,}',
+                        'total_finalizadas': '{:,}'
+                    })
+                    st.dataframe(styled_df, use_container_width=True, hide_index=True)
+
+                    st.write("**Gráfico Comparativo de Efectividad**")
+                    df_provision['color_efectividad'] = clasificar(df_provision['pct_efectividad'], 80, 'Sobre 80%', 'Bajo 80%')
                 
-                fig_prov = px.bar(
-                    df_provision.sort_values("pct_efectividad", ascending=False),
-                    x="empresa_limpia", y="pct_efectividad",
-                    text=df_provision["pct_efectividad"].apply(lambda x: f"{x:.1f}%"),
-                    color='color_efectividad',
-                    color_discrete_map={'Sobre 80%': '#388E3C', 'Bajo 80%': '#D32F2F'},
-                    title="⚙️ % de Efectividad en Provisión por Empresa",
-                    labels={"empresa_limpia": "Empresa", "pct_efectividad": "% Efectividad"}
-                )
-                fig_prov.update_layout(yaxis={'range': [0,105]}, legend_title_text='Rendimiento')
-                st.plotly_chart(fig_prov, use_container_width=True)
+                    fig_prov = px.bar(
+                        df_provision.sort_values("pct_efectividad", ascending=False),
+                        x="empresa_limpia", y="pct_efectividad",
+                        text=df_provision["pct_efectividad"].apply(lambda x: f"{x:.1f}%"),
+                        color='color_efectividad',
+                        color_discrete_map={'Sobre 80%': '#388E3C', 'Bajo 80%': '#D32F2F'},
+                        title="⚙️ % de Efectividad en Provisión por Empresa",
+                        labels={"empresa_limpia": "Empresa", "pct_efectividad": "% Efectividad"}
+                    )
+                    fig_prov.update_layout(yaxis={'range': [0,105]}, legend_title_text='Rendimiento')
+                    st.plotly_chart(fig_prov, use_container_width=True)
+            seccion_diferida(plan, "Calculando KPI de Provisión...", obtener_kpi_provision, dibujar_provision,
+                             fecha_inicio=f_inicio_prov, fecha_fin=f_fin_prov)
 
 
 ################################ Resumen Reincidencias #######################################################
@@ -362,38 +379,51 @@ def render_vista_general():
                 f_fin_rec = fecha_fin_rec.strftime("%Y-%m-%d")
             # Si no se filtra, las fechas son None y la función traerá todo.
 
-            with st.spinner("Calculando resumen de reincidencias..."):
-                df_reincidencias = obtener_resumen_general_rt (engine, fecha_inicio=f_inicio_rec, fecha_fin=f_fin_rec)
+            def dibujar_reincidencias(df_reincidencias):
 
-            if df_reincidencias.empty:
-                st.info("No se encontraron reincidencias para el periodo indicado.")
-            else:
+                if df_reincidencias.empty:
+                    st.info("No se encontraron reincidencias para el periodo indicado.")
+                else:
                 
-                st.write("**📋Resumen de Reincidencias por Empresa**")
-
-                styled_df_reincidencias = df_reincidencias.style.apply(
-                        style_porcentaje, 
-                        umbral=4, 
-                        subset=['porcentaje_reincidencia']
-                ).format({
-                    'porcentaje_reincidencia': '{:.2f}%'
-                })
+                    st.write("**📋Resumen de Reincidencias por Empresa**")
+
+                    styled_df_reincidencias = df_reincidencias.style.apply(
+                            style_porcentaje, 
+                            umbral=4, 
+                            subset=['porcentaje_reincidencia']
+                    ).format({
+                        'porcentaje_reincidencia': '{:.2f}%'
+                    })
                 
-                # 3. Mostramos el DataFrame con estilo en lugar del original
-                st.dataframe(styled_df_reincidencias, hide_index=True, use_container_width=True)
+                    # 3. Mostramos el DataFrame con estilo en lugar del original
+                    st.dataframe(styled_df_reincidencias, hide_index=True, use_container_width=True)
                 
-                st.subheader("📈 Gráfico de Reincidencias")
-                # Gráfico de Reincidencias con el estilo unificado
-                df_reincidencias['rendimiento'] = df_reincidencias['porcentaje_reincidencia'].apply(lambda x: 'Sobre el Umbral (> 4%)' if x > 4 else 'Bajo el Umbral (<= 4%)')
-                fig_rec = px.bar(
-                    df_reincidencias.sort_values("porcentaje_reincidencia", ascending=True),
-                    x="empresa", y="porcentaje_reincidencia", text="porcentaje_reincidencia",
-                    color='rendimiento',
-                    color_discrete_map={'Sobre el Umbral (> 4%)': '#D32F2F', 'Bajo el Umbral (<= 4%)': '#388E3C'},
-                    title="📈 % Reincidencia por Empresa"
-                )
-                fig_rec.update_traces(texttemplate="%{text:.2f}%", textposition="outside")
-                st.plotly_chart(fig_rec, use_container_width=True)
+                    st.subheader("📈 Gráfico de Reincidencias")
+                    # Gráfico de Reincidencias con el estilo unificado
+                    df_reincidencias['rendimiento'] = clasificar(df_reincidencias['porcentaje_reincidencia'], 4, 'Sobre el Umbral (> 4%)', 'Bajo el Umbral (<= 4%)', incluye_umbral=False)
+                    fig_rec = px.bar(
+                        df_reincidencias.sort_values("porcentaje_reincidencia", ascending=True),
+                        x="empresa", y="porcentaje_reincidencia", text="porcentaje_reincidencia",
+                        color='rendimiento',
+                        color_discrete_map={'Sobre el Umbral (> 4%)': '#D32F2F', 'Bajo el Umbral (<= 4%)': '#388E3C'},
+                        title="📈 % Reincidencia por Empresa"
+                    )
+                    fig_rec.update_traces(texttemplate="%{text:.2f}%", textposition="outside")
+                    st.plotly_chart(fig_rec, use_container_width=True)
+            seccion_diferida(plan, "Calculando resumen de reincidencias...", obtener_resumen_general_rt, dibujar_reincidencias,
+                             fecha_inicio=f_inicio_rec, fecha_fin=f_fin_rec)
+
+            def dibujar_reincidencias_mensuales(df_mensual):
+                if not df_mensual.empty:
+                    st.write("**📅 Reincidencia Mensual por Empresa**")
+                    st.dataframe(
+                        df_mensual.style.apply(style_porcentaje, umbral=4).format('{:.2f}%', na_rep='-'),
+                        use_container_width=True
+                    )
+            # La matriz mensual necesita un rango: solo se muestra con el filtro de fechas activo
+            if filtrar_reinc:
+                seccion_diferida(plan, "Calculando reincidencia mensual...", obtener_matriz_mensual, dibujar_reincidencias_mensuales,
+                                 fecha_inicio=f_inicio_rec, fecha_fin=f_fin_rec, indicador="rt")
 
             
 ################################### Resumen Falle Temprana #############################################
@@ -411,71 +441,63 @@ def render_vista_general():
                 with col1_ft: f_inicio_ft = st.date_input("Fecha inicio", value=datetime(2025, 1, 1), key="ft_start").strftime("%Y-%m-%d")
                 with col2_ft: f_fin_ft = st.date_input("Fecha fin", value=datetime(2025, 12, 31), key="ft_end").strftime("%Y-%m-%d")
 
-            with st.spinner("Calculando resumen de fallas tempranas..."):
-                
-               
-                df_fallas = obtener_resumen_general_ft(
-                    engine, # Este es el _engine
-                    fecha_inicio=f_inicio_ft, # Este va a **kwargs
-                    fecha_fin=f_fin_ft # Este también va a **kwargs
-                )
+            def dibujar_fallas_tempranas(df_fallas):
 
-            if df_fallas.empty:
-                st.info("No se encontraron fallas tempranas para el periodo indicado.")
-            else:
-                st.write("**Resumen de Fallas Tempranas por Empresa**")
-                styled_df_fallas = df_fallas.style.apply(
-                style_porcentaje, 
-                umbral=3, # <-- El único cambio es este valor
-                subset=['porcentaje_falla']
-                ).format({
-                    'porcentaje_falla': '{:.2f}%'
-                })
-                st.dataframe(styled_df_fallas, hide_index=True, use_container_width=True)
+                if df_fallas.empty:
+                    st.info("No se encontraron fallas tempranas para el periodo indicado.")
+                else:
+                    st.write("**Resumen de Fallas Tempranas por Empresa**")
+                    styled_df_fallas = df_fallas.style.apply(
+                    style_porcentaje, 
+                    umbral=3, # <-- El único cambio es este valor
+                    subset=['porcentaje_falla']
+                    ).format({
+                        'porcentaje_falla': '{:.2f}%'
+                    })
+                    st.dataframe(styled_df_fallas, hide_index=True, use_container_width=True)
                 
                 
                 
-                st.subheader("Grafico de Fallas Tempranas")
-                df_fallas['rendimiento'] = df_fallas['porcentaje_falla'].apply(lambda x: 'Sobre el Umbral (> 3%)' if x > 3 else 'Bajo el Umbral (<= 3%)')
-                fig_ft = px.bar(
-                    df_fallas.sort_values("porcentaje_falla", ascending=True),
-                    x="empresa", y="porcentaje_falla", text="porcentaje_falla",
-                    color='rendimiento',
-                    color_discrete_map={'Sobre el Umbral (> 3%)': '#D32F2F', 'Bajo el Umbral (<= 3%)': '#388E3C'},
-                    title="📉 % Fallas Tempranas por Empresa"
-                )
-                fig_ft.update_traces(texttemplate="%{text:.2f}%", textposition="outside")
-                st.plotly_chart(fig_ft, use_container_width=True)
+                    st.subheader("Grafico de Fallas Tempranas")
+                    df_fallas['rendimiento'] = clasificar(df_fallas['porcentaje_falla'], 3, 'Sobre el Umbral (> 3%)', 'Bajo el Umbral (<= 3%)', incluye_umbral=False)
+                    fig_ft = px.bar(
+                        df_fallas.sort_values("porcentaje_falla", ascending=True),
+                        x="empresa", y="porcentaje_falla", text="porcentaje_falla",
+                        color='rendimiento',
+                        color_discrete_map={'Sobre el Umbral (> 3%)': '#D32F2F', 'Bajo el Umbral (<= 3%)': '#388E3C'},
+                        title="📉 % Fallas Tempranas por Empresa"
+                    )
+                    fig_ft.update_traces(texttemplate="%{text:.2f}%", textposition="outside")
+                    st.plotly_chart(fig_ft, use_container_width=True)
+            seccion_diferida(plan, "Calculando resumen de fallas tempranas...", obtener_resumen_general_ft, dibujar_fallas_tempranas,
+                             fecha_inicio=f_inicio_ft, fecha_fin=f_fin_ft)
 
     st.markdown("---")
-    with st.spinner("Calculando distribución de reincidencias..."):
-        df_distribucion = obtener_distribucion_reincidencias(
-            engine, 
-            fecha_inicio=str(f_inicio_global), 
-            fecha_fin=str(f_fin_global)
-        )
+    def dibujar_distribucion(df_distribucion):
 
-    if df_distribucion.empty:
-        st.info("No se encontraron reincidencias en el período seleccionado para analizar su distribución.")
-    else:
-        # Calculamos el total para poder sacar los porcentajes
-        total_reincidencias = df_distribucion['total_reincidencias'].sum()
+        if df_distribucion.empty:
+            st.info("No se encontraron reincidencias en el período seleccionado para analizar su distribución.")
+        else:
+            # Calculamos el total para poder sacar los porcentajes
+            total_reincidencias = df_distribucion['total_reincidencias'].sum()
         
-        # Creamos el texto HTML dinámicamente
-        texto_kpi = '<div style="font-size: 17px; line-height: 1.8;"><ul>'
+            # Creamos el texto HTML dinámicamente
+            texto_kpi = '<div style="font-size: 17px; line-height: 1.8;"><ul>'
         
-        for index, row in df_distribucion.iterrows():
-            actividad = row['tipo_actividad'].replace('-', ' ').title()
-            conteo = row['total_reincidencias']
-            # Calculamos el porcentaje para esta actividad
-            porcentaje = (conteo / total_reincidencias * 100) if total_reincidencias > 0 else 0
+            for index, row in df_distribucion.iterrows():
+                actividad = row['tipo_actividad'].replace('-', ' ').title()
+                conteo = row['total_reincidencias']
+                # Calculamos el porcentaje para esta actividad
+                porcentaje = (conteo / total_reincidencias * 100) if total_reincidencias > 0 else 0
             
-            texto_kpi += f"<li>El <b>{porcentaje:.1f}%</b> de las reincidencias pertenece a <b>'{actividad}'</b> ({conteo:,} casos).</li>"
+                texto_kpi += f"<li>El <b>{porcentaje:.1f}%</b> de las reincidencias pertenece a <b>'{actividad}'</b> ({conteo:,} casos).</li>"
             
-        texto_kpi += '</ul></div>'
+            texto_kpi += '</ul></div>'
         
-        # Mostramos el resultado final en la app
-        st.markdown(texto_kpi, unsafe_allow_html=True)
+            # Mostramos el resultado final en la app
+            st.markdown(texto_kpi, unsafe_allow_html=True)
+    seccion_diferida(plan, "Calculando distribución de reincidencias...", obtener_distribucion_reincidencias, dibujar_distribucion,
+                     fecha_inicio=str(f_inicio_global), fecha_fin=str(f_fin_global))
 
 
 ################################### Certificacion#############################################################
@@ -495,56 +517,57 @@ def render_vista_general():
             with col2: 
                 f_fin_cert = st.date_input("Fecha fin", value=datetime(2025, 12, 31), key="cert_end").strftime("%Y-%m-%d")
         
-        with st.spinner("Calculando KPI de Certificación..."):
-            df_cert = obtener_kpi_certificacion (engine, fecha_inicio=f_inicio_cert, fecha_fin=f_fin_cert)
+        def dibujar_certificacion(df_cert):
         
-        if df_cert.empty:
-            st.info("No hay datos de certificación para los filtros seleccionados.")
-        else:
-            df_cert["empresa_limpia"] = df_cert["empresa"].str.replace("(?i)data_diaria[_\\-]*", "", regex=True)
+            if df_cert.empty:
+                st.info("No hay datos de certificación para los filtros seleccionados.")
+            else:
+                df_cert["empresa_limpia"] = df_cert["empresa"].str.replace("(?i)data_diaria[_\\-]*", "", regex=True)
             
-            st.write("**Ranking de Certificación por Empresa**")
+                st.write("**Ranking de Certificación por Empresa**")
             
-            # Renombramos y ordenamos la tabla para mostrarla
-            df_display = df_cert.rename(columns={
-                "empresa_limpia": "Empresa", "total_finalizadas": "Total Finalizadas",
-                "certificadas": "Certificadas", "porcentaje_certificacion": "Porcentaje (%)"
-            }).sort_values(by="Certificadas", ascending=False) # Ordenamos por cantidad
+                # Renombramos y ordenamos la tabla para mostrarla
+                df_display = df_cert.rename(columns={
+                    "empresa_limpia": "Empresa", "total_finalizadas": "Total Finalizadas",
+                    "certificadas": "Certificadas", "porcentaje_certificacion": "Porcentaje (%)"
+                }).sort_values(by="Certificadas", ascending=False) # Ordenamos por cantidad
             
-            st.dataframe(df_display, use_container_width=True, hide_index=True)
+                st.dataframe(df_display, use_container_width=True, hide_index=True)
             
-            st.write("**Gráfico Comparativo de Porcentaje de Certificación**")
-
-            # --- INICIO DE LA CORRECCIÓN FINAL ---
-
-            # 1. Creamos un DataFrame específicamente ordenado por el porcentaje para el gráfico.
-            df_grafico_ordenado = df_cert.sort_values("porcentaje_certificacion", ascending=False)
-
-            # 2. Usamos este DataFrame ORDENADO para todo: para las barras y para las etiquetas.
-            fig_cert = px.bar(
-                df_grafico_ordenado,  # <-- Usamos los datos ordenados
-                x="empresa_limpia", 
-                y="porcentaje_certificacion",
-                # Usamos LA MISMA fuente de datos ordenada para el texto
-                text=df_grafico_ordenado["porcentaje_certificacion"].apply(lambda x: f"{x:.1f}%"), 
-                color="empresa_limpia",
-                title="✅ Porcentaje de Trabajos Certificados por Empresa",
-                labels={"empresa_limpia": "Empresa", "porcentaje_certificacion": "% Certificado"}
-            )
+                st.write("**Gráfico Comparativo de Porcentaje de Certificación**")
+
+                # --- INICIO DE LA CORRECCIÓN FINAL ---
+
+                # 1. Creamos un DataFrame específicamente ordenado por el porcentaje para el gráfico.
+                df_grafico_ordenado = df_cert.sort_values("porcentaje_certificacion", ascending=False)
+
+                # 2. Usamos este DataFrame ORDENADO para todo: para las barras y para las etiquetas.
+                fig_cert = px.bar(
+                    df_grafico_ordenado,  # <-- Usamos los datos ordenados
+                    x="empresa_limpia", 
+                    y="porcentaje_certificacion",
+                    # Usamos LA MISMA fuente de datos ordenada para el texto
+                    text=df_grafico_ordenado["porcentaje_certificacion"].apply(lambda x: f"{x:.1f}%"), 
+                    color="empresa_limpia",
+                    title="✅ Porcentaje de Trabajos Certificados por Empresa",
+                    labels={"empresa_limpia": "Empresa", "porcentaje_certificacion": "% Certificado"}
+                )
 
-            # 3. Forzamos el orden del eje X para que coincida con el DataFrame
-            fig_cert.update_xaxes(categoryorder='array', categoryarray=df_grafico_ordenado['empresa_limpia'])
+                # 3. Forzamos el orden del eje X para que coincida con el DataFrame
+                fig_cert.update_xaxes(categoryorder='array', categoryarray=df_grafico_ordenado['empresa_limpia'])
 
-            # 4. Actualizamos otros detalles del layout
-            fig_cert.update_layout(
-                yaxis={'range': [0,105]}, 
-                xaxis_title=None, 
-                showlegend=False
-            )
-            fig_cert.update_traces(textposition="outside")
+                # 4. Actualizamos otros detalles del layout
+                fig_cert.update_layout(
+                    yaxis={'range': [0,105]}, 
+                    xaxis_title=None, 
+                    showlegend=False
+                )
+                fig_cert.update_traces(textposition="outside")
 
-            st.plotly_chart(fig_cert, use_container_width=True)
-            # --- FIN DE LA CORRECCIÓN FINAL ---
+                st.plotly_chart(fig_cert, use_container_width=True)
+                # --- FIN DE LA CORRECCIÓN FINAL ---
+        seccion_diferida(plan, "Calculando KPI de Certificación...", obtener_kpi_certificacion, dibujar_certificacion,
+                         fecha_inicio=f_inicio_cert, fecha_fin=f_fin_cert)
 
 ##################################ranking de balance de empresas####################################
     st.markdown("---")
@@ -571,67 +594,64 @@ def render_vista_general():
     else:
         st.info("Mostrando datos de todo el historial. Active el filtro de arriba para un período específico.")
     
-    with st.spinner("Calculando ranking de empresas..."):
-        df_ranking_empresas = obtener_ranking_empresas( 
-            engine, 
-            fecha_inicio=f_inicio_para_query, 
-            fecha_fin=f_fin_para_query
-        )
+    def dibujar_ranking_empresas(df_ranking_empresas):
     
-    if df_ranking_empresas.empty:
-        st.info("No hay datos para generar el ranking de empresas en el período seleccionado.")
-    else:
-        df_ranking_empresas.index = ["🥇", "🥈", "🥉"] + [f"#{i}" for i in range(4, len(df_ranking_empresas) + 1)]
-        df_ranking_empresas['Puntaje'] = df_ranking_empresas['puntaje_final'].apply(lambda x: f"{x:.1f} pts")
+        if df_ranking_empresas.empty:
+            st.info("No hay datos para generar el ranking de empresas en el período seleccionado.")
+        else:
+            df_ranking_empresas.index = ["🥇", "🥈", "🥉"] + [f"#{i}" for i in range(4, len(df_ranking_empresas) + 1)]
+            df_ranking_empresas['Puntaje'] = df_ranking_empresas['puntaje_final'].apply(lambda x: f"{x:.1f} pts")
         
-        # Seleccionamos las columnas más relevantes para mostrar
-        columnas_a_mostrar = ['Empresa', 'Puntaje', 'total_reparaciones', 'total_instalaciones', 'pct_reincidencia', 'pct_falla_temprana', 'pct_certificacion']
-        df_ranking_empresas['Empresa'] = df_ranking_empresas['Empresa'].str.replace("(?i)data_diaria[_\\-]*", "", regex=True)
+            # Seleccionamos las columnas más relevantes para mostrar
+            columnas_a_mostrar = ['Empresa', 'Puntaje', 'total_reparaciones', 'total_instalaciones', 'pct_reincidencia', 'pct_falla_temprana', 'pct_certificacion']
+            df_ranking_empresas['Empresa'] = df_ranking_empresas['Empresa'].str.replace("(?i)data_diaria[_\\-]*", "", regex=True)
         
-        st.dataframe(
-            df_ranking_empresas[columnas_a_mostrar].rename(columns={"pct_reincidencia": "% Reinc.", "pct_falla_temprana": "% F.T.", "pct_certificacion": "% Cert."}),
-            use_container_width=True
-        )
+            st.dataframe(
+                df_ranking_empresas[columnas_a_mostrar].rename(columns={"pct_reincidencia": "% Reinc.", "pct_falla_temprana": "% F.T.", "pct_certificacion": "% Cert."}),
+                use_container_width=True
+            )
 
-        # --- INICIO DE LA CORRECCIÓN ---
+            # --- INICIO DE LA CORRECCIÓN ---
 
-        # 1. Creamos la columna 'empresa_limpia'
-        df_ranking_empresas['empresa_limpia'] = df_ranking_empresas['Empresa'].str.replace("(?i)data_diaria[_\\-]*", "", regex=True)
+            # 1. Creamos la columna 'empresa_limpia'
+            df_ranking_empresas['empresa_limpia'] = df_ranking_empresas['Empresa'].str.replace("(?i)data_diaria[_\\-]*", "", regex=True)
         
-        # 2. Preparamos el índice y la columna de puntaje
-        df_ranking_empresas.index = ["🥇", "🥈", "🥉"] + [f"#{i}" for i in range(4, len(df_ranking_empresas) + 1)]
-        df_ranking_empresas['Puntaje'] = df_ranking_empresas['puntaje_final'].apply(lambda x: f"{x:.1f} pts")
+            # 2. Preparamos el índice y la columna de puntaje
+            df_ranking_empresas.index = ["🥇", "🥈", "🥉"] + [f"#{i}" for i in range(4, len(df_ranking_empresas) + 1)]
+            df_ranking_empresas['Puntaje'] = df_ranking_empresas['puntaje_final'].apply(lambda x: f"{x:.1f} pts")
         
-        # 3. Definimos la lista de columnas que queremos con sus NOMBRES ORIGINALES
-        columnas_a_mostrar = ['empresa_limpia', 'Puntaje', 'total_reparaciones', 'total_instalaciones', 'pct_reincidencia', 'pct_falla_temprana', 'pct_certificacion']
+            # 3. Definimos la lista de columnas que queremos con sus NOMBRES ORIGINALES
+            columnas_a_mostrar = ['empresa_limpia', 'Puntaje', 'total_reparaciones', 'total_instalaciones', 'pct_reincidencia', 'pct_falla_temprana', 'pct_certificacion']
         
-        # 4. PRIMERO seleccionamos el subconjunto de columnas
-        df_display = df_ranking_empresas[columnas_a_mostrar]
-
-        # 5. LUEGO, a ese subconjunto, le cambiamos el nombre a las columnas para la visualización
-        df_display_renamed = df_display.rename(columns={
-            "empresa_limpia": "Empresa", 
-            "pct_reincidencia": "% Reinc.", 
-            "pct_falla_temprana": "% F.T.", 
-            "pct_certificacion": "% Cert."
-        })
-
-        st.write("**Gráfico de Ranking por Puntaje Final**")
+            # 4. PRIMERO seleccionamos el subconjunto de columnas
+            df_display = df_ranking_empresas[columnas_a_mostrar]
+
+            # 5. LUEGO, a ese subconjunto, le cambiamos el nombre a las columnas para la visualización
+            df_display_renamed = df_display.rename(columns={
+                "empresa_limpia": "Empresa", 
+                "pct_reincidencia": "% Reinc.", 
+                "pct_falla_temprana": "% F.T.", 
+                "pct_certificacion": "% Cert."
+            })
+
+            st.write("**Gráfico de Ranking por Puntaje Final**")
         
-        fig_ranking = px.bar(
-            df_ranking_empresas, # Usamos el DataFrame con la columna 'empresa_limpia'
-            x="puntaje_final",
-            y="empresa_limpia",
-            orientation='h',
-            text=df_ranking_empresas["puntaje_final"].apply(lambda x: f"{x:.1f}"),
-            title="🏆 Puntaje General por Empresa",
-            labels={"empresa_limpia": "Empresa", "puntaje_final": "Puntaje Final"}
-        )
-        fig_ranking.update_yaxes(categoryorder='total ascending')
-        fig_ranking.update_traces(textposition="outside")
-        fig_ranking.update_layout(showlegend=False)
+            fig_ranking = px.bar(
+                df_ranking_empresas, # Usamos el DataFrame con la columna 'empresa_limpia'
+                x="puntaje_final",
+                y="empresa_limpia",
+                orientation='h',
+                text=df_ranking_empresas["puntaje_final"].apply(lambda x: f"{x:.1f}"),
+                title="🏆 Puntaje General por Empresa",
+                labels={"empresa_limpia": "Empresa", "puntaje_final": "Puntaje Final"}
+            )
+            fig_ranking.update_yaxes(categoryorder='total ascending')
+            fig_ranking.update_traces(textposition="outside")
+            fig_ranking.update_layout(showlegend=False)
         
-        st.plotly_chart(fig_ranking, use_container_width=True)
+            st.plotly_chart(fig_ranking, use_container_width=True)
+    seccion_diferida(plan, "Calculando ranking de empresas...", obtener_ranking_empresas, dibujar_ranking_empresas,
+                     fecha_inicio=f_inicio_para_query, fecha_fin=f_fin_para_query)
 ########################################rankig de tecncicos##############################################
     st.markdown("---")
 
@@ -659,111 +679,105 @@ def render_vista_general():
     else:
         st.info("Mostrando ranking de todo el historial. Active el filtro para un período específico.")
 
-    with st.spinner("Calculando ranking de técnicos..."):
-        df_ranking = obtener_ranking_tecnicos( 
-            engine, 
-            fecha_inicio=f_inicio_para_query, 
-            fecha_fin=f_fin_para_query
-        )
+    def dibujar_ranking_tecnicos(df_ranking):
     
-    if df_ranking.empty:
-        st.info("No hay suficientes datos para generar el ranking en el período seleccionado.")
-    else:
-        # Añadir medallas para el Top 3
-        df_ranking.index = ["🥇", "🥈", "🥉"] + [f"#{i}" for i in range(4, len(df_ranking) + 1)]
-        df_ranking['Puntaje'] = df_ranking['puntaje_final'].apply(lambda x: f"{x:.1f} pts")
-        st.dataframe(
-            df_ranking[['Recurso', 'Empresa', 'Puntaje']],
-            use_container_width=True
-        )
+        if df_ranking.empty:
+            st.info("No hay suficientes datos para generar el ranking en el período seleccionado.")
+        else:
+            # Añadir medallas para el Top 3
+            df_ranking.index = ["🥇", "🥈", "🥉"] + [f"#{i}" for i in range(4, len(df_ranking) + 1)]
+            df_ranking['Puntaje'] = df_ranking['puntaje_final'].apply(lambda x: f"{x:.1f} pts")
+            st.dataframe(
+                df_ranking[['Recurso', 'Empresa', 'Puntaje']],
+                use_container_width=True
+            )
+    seccion_diferida(plan, "Calculando ranking de técnicos...", obtener_ranking_tecnicos, dibujar_ranking_tecnicos,
+                     fecha_inicio=f_inicio_para_query, fecha_fin=f_fin_para_query)
 
 
 ############################# Instalacion y Reparacion por Comuna  #########################################################
-        st.markdown("---")
-        st.subheader("Distribucion de Trabajo por Comuna")
-        with st.expander("📅 Aplicar Filtro de Fecha General", expanded=True):
-                col_f1, col_f2 = st.columns(2)
-                with col_f1:
-                    f_inicio = st.date_input("Fecha de Inicio General", value=datetime.now().date() - timedelta(days=30),key="comuna_start")
-                with col_f2:
-                    f_fin = st.date_input("Fecha de Fin General", value=datetime.now().date(), key="comuna_end")
-                f_inicio_str = f_inicio.strftime("%Y-%m-%d")
-                f_fin_str = f_fin.strftime("%Y-%m-%d")
-         
-
-            # --- NUEVA SECCIÓN: VOLUMEN POR COMUNA ---
-        
-        col_reparaciones, col_instalaciones = st.columns(2, gap="large")
-
-        with col_reparaciones:
-            with st.container(border=True):
-                st.markdown("<h5 style='text-align: center;'>Top Comunas por Reparaciones</h5>", unsafe_allow_html=True)
-                # Filtro opcional para este gráfico
-            filtrar_rep = st.checkbox("Filtrar por fecha", value=False, key="check_rep_comuna")
-            f_inicio_rep, f_fin_rep = None, None
-            if filtrar_rep:
-                c1, c2 = st.columns(2)
-                with c1: f_inicio_rep = st.date_input("Inicio", value=datetime.now() - timedelta(days=30), key="rep_comuna_start").strftime("%Y-%m-%d")
-                with c2: f_fin_rep = st.date_input("Fin", value=datetime.now(), key="rep_comuna_end").strftime("%Y-%m-%d")
-
-            with st.spinner("Calculando..."):
-                df_rep_comuna = obtener_reparaciones_por_comuna (engine, fecha_inicio=f_inicio_rep, fecha_fin=f_fin_rep)
-                
-                if df_rep_comuna.empty:
-                    st.info("No hay datos de reparaciones.")
-                else:
-                    # Mostramos tabla y gráfico del Top 15
-                    st.dataframe(df_rep_comuna.head(15), hide_index=True, use_container_width=True)
-                    fig = px.bar(df_rep_comuna.head(15).sort_values("total_reparaciones", ascending=True), 
-                                x="total_reparaciones", y="comuna", orientation='h', text="total_reparaciones")
-                    fig.update_layout(height=400, showlegend=False, xaxis_title="Total Reparaciones", yaxis_title="Comuna")
-                    st.plotly_chart(fig, use_container_width=True)
+    st.markdown("---")
+    st.subheader("Distribucion de Trabajo por Comuna")
+    with st.expander("📅 Aplicar Filtro de Fecha General", expanded=True):
+            col_f1, col_f2 = st.columns(2)
+            with col_f1:
+                f_inicio = st.date_input("Fecha de Inicio General", value=datetime.now().date() - timedelta(days=30),key="comuna_start")
+            with col_f2:
+                f_fin = st.date_input("Fecha de Fin General", value=datetime.now().date(), key="comuna_end")
+            f_inicio_str = f_inicio.strftime("%Y-%m-%d")
+            f_fin_str = f_fin.strftime("%Y-%m-%d")
+     
 
-        with col_instalaciones:
-            with st.container(border=True):
-                st.markdown("<h5 style='text-align: center;'>Top Comunas por Instalaciones y Postventa</h5>", unsafe_allow_html=True)
-            filtrar_inst = st.checkbox("Filtrar por fecha", value=False, key="check_inst_comuna")
-            f_inicio_inst, f_fin_inst = None, None
-            if filtrar_inst:
-                c1, c2 = st.columns(2)
-                with c1: f_inicio_inst = st.date_input("Inicio", value=datetime.now() - timedelta(days=30), key="inst_comuna_start").strftime("%Y-%m-%d")
-                with c2: f_fin_inst = st.date_input("Fin", value=datetime.now(), key="inst_comuna_end").strftime("%Y-%m-%d")
-
-            with st.spinner("Calculando..."):
-                df_inst_comuna = obtener_instalaciones_por_comuna (engine, fecha_inicio=f_inicio_inst, fecha_fin=f_fin_inst)
-                    
-                if df_inst_comuna.empty:
-                    st.info("No hay datos de instalaciones.")
-                else:
-                    # Mostramos tabla y gráfico del Top 15
-                    st.dataframe(df_inst_comuna.head(15), hide_index=True, use_container_width=True)
-                    fig = px.bar(df_inst_comuna.head(15).sort_values("total_instalaciones", ascending=True), 
-                                x="total_instalaciones", y="comuna", orientation='h', text="total_instalaciones")
-                    fig.update_layout(height=400, showlegend=False, xaxis_title="Total Instalaciones", yaxis_title="Comuna")
-                    st.plotly_chart(fig, use_container_width=True)
+        # --- NUEVA SECCIÓN: VOLUMEN POR COMUNA ---
+    
+    col_reparaciones, col_instalaciones = st.columns(2, gap="large")
 
+    with col_reparaciones:
+        with st.container(border=True):
+            st.markdown("<h5 style='text-align: center;'>Top Comunas por Reparaciones</h5>", unsafe_allow_html=True)
+            # Filtro opcional para este gráfico
+        filtrar_rep = st.checkbox("Filtrar por fecha", value=False, key="check_rep_comuna")
+        f_inicio_rep, f_fin_rep = None, None
+        if filtrar_rep:
+            c1, c2 = st.columns(2)
+            with c1: f_inicio_rep = st.date_input("Inicio", value=datetime.now() - timedelta(days=30), key="rep_comuna_start").strftime("%Y-%m-%d")
+            with c2: f_fin_rep = st.date_input("Fin", value=datetime.now(), key="rep_comuna_end").strftime("%Y-%m-%d")
 
-        st.header("🖼️ Vista General: Análisis de Calidad por Comuna")
+        def dibujar_reparaciones_comuna(df_rep_comuna):
             
+            if df_rep_comuna.empty:
+                st.info("No hay datos de reparaciones.")
+            else:
+                # Mostramos tabla y gráfico del Top 15
+                st.dataframe(df_rep_comuna.head(15), hide_index=True, use_container_width=True)
+                fig = px.bar(df_rep_comuna.head(15).sort_values("total_reparaciones", ascending=True), 
+                            x="total_reparaciones", y="comuna", orientation='h', text="total_reparaciones")
+                fig.update_layout(height=400, showlegend=False, xaxis_title="Total Reparaciones", yaxis_title="Comuna")
+                st.plotly_chart(fig, use_container_width=True)
+        seccion_diferida(plan, "Calculando...", obtener_reparaciones_por_comuna, dibujar_reparaciones_comuna,
+                         fecha_inicio=f_inicio_rep, fecha_fin=f_fin_rep)
+
+    with col_instalaciones:
         with st.container(border=True):
-            st.subheader("Filtros")
-            col_f1, col_f2, col_f3 = st.columns([2, 2, 1])
-            with col_f1:
-                f_inicio = st.date_input("Fecha de Inicio", value=datetime.now().date() - timedelta(days=90))
-            with col_f2:
-                f_fin = st.date_input("Fecha de Fin", value=datetime.now().date())
-            with col_f3:
-                top_n = st.number_input("Mostrar Top N Comunas:", min_value=3, max_value=50, value=5, step=1)
-
-        with st.spinner("Calculando datos por comuna..."):
-            df_stats = obtener_stats_calidad_por_comuna( 
-                engine, 
-                fecha_inicio=f_inicio.strftime("%Y-%m-%d"), 
-                fecha_fin=f_fin.strftime("%Y-%m-%d")
-            )
+            st.markdown("<h5 style='text-align: center;'>Top Comunas por Instalaciones y Postventa</h5>", unsafe_allow_html=True)
+        filtrar_inst = st.checkbox("Filtrar por fecha", value=False, key="check_inst_comuna")
+        f_inicio_inst, f_fin_inst = None, None
+        if filtrar_inst:
+            c1, c2 = st.columns(2)
+            with c1: f_inicio_inst = st.date_input("Inicio", value=datetime.now() - timedelta(days=30), key="inst_comuna_start").strftime("%Y-%m-%d")
+            with c2: f_fin_inst = st.date_input("Fin", value=datetime.now(), key="inst_comuna_end").strftime("%Y-%m-%d")
 
-        st.markdown("---")
+        def dibujar_instalaciones_comuna(df_inst_comuna):
+                
+            if df_inst_comuna.empty:
+                st.info("No hay datos de instalaciones.")
+            else:
+                # Mostramos tabla y gráfico del Top 15
+                st.dataframe(df_inst_comuna.head(15), hide_index=True, use_container_width=True)
+                fig = px.bar(df_inst_comuna.head(15).sort_values("total_instalaciones", ascending=True), 
+                            x="total_instalaciones", y="comuna", orientation='h', text="total_instalaciones")
+                fig.update_layout(height=400, showlegend=False, xaxis_title="Total Instalaciones", yaxis_title="Comuna")
+                st.plotly_chart(fig, use_container_width=True)
+        seccion_diferida(plan, "Calculando...", obtener_instalaciones_por_comuna, dibujar_instalaciones_comuna,
+                         fecha_inicio=f_inicio_inst, fecha_fin=f_fin_inst)
+
+
+    st.header("🖼️ Vista General: Análisis de Calidad por Comuna")
+        
+    with st.container(border=True):
+        st.subheader("Filtros")
+        col_f1, col_f2, col_f3 = st.columns([2, 2, 1])
+        with col_f1:
+            f_inicio = st.date_input("Fecha de Inicio", value=datetime.now().date() - timedelta(days=90))
+        with col_f2:
+            f_fin = st.date_input("Fecha de Fin", value=datetime.now().date())
+        with col_f3:
+            top_n = st.number_input("Mostrar Top N Comunas:", min_value=3, max_value=50, value=5, step=1)
+
+
+    st.markdown("---")
 
+    def dibujar_calidad_comuna(df_stats):
         if df_stats.empty:
             st.info("No se encontraron datos de calidad para los filtros seleccionados.")
         else:
@@ -775,7 +789,7 @@ def render_vista_general():
             for index, row in ranking_comunas.iterrows():
                 comuna_actual = row['comuna']
                 total_problemas_comuna = row['problemas_totales']
-                
+            
                 with st.expander(f"📍 **{comuna_actual}** - {int(total_problemas_comuna)} Incidencias Totales (Reincidencias + Fallas)"):
                     df_filtrado_comuna = df_stats[df_stats['comuna'] == comuna_actual].copy()
                     df_filtrado_comuna["empresa"] = df_filtrado_comuna["empresa"].str.replace("(?i)data_diaria[_\\-]*", "", regex=True)
@@ -804,84 +818,74 @@ def render_vista_general():
                             fig.update_traces(textposition='inside', textinfo='percent+label', sort=False)
                             fig.update_layout(showlegend=False, margin=dict(l=10, r=10, t=40, b=10), height=300)
                             st.plotly_chart(fig, use_container_width=True)
+    seccion_diferida(plan, "Calculando datos por comuna...", obtener_stats_calidad_por_comuna, dibujar_calidad_comuna,
+                     fecha_inicio=f_inicio.strftime("%Y-%m-%d"), fecha_fin=f_fin.strftime("%Y-%m-%d"))
 
-        
-###########################  - INICIO DE LA NUEVA SECCIÓN: Duración de Tiempos Promedios ---######################
-                
     
-        # --- INICIO DE LA SECCIÓN CORREGIDA: Tiempos Promedios de Duración ---
-        st.markdown("---")
-        st.subheader("⏱️ Tiempos Promedios de Duración por Actividad")
-        st.write("Análisis de la duración promedio para las actividades finalizadas.")
-
-        # Se define una función de ayuda local para formatear los tiempos
-        def format_timedelta(td: timedelta) -> str:
-            if pd.isna(td): return "N/A"
-            total_seconds = int(td.total_seconds())
-            hours, remainder = divmod(total_seconds, 3600)
-            minutes, seconds = divmod(remainder, 60)
-            return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
-
-        # Se asume que la variable 'engine' está disponible
-
-        # --- FILTROS INTERACTIVOS (LÓGICA CORREGIDA) ---
-        with st.expander("📅 Aplicar Filtros para el Análisis", expanded=True):
-            # --- Checkbox para activar/desactivar el filtro de fecha ---
-            aplicar_filtro_fecha = st.checkbox("Filtrar por rango de fechas", key="check_duracion_page")
-            
-            col_f1, col_f2 = st.columns(2)
-            with col_f1:
-                # Los widgets de fecha ahora están deshabilitados si el checkbox no está marcado
-                f_inicio_widget = st.date_input("Fecha de Inicio", value=datetime.now().date() - timedelta(days=30), key="duracion_start_page", disabled=not aplicar_filtro_fecha)
-            with col_f2:
-                f_fin_widget = st.date_input("Fecha de Fin", value=datetime.now().date(), key="duracion_end_page", disabled=not aplicar_filtro_fecha)
-
-            # El filtro de comuna se mantiene igual
-            with st.spinner("Cargando opciones de filtro..."):
-                comunas_disponibles, _ = obtener_opciones_filtros(engine)
-            opciones_comuna = ["Todas las Comunas"] + comunas_disponibles
-            comuna_seleccionada = st.selectbox("Comuna", options=opciones_comuna, key="duracion_comuna_page")
-
-        # --- LÓGICA PARA DETERMINAR QUÉ FECHAS USAR ---
-        if aplicar_filtro_fecha:
-            f_inicio_para_query = f_inicio_widget.strftime("%Y-%m-%d")
-            f_fin_para_query = f_fin_widget.strftime("%Y-%m-%d")
-            st.info(f"Mostrando análisis para el período: {f_inicio_para_query} al {f_fin_para_query}")
-        else:
-            # Por defecto, se usa un rango muy amplio para traer todo el historial
-            f_inicio_para_query = "2024-01-01" 
-            f_fin_para_query = "2999-12-31"
-            st.info("Mostrando análisis de todo el historial. Active el filtro para un período específico.")
-
-        # --- CÁLCULO DE DATOS ---
-        tipos_actividad_fijos = [
-            'instalación-hogar-fibra', 'instalación-masivo-fibra', 'incidencia manual',
-            'postventa-hogar-fibra', 'reparación 3play light', 'postventa-masivo-equipo',
-            'postventa-masivo-fibra', 'reparación empresa masivo fibra', 'reparación-hogar-fibra'
-        ]
-
-        with st.spinner("Calculando tiempos promedio..."):
-            df_base = obtener_datos_duracion(
-                engine,
-                fecha_inicio=f_inicio_para_query,
-                fecha_fin=f_fin_para_query,
-                tipos_seleccionados=tipos_actividad_fijos
-            )
-            if comuna_seleccionada.lower() != "todas las comunas":
-                df_base = df_base[df_base['Comuna'] == comuna_seleccionada.lower()]
+###########################  - INICIO DE LA NUEVA SECCIÓN: Duración de Tiempos Promedios ---######################
             
-            df_analisis = df_base[
-                (df_base['Estado de actividad'] == 'finalizada') &
-                (df_base['Duración'].notna()) &
-                (df_base['Duración'] > pd.Timedelta(0))
-            ].copy()
+
+    # --- INICIO DE LA SECCIÓN CORREGIDA: Tiempos Promedios de Duración ---
+    st.markdown("---")
+    st.subheader("⏱️ Tiempos Promedios de Duración por Actividad")
+    st.write("Análisis de la duración promedio para las actividades finalizadas.")
+
+    # Se define una función de ayuda local para formatear los tiempos
+    def format_timedelta(td: timedelta) -> str:
+        if pd.isna(td): return "N/A"
+        total_seconds = int(td.total_seconds())
+        hours, remainder = divmod(total_seconds, 3600)
+        minutes, seconds = divmod(remainder, 60)
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d}"
+
+    # Se asume que la variable 'engine' está disponible
+
+    # --- FILTROS INTERACTIVOS (LÓGICA CORREGIDA) ---
+    with st.expander("📅 Aplicar Filtros para el Análisis", expanded=True):
+        # --- Checkbox para activar/desactivar el filtro de fecha ---
+        aplicar_filtro_fecha = st.checkbox("Filtrar por rango de fechas", key="check_duracion_page")
+        
+        col_f1, col_f2 = st.columns(2)
+        with col_f1:
+            # Los widgets de fecha ahora están deshabilitados si el checkbox no está marcado
+            f_inicio_widget = st.date_input("Fecha de Inicio", value=datetime.now().date() - timedelta(days=30), key="duracion_start_page", disabled=not aplicar_filtro_fecha)
+        with col_f2:
+            f_fin_widget = st.date_input("Fecha de Fin", value=datetime.now().date(), key="duracion_end_page", disabled=not aplicar_filtro_fecha)
+
+        # El filtro de comuna se mantiene igual
+        with st.spinner("Cargando opciones de filtro..."):
+            comunas_disponibles, _ = obtener_opciones_filtros(engine)
+        opciones_comuna = ["Todas las Comunas"] + comunas_disponibles
+        comuna_seleccionada = st.selectbox("Comuna", options=opciones_comuna, key="duracion_comuna_page")
+
+    # --- LÓGICA PARA DETERMINAR QUÉ FECHAS USAR ---
+    if aplicar_filtro_fecha:
+        f_inicio_para_query = f_inicio_widget.strftime("%Y-%m-%d")
+        f_fin_para_query = f_fin_widget.strftime("%Y-%m-%d")
+        st.info(f"Mostrando análisis para el período: {f_inicio_para_query} al {f_fin_para_query}")
+    else:
+        # Por defecto, se usa un rango muy amplio para traer todo el historial
+        f_inicio_para_query = "2024-01-01" 
+        f_fin_para_query = "2999-12-31"
+        st.info("Mostrando análisis de todo el historial. Active el filtro para un período específico.")
+
+    # --- CÁLCULO DE DATOS ---
+    tipos_actividad_fijos = [
+        'instalación-hogar-fibra', 'instalación-masivo-fibra', 'incidencia manual',
+        'postventa-hogar-fibra', 'reparación 3play light', 'postventa-masivo-equipo',
+        'postventa-masivo-fibra', 'reparación empresa masivo fibra', 'reparación-hogar-fibra'
+    ]
+
+    def dibujar_duracion(df_stats):
+        # Estadísticas calculadas en la BD (promedio, mediana, p90) de las finalizadas con duración > 0
+        df_propietario = estadisticas_por(df_stats, ['Propietario de Red', 'Tipo de actividad'])
+        df_comunas_stats = estadisticas_por(df_stats, ['Tipo de actividad', 'Comuna'])
 
         # --- VISUALIZACIÓN ---
-        if df_analisis.empty:
+        if df_propietario.empty:
             st.warning("No se encontraron actividades finalizadas con datos de duración para los filtros seleccionados.")
         else:
-            def display_propietario_analysis(df_proveedor):
-                resumen = df_proveedor.groupby('Tipo de actividad')['Duración'].mean().reset_index()
+            def display_propietario_analysis(resumen):
                 resumen_ordenado = resumen.sort_values("Duración", ascending=True)
                 fig = px.bar(
                     resumen_ordenado,
@@ -893,12 +897,22 @@ def render_vista_general():
                 fig.update_traces(textposition='outside', marker=dict(color='#007aff'))
                 st.plotly_chart(fig, use_container_width=True)
 
+                # Percentiles: un P90 muy por encima de la mediana indica actividades atípicamente largas
+                tabla = resumen_ordenado.copy()
+                for columna in ('Duración', 'Mediana', 'P90'):
+                    tabla[columna] = tabla[columna].apply(format_timedelta)
+                st.dataframe(
+                    tabla[['Tipo de actividad', 'registros', 'Duración', 'Mediana', 'P90']].rename(
+                        columns={'registros': 'Actividades', 'Duración': 'Promedio'}),
+                    hide_index=True, use_container_width=True
+                )
+
             st.markdown("---")
-            
+        
             with st.container(border=True):
                 # ... (lógica para mostrar Entel)
                 st.markdown("<h5 style='text-align: center;'>Tiempos Promedio Entel</h5>", unsafe_allow_html=True)
-                df_entel = df_analisis[df_analisis['Propietario de Red'] == 'entel']
+                df_entel = df_propietario[df_propietario['Propietario de Red'] == 'entel']
                 if df_entel.empty:
                     st.info("No hay datos para Entel con los filtros seleccionados.")
                 else:
@@ -909,7 +923,7 @@ def render_vista_general():
             with st.container(border=True):
                 # ... (lógica para mostrar Onnet)
                 st.markdown("<h5 style='text-align: center;'>Tiempos Promedio Onnet</h5>", unsafe_allow_html=True)
-                df_onnet = df_analisis[df_analisis['Propietario de Red'] == 'onnet']
+                df_onnet = df_propietario[df_propietario['Propietario de Red'] == 'onnet']
                 if df_onnet.empty:
                     st.info("No hay datos para Onnet con los filtros seleccionados.")
                 else:
@@ -917,44 +931,44 @@ def render_vista_general():
 
             st.markdown("---")
             with st.expander("🔍 Ver Desglose Detallado por Comuna"):
-                # ... (lógica del expander de desglose)
-                resumen_comunas = df_analisis.groupby(['Tipo de actividad', 'Comuna'])['Duración'].mean().reset_index()
+                resumen_comunas = df_comunas_stats.dropna(subset=['Comuna'])
                 resumen_comunas = resumen_comunas.sort_values(by=['Tipo de actividad', 'Duración'], ascending=[True, True])
                 resumen_comunas['Tiempo Promedio'] = resumen_comunas['Duración'].apply(format_timedelta)
-                st.dataframe(resumen_comunas[['Tipo de actividad', 'Comuna', 'Tiempo Promedio']], hide_index=True, use_container_width=True)
+                resumen_comunas['Mediana'] = resumen_comunas['Mediana'].apply(format_timedelta)
+                resumen_comunas['P90'] = resumen_comunas['P90'].apply(format_timedelta)
+                st.dataframe(resumen_comunas[['Tipo de actividad', 'Comuna', 'Tiempo Promedio', 'Mediana', 'P90']], hide_index=True, use_container_width=True)
+    seccion_diferida(plan, "Calculando tiempos promedio...", obtener_estadisticas_duracion, dibujar_duracion,
+                     fecha_inicio=f_inicio_para_query, fecha_fin=f_fin_para_query,
+                     agrupaciones=(('Propietario de Red', 'Tipo de actividad'), ('Tipo de actividad', 'Comuna')),
+                     tipos_seleccionados=tipos_actividad_fijos,
+                     comuna=None if comuna_seleccionada.lower() == "todas las comunas" else comuna_seleccionada)
 
 
 
-            # --- INICIO DE LA NUEVA SECCIÓN: ANÁLISIS DE CAUSA DE FALLA ---
+        # --- INICIO DE LA NUEVA SECCIÓN: ANÁLISIS DE CAUSA DE FALLA ---
 
-        # --- INICIO DE LA NUEVA SECCIÓN: ANÁLISIS DE CAUSA DE FALLA (VERSIÓN MEJORADA) ---
+    # --- INICIO DE LA NUEVA SECCIÓN: ANÁLISIS DE CAUSA DE FALLA (VERSIÓN MEJORADA) ---
 
-        st.markdown("---")
-        st.subheader("📊 Análisis de Causa de Falla")
+    st.markdown("---")
+    st.subheader("📊 Análisis de Causa de Falla")
 
-        # --- Filtro de fecha opcional ---
-        filtrar_fechas_falla = st.checkbox("Filtrar por fecha para el análisis de fallas", value=False, key="check_fallas")
+    # --- Filtro de fecha opcional ---
+    filtrar_fechas_falla = st.checkbox("Filtrar por fecha para el análisis de fallas", value=False, key="check_fallas")
 
-        f_inicio_fallas = "2024-01-01"
-        f_fin_fallas = "2999-12-31"
+    f_inicio_fallas = "2024-01-01"
+    f_fin_fallas = "2999-12-31"
 
-        if filtrar_fechas_falla:
-            c1, c2 = st.columns(2)
-            with c1:
-                fecha_inicio_widget = st.date_input("Inicio del período", value=datetime.now() - timedelta(days=90), key="fallas_start")
-                f_inicio_fallas = fecha_inicio_widget.strftime("%Y-%m-%d")
-            with c2:
-                fecha_fin_widget = st.date_input("Fin del período", value=datetime.now(), key="fallas_end")
-                f_fin_fallas = fecha_fin_widget.strftime("%Y-%m-%d")
-
-        # --- Carga de datos con el filtro aplicado ---
-        with st.spinner("Analizando causas de falla..."):
-            # Se asume que 'engine' está disponible
-            df_fallas = obtener_datos_causa_falla(
-                engine,
-                fecha_inicio=f_inicio_fallas,
-                fecha_fin=f_fin_fallas
-            )
+    if filtrar_fechas_falla:
+        c1, c2 = st.columns(2)
+        with c1:
+            fecha_inicio_widget = st.date_input("Inicio del período", value=datetime.now() - timedelta(days=90), key="fallas_start")
+            f_inicio_fallas = fecha_inicio_widget.strftime("%Y-%m-%d")
+        with c2:
+            fecha_fin_widget = st.date_input("Fin del período", value=datetime.now(), key="fallas_end")
+            f_fin_fallas = fecha_fin_widget.strftime("%Y-%m-%d")
+
+    # --- Carga de datos con el filtro aplicado ---
+    def dibujar_causa_falla(df_fallas):
 
         if df_fallas.empty:
             st.info("No se encontraron datos de causas de falla para los filtros seleccionados.")
@@ -966,8 +980,8 @@ def render_vista_general():
             with col_grafico:
                 with st.container(border=True):
                     st.markdown("<h5 style='text-align: center;'>Top 10 Causas de Falla</h5>", unsafe_allow_html=True)
-                    causa_counts = df_fallas['Causa de la falla'].value_counts().head(10)
-                    
+                    causa_counts = df_fallas.groupby('Causa de la falla')['registros'].sum().sort_values(ascending=False).head(10)
+                
                     fig = px.pie(
                         causa_counts, 
                         names=causa_counts.index, 
@@ -987,21 +1001,28 @@ def render_vista_general():
                     if df_comunas.empty:
                         st.info("No hay datos para mostrar el desglose por comuna.")
                     else:
-                        causa_principal = df_comunas.groupby('Comuna')['Causa de la falla'].agg(
-                            lambda x: x.mode()[0] if not x.mode().empty else "N/A"
-                        ).reset_index()
+                        # La causa con más registros en cada comuna (ante empate, la primera alfabéticamente)
+                        causa_principal = df_comunas.sort_values(
+                            ['Comuna', 'registros', 'Causa de la falla'], ascending=[True, False, True]
+                        ).drop_duplicates('Comuna')[['Comuna', 'Causa de la falla']]
                         causa_principal.rename(columns={'Causa de la falla': 'Causa Más Frecuente'}, inplace=True)
-                        
+                    
                         st.dataframe(
                             causa_principal.sort_values(by="Comuna"),
                             hide_index=True,
                             use_container_width=True,
                             height=450 # Para alinear la altura con el gráfico
                         )
-                
+    seccion_diferida(plan, "Analizando causas de falla...", obtener_resumen_causa_falla, dibujar_causa_falla,
+                     fecha_inicio=f_inicio_fallas, fecha_fin=f_fin_fallas)
+
+    # Las secciones se dibujan a medida que terminan sus consultas: la página completa tarda
+    # lo que la consulta más lenta, no la suma de todas.
+    plan.esperar_todas()
+            
         ############################## Seccion de reincidecnias ######################################################
 st.markdown("---")
-@st.cache_data(show_spinner=False)
+# Las funciones de analisis.py ya guardan sus resultados en caché (se invalida con cada carga)
 def obtener_df_resumen_caché(_engine, f_inicio, f_fin, empresa):
     # Obtiene el dataframe y lo ordena por 'recurso' para que sea determinista.
     df = obtener_resumen_rt_por_empresa(_engine, str(f_inicio), str(f_fin), empresa)
@@ -1069,7 +1090,7 @@ def render_produccion_mantenimiento_page(empresa, f_inicio, f_fin):
     # --- INICIO DE LA CORRECCIÓN ---
 
     # 1. Creamos la columna para definir el color según el umbral del 90%
-    df_mant['rendimiento'] = df_mant['pct_efectividad'].apply(lambda x: 'Cumple (>= 90%)' if x >= 90 else 'No Cumple (< 90%)')
+    df_mant['rendimiento'] = clasificar(df_mant['pct_efectividad'], 90, 'Cumple (>= 90%)', 'No Cumple (< 90%)')
 
     # El DataFrame ya viene ordenado desde la función de análisis
     fig_mant_tech = px.bar(
@@ -1150,7 +1171,7 @@ def render_produccion_provision_page(empresa, f_inicio, f_fin):
     # --- INICIO DE LA CORRECCIÓN ---
 
     # 1. Creamos una columna para definir el color según el umbral del 80%
-    df_prov['rendimiento'] = df_prov['pct_efectividad'].apply(lambda x: 'Cumple (>= 80%)' if x >= 80 else 'No Cumple (< 80%)')
+    df_prov['rendimiento'] = clasificar(df_prov['pct_efectividad'], 80, 'Cumple (>= 80%)', 'No Cumple (< 80%)')
     
     # El DataFrame ya viene ordenado desde la función de análisis
     fig_prov_tech = px.bar(
@@ -1230,6 +1251,15 @@ def render_reincidencias_page(empresa, f_inicio, f_fin):
         style_porcentaje, umbral=4, subset=['porcentaje_reincidencia']
     ).format({'porcentaje_reincidencia': '{:.2f}%'})
     st.dataframe(styled_df_rt, use_container_width=True, hide_index=True)
+
+    # Tasa mensual por técnico (meta 4%), desde las casillas diarias de reincidencias
+    df_mensual_rt = obtener_matriz_mensual(engine, str(f_inicio), str(f_fin), "rt", empresa)
+    if not df_mensual_rt.empty:
+        st.subheader("📅 Reincidencia Mensual por Técnico")
+        st.dataframe(
+            df_mensual_rt.style.apply(style_porcentaje, umbral=4).format('{:.2f}%', na_rep='-'),
+            use_container_width=True
+        )
     
     # --- LÓGICA DE DRILL-DOWN ---
     if total_reincidencias > 0:
@@ -1284,7 +1314,9 @@ def render_reincidencias_page(empresa, f_inicio, f_fin):
 
             if st.button(f"📊 Ver Evolución de {tecnico_seleccionado}", key=f"evolucion_btn_rt_{tecnico_seleccionado}"):
                 with st.spinner("Generando gráfico de evolución..."):
-                    df_historial = obtener_historial_rodante_rt (engine, str(f_inicio), str(f_fin), tecnico_seleccionado)
+                    # Las series de todos los técnicos de la empresa se calculan juntas y quedan en caché
+                    df_historiales = obtener_historiales_rodantes(engine, str(f_inicio), str(f_fin), empresa)
+                    df_historial = historial_de_tecnico(df_historiales, tecnico_seleccionado, "rt")
                     if not df_historial.empty:
                         st.subheader(f"Evolución de Tasa de Reincidencia (Móvil de 10 días)")
                         st.line_chart(df_historial['tasa_reincidencia_movil'])
@@ -1316,6 +1348,15 @@ def render_fallas_tempranas_page(empresa, f_inicio, f_fin):
     st.subheader("Resumen por Técnico")
     styled_df_ft = df_resumen_ft.style.apply(style_porcentaje, umbral=3, subset=['porcentaje_falla']).format({'porcentaje_falla': '{:.2f}%'})
     st.dataframe(styled_df_ft, use_container_width=True, hide_index=True)
+
+    # Tasa mensual por técnico (meta 3%), desde las casillas diarias de fallas tempranas
+    df_mensual_ft = obtener_matriz_mensual(engine, str(f_inicio), str(f_fin), "ft", empresa)
+    if not df_mensual_ft.empty:
+        st.subheader("📅 Falla Temprana Mensual por Técnico")
+        st.dataframe(
+            df_mensual_ft.style.apply(style_porcentaje, umbral=3).format('{:.2f}%', na_rep='-'),
+            use_container_width=True
+        )
     
     # --- LÓGICA DE DRILL-DOWN MODIFICADA ---
     if total_fallas > 0:
@@ -1351,14 +1392,14 @@ def render_fallas_tempranas_page(empresa, f_inicio, f_fin):
             # Lógica del botón de evolución
             if st.button(f"📊 Ver Evolución de {tecnico_seleccionado}", key=f"evolucion_btn_ft_{tecnico_seleccionado}"):
                 with st.spinner("Generando gráfico de evolución..."):
-                    df_historial = obtener_historial_rodante_ft (engine, str(f_inicio), str(f_fin), tecnico_seleccionado)
+                    df_historiales = obtener_historiales_rodantes(engine, str(f_inicio), str(f_fin), empresa)
+                    df_historial = historial_de_tecnico(df_historiales, tecnico_seleccionado, "ft")
                     if not df_historial.empty:
                         st.subheader(f"Evolución de Tasa de Falla Temprana (Móvil de 10 días)")
                         st.line_chart(df_historial['tasa_falla_movil'])
                     else:
                         st.warning("No hay suficientes datos para generar un historial.")
 
-@st.cache_data
 def render_certificacion_page(empresa, f_inicio, f_fin):
     st.header(f"✅ Análisis de Certificación para: {empresa}")
     
@@ -1421,7 +1462,6 @@ def render_certificacion_page(empresa, f_inicio, f_fin):
     fig_cert_tech.update_yaxes(categoryorder='array', categoryarray=df_cert.sort_values("porcentaje_certificacion", ascending=True)['recurso'])
     st.plotly_chart(fig_cert_tech, use_container_width=True)
 
-@st.cache_data
 def render_ranking_page(_engine, empresa, f_inicio, f_fin):
     st.header(f"🏆 Ranking de Técnicos para: {empresa}")
     
@@ -1468,7 +1508,12 @@ def render_tiempos_empresas_page(engine: sa.Engine, empresa: str, f_inicio: str,
     st.header(f"⏱️ Tiempos Promedios para: {empresa}")
 
     with st.spinner(f"Calculando tiempos para {empresa}..."):
-        df_base = obtener_tiempos_promedio_empresa(engine, f_inicio, f_fin, empresa)
+        # Promedio, mediana y p90 calculados en la BD para las tres vistas de la página
+        df_base = obtener_estadisticas_duracion(
+            engine, f_inicio, f_fin,
+            agrupaciones=(('Recurso',), ('Tipo de actividad',), ('Recurso', 'Tipo de actividad')),
+            empresa=empresa
+        )
 
     if df_base.empty:
         st.info("No se encontraron actividades con datos de duración para esta empresa en el período seleccionado.")
@@ -1477,7 +1522,7 @@ def render_tiempos_empresas_page(engine: sa.Engine, empresa: str, f_inicio: str,
     st.subheader("🏆 Resumen de Rendimiento por Técnico")
 
     # 1. Calculamos el promedio de duración general para cada técnico
-    avg_duration_by_tech = df_base.groupby('Recurso')['Duración'].mean().reset_index()
+    avg_duration_by_tech = estadisticas_por(df_base, ['Recurso']).dropna(subset=['Recurso'])
     
     # 2. Nos aseguramos de que haya al menos dos técnicos para poder comparar
     if len(avg_duration_by_tech) > 1:
@@ -1506,12 +1551,14 @@ def render_tiempos_empresas_page(engine: sa.Engine, empresa: str, f_inicio: str,
     # --- 1. DATAFRAME GENERAL DE LA EMPRESA ---
     st.subheader("Tiempos Promedio por Tipo de Actividad")
     
-    df_resumen_empresa = df_base.groupby('Tipo de actividad')['Duración'].mean().reset_index()
+    df_resumen_empresa = estadisticas_por(df_base, ['Tipo de actividad'])
     df_resumen_empresa['Tiempo Promedio'] = df_resumen_empresa['Duración'].apply(format_timedelta)
+    df_resumen_empresa['Mediana'] = df_resumen_empresa['Mediana'].apply(format_timedelta)
+    df_resumen_empresa['P90'] = df_resumen_empresa['P90'].apply(format_timedelta)
     df_resumen_empresa_sorted = df_resumen_empresa.sort_values(by="Duración", ascending=True)
 
     st.dataframe(
-        df_resumen_empresa_sorted[['Tipo de actividad', 'Tiempo Promedio']],
+        df_resumen_empresa_sorted[['Tipo de actividad', 'Tiempo Promedio', 'Mediana', 'P90']],
         hide_index=True,
         use_container_width=True
     )
@@ -1521,7 +1568,8 @@ def render_tiempos_empresas_page(engine: sa.Engine, empresa: str, f_inicio: str,
     # --- 2. DATAFRAME INTERACTIVO POR TÉCNICO ---
     st.subheader("Análisis de Tiempos por Técnico")
     
-    tecnicos_disponibles = sorted(df_base['Recurso'].dropna().unique())
+    df_por_tecnico_y_tipo = estadisticas_por(df_base, ['Recurso', 'Tipo de actividad']).dropna(subset=['Recurso'])
+    tecnicos_disponibles = sorted(df_por_tecnico_y_tipo['Recurso'].unique())
     
     # Creamos un menú desplegable para seleccionar un técnico
     tecnico_seleccionado = st.selectbox(
@@ -1532,20 +1580,21 @@ def render_tiempos_empresas_page(engine: sa.Engine, empresa: str, f_inicio: str,
 
     # Si se selecciona un técnico específico, filtramos los datos
     if tecnico_seleccionado != "Todos los Técnicos":
-        df_filtrado_tecnico = df_base[df_base['Recurso'] == tecnico_seleccionado]
+        df_filtrado_tecnico = df_por_tecnico_y_tipo[df_por_tecnico_y_tipo['Recurso'] == tecnico_seleccionado]
         titulo_ranking = f"Ranking de Actividades para: {tecnico_seleccionado}"
     else:
-        df_filtrado_tecnico = df_base
+        df_filtrado_tecnico = df_por_tecnico_y_tipo
         titulo_ranking = "Ranking General de Actividades por Técnico"
 
     # Calculamos el resumen para el DataFrame filtrado (sea de todos o de uno solo)
-    df_resumen_tecnicos = df_filtrado_tecnico.groupby(['Recurso', 'Tipo de actividad'])['Duración'].mean().reset_index()
+    df_resumen_tecnicos = df_filtrado_tecnico.copy()
     df_resumen_tecnicos['Tiempo Promedio'] = df_resumen_tecnicos['Duración'].apply(format_timedelta)
+    df_resumen_tecnicos['P90'] = df_resumen_tecnicos['P90'].apply(format_timedelta)
     df_resumen_tecnicos_sorted = df_resumen_tecnicos.sort_values(by=["Recurso", "Duración"], ascending=True)
     
     st.write(f"**{titulo_ranking}**")
     st.dataframe(
-        df_resumen_tecnicos_sorted[['Recurso', 'Tipo de actividad', 'Tiempo Promedio']],
+        df_resumen_tecnicos_sorted[['Recurso', 'Tipo de actividad', 'Tiempo Promedio', 'P90']],
         hide_index=True,
         use_container_width=True
     )
@@ -1604,7 +1653,11 @@ f_fin_global = None
 if seccion != "Vista General":
     with st.sidebar.expander("Filtros de Análisis", expanded=True):
         if engine:
-            lista_empresas = get_company_list (engine)
+            try:
+                lista_empresas = get_company_list(engine)
+            except Exception as e:
+                print(f"Error al obtener lista de empresas: {e}")
+                lista_empresas = []
             if lista_empresas:
                 # Usamos un selectbox simple para todas las páginas de detalle, incluyendo el ranking
                 empresa_seleccionada = st.sidebar.selectbox(
@@ -3,19 +3,20 @@ import pandas as pd
 import os
 from datetime import timedelta, date, datetime
 import plotly.express as px
+from funciones.almacen_parquet import leer_dataset
 
 # --- 1. CONFIGURACIÓN Y CARGA DE DATOS ---
 st.set_page_config(page_title="KPI de Duración de Actividades", layout="wide")
 st.title("⏱️ KPI de Duración de Actividades")
 
-RUTA_PARQUET = r"C:\Users\alex_\Downloads\Proyecto_EntelRM\Datos\datos_unificados.parquet"
+RUTA_DATASET = r"C:\Users\alex_\Downloads\Proyecto_EntelRM\Datos\datos_unificados"
 
 @st.cache_data
 def cargar_datos(ruta: str) -> pd.DataFrame:
     if not os.path.exists(ruta):
-        st.error(f"Error: No se encontró el archivo en: {ruta}")
+        st.error(f"Error: No se encontró el dataset en: {ruta}")
         return pd.DataFrame()
-    df = pd.read_parquet(ruta)
+    df = leer_dataset(ruta)
     # Convertimos las columnas de fecha/hora al cargarlas
     df['Duración'] = pd.to_timedelta(df['Duración'], errors='coerce')
     df['Fecha Agendamiento'] = pd.to_datetime(df['Fecha Agendamiento'], errors='coerce', dayfirst=True)
@@ -57,7 +58,7 @@ def display_status_kpis(df: pd.DataFrame, status_title: str):
         st.dataframe(resumen_por_tipo[['Tipo de actividad', 'Duración Promedio (HH:MM:SS)']], hide_index=True, use_container_width=True)
 
 # --- 3. APLICACIÓN PRINCIPAL ---
-df_maestro = cargar_datos(RUTA_PARQUET)
+df_maestro = cargar_datos(RUTA_DATASET)
 if not df_maestro.empty:
     st.sidebar.header("Filtros de Análisis")
     
@@ -0,0 +1,243 @@
+# almacen_cache.py
+
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+
+# Almacenes intercambiables para la caché de consultas (cache_consultas.py). Todos exponen
+# obtener(clave) -> (valor, encontrado), guardar(clave, valor), limpiar() y len().
+#   - CacheLRU:   en memoria, solo del proceso actual.
+#   - CacheDisco: archivos Arrow IPC en una carpeta compartida + índice SQLite. Lo ven todas las
+#                 réplicas del dashboard que montan la misma carpeta y sobrevive a reinicios.
+#   - CacheKV:    almacén clave-valor local (una tabla SQLite) que reemplaza a un Redis/Memcached.
+
+
+class CacheLRU:
+    """Diccionario acotado: al superar 'max_entradas' se descarta el usado hace más tiempo."""
+
+    def __init__(self, max_entradas: int):
+        self.max_entradas = max_entradas
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+
+    def obtener(self, clave):
+        with self._lock:
+            if clave not in self._datos:
+                self.fallos += 1
+                return None, False
+            self._datos.move_to_end(clave)
+            self.aciertos += 1
+            return self._datos[clave], True
+
+    def guardar(self, clave, valor) -> None:
+        with self._lock:
+            self._datos[clave] = valor
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def limpiar(self) -> None:
+        with self._lock:
+            self._datos.clear()
+            self.aciertos = self.fallos = 0
+
+    def __len__(self):
+        return len(self._datos)
+
+
+# --- SERIALIZACIÓN ---
+# Los DataFrames van en formato Arrow IPC (rápido de leer y sin pickle); el resto
+# (dicts de benchmarks, listas, tuplas) o un DataFrame que Arrow no sepa convertir, con pickle.
+def _clave_texto(clave) -> str:
+    return hashlib.sha256(repr(clave).encode("utf-8")).hexdigest()
+
+
+def serializar(valor) -> tuple:
+    """Devuelve (formato, bytes) con formato 'arrow' o 'pickle'."""
+    if isinstance(valor, pd.DataFrame):
+        try:
+            tabla = pa.Table.from_pandas(valor, preserve_index=True)
+            sumidero = pa.BufferOutputStream()
+            with pa.ipc.new_file(sumidero, tabla.schema) as escritor:
+                escritor.write_table(tabla)
+            return "arrow", sumidero.getvalue().to_pybytes()
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            pass
+    return "pickle", pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def deserializar(formato: str, datos: bytes):
+    if formato == "arrow":
+        return pa.ipc.open_file(pa.py_buffer(datos)).read_all().to_pandas()
+    return pickle.loads(datos)
+
+
+class _CacheSQLite:
+    """Base común: índice SQLite con LRU por fecha de último acceso y contadores de aciertos."""
+
+    _DDL = ""
+
+    def __init__(self, ruta_db: str, max_entradas: int):
+        self.max_entradas = max_entradas
+        self.ruta_db = ruta_db
+        self._local = threading.local()
+        self.aciertos = 0
+        self.fallos = 0
+        with self._conexion() as conn:
+            conn.execute(self._DDL)
+
+    def _conexion(self) -> sqlite3.Connection:
+        # sqlite3 no comparte conexiones entre hilos: una por hilo de Streamlit
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.ruta_db, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def __len__(self):
+        return self._conexion().execute("SELECT COUNT(*) FROM entradas").fetchone()[0]
+
+
+class CacheKV(_CacheSQLite):
+    """Almacén clave-valor en un archivo SQLite (los bytes se guardan en la misma tabla)."""
+
+    _DDL = """
+        CREATE TABLE IF NOT EXISTS entradas (
+            clave          TEXT PRIMARY KEY,
+            formato        TEXT NOT NULL,
+            valor          BLOB NOT NULL,
+            ultimo_acceso  REAL NOT NULL
+        )
+    """
+
+    def obtener(self, clave):
+        conn = self._conexion()
+        clave = _clave_texto(clave)
+        fila = conn.execute("SELECT formato, valor FROM entradas WHERE clave = ?", (clave,)).fetchone()
+        if fila is None:
+            self.fallos += 1
+            return None, False
+        with conn:
+            conn.execute("UPDATE entradas SET ultimo_acceso = ? WHERE clave = ?", (time.time(), clave))
+        self.aciertos += 1
+        return deserializar(*fila), True
+
+    def guardar(self, clave, valor) -> None:
+        formato, datos = serializar(valor)
+        conn = self._conexion()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entradas (clave, formato, valor, ultimo_acceso) VALUES (?, ?, ?, ?)",
+                (_clave_texto(clave), formato, sqlite3.Binary(datos), time.time()),
+            )
+            conn.execute(
+                "DELETE FROM entradas WHERE clave IN (SELECT clave FROM entradas ORDER BY ultimo_acceso DESC LIMIT -1 OFFSET ?)",
+                (self.max_entradas,),
+            )
+
+    def limpiar(self) -> None:
+        conn = self._conexion()
+        with conn:
+            conn.execute("DELETE FROM entradas")
+        self.aciertos = self.fallos = 0
+
+
+class CacheDisco(_CacheSQLite):
+    """
+    Un archivo por resultado (<hash>.arrow o <hash>.pkl) y un índice SQLite 'indice.db' con la
+    clave, el archivo y el último acceso. Los archivos se escriben con nombre temporal y se
+    renombran, así otra réplica nunca lee un archivo a medio escribir.
+    """
+
+    _DDL = """
+        CREATE TABLE IF NOT EXISTS entradas (
+            clave          TEXT PRIMARY KEY,
+            archivo        TEXT NOT NULL,
+            formato        TEXT NOT NULL,
+            bytes          INTEGER NOT NULL,
+            ultimo_acceso  REAL NOT NULL
+        )
+    """
+
+    def __init__(self, directorio: str, max_entradas: int):
+        os.makedirs(directorio, exist_ok=True)
+        self.directorio = directorio
+        super().__init__(os.path.join(directorio, "indice.db"), max_entradas)
+
+    def _borrar_archivos(self, archivos) -> None:
+        for archivo in archivos:
+            try:
+                os.remove(os.path.join(self.directorio, archivo))
+            except FileNotFoundError:
+                pass
+
+    def obtener(self, clave):
+        conn = self._conexion()
+        clave = _clave_texto(clave)
+        fila = conn.execute("SELECT archivo, formato FROM entradas WHERE clave = ?", (clave,)).fetchone()
+        if fila is not None:
+            try:
+                with open(os.path.join(self.directorio, fila[0]), "rb") as f:
+                    valor = deserializar(fila[1], f.read())
+            except FileNotFoundError:
+                # Otra réplica lo desalojó entre la consulta al índice y la lectura
+                fila = None
+        if fila is None:
+            self.fallos += 1
+            return None, False
+        with conn:
+            conn.execute("UPDATE entradas SET ultimo_acceso = ? WHERE clave = ?", (time.time(), clave))
+        self.aciertos += 1
+        return valor, True
+
+    def guardar(self, clave, valor) -> None:
+        formato, datos = serializar(valor)
+        clave = _clave_texto(clave)
+        archivo = f"{clave}.{'arrow' if formato == 'arrow' else 'pkl'}"
+        temporal = os.path.join(self.directorio, f"_{uuid.uuid4().hex[:8]}_{archivo}")
+        with open(temporal, "wb") as f:
+            f.write(datos)
+        os.replace(temporal, os.path.join(self.directorio, archivo))
+
+        conn = self._conexion()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entradas (clave, archivo, formato, bytes, ultimo_acceso) VALUES (?, ?, ?, ?, ?)",
+                (clave, archivo, formato, len(datos), time.time()),
+            )
+            desalojados = conn.execute(
+                "SELECT clave, archivo FROM entradas ORDER BY ultimo_acceso DESC LIMIT -1 OFFSET ?",
+                (self.max_entradas,),
+            ).fetchall()
+            conn.executemany("DELETE FROM entradas WHERE clave = ?", [(c,) for c, _ in desalojados])
+        self._borrar_archivos(a for _, a in desalojados)
+
+    def limpiar(self) -> None:
+        conn = self._conexion()
+        with conn:
+            archivos = [a for (a,) in conn.execute("SELECT archivo FROM entradas")]
+            conn.execute("DELETE FROM entradas")
+        self._borrar_archivos(archivos)
+        self.aciertos = self.fallos = 0
+
+
+def crear_almacen(tipo: str, max_entradas: int, ruta: str = None):
+    """Crea el almacén según su nombre: 'memoria', 'disco' (ruta = carpeta) o 'kv' (ruta = archivo)."""
+    if tipo == "memoria":
+        return CacheLRU(max_entradas)
+    if tipo == "disco":
+        return CacheDisco(ruta or os.path.join(os.getcwd(), ".cache_consultas"), max_entradas)
+    if tipo == "kv":
+        return CacheKV(ruta or os.path.join(os.getcwd(), "cache_consultas.db"), max_entradas)
+    raise ValueError(f"Almacén de caché desconocido: '{tipo}'. Use 'memoria', 'disco' o 'kv'.")
@@ -0,0 +1,148 @@
+# almacen_parquet.py
+
+import os
+import uuid
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+# Estructura de carpetas del dataset (estilo hive):
+#   <ruta_dataset>/Empresa=<empresa>/anio=<YYYY>/mes=<M>/<archivo>.parquet
+# Las filas sin fecha válida quedan en anio=0/mes=0.
+COLUMNAS_PARTICION = ["Empresa", "anio", "mes"]
+ESQUEMA_PARTICION = pa.schema([("Empresa", pa.string()), ("anio", pa.int32()), ("mes", pa.int32())])
+
+
+def _particionado():
+    return ds.partitioning(ESQUEMA_PARTICION, flavor="hive")
+
+
+def _archivos_de_datos(nombres: list) -> list:
+    # pyarrow ignora los archivos que empiezan con '_' o '.', que usamos como temporales
+    return sorted(n for n in nombres if n.endswith(".parquet") and not n.startswith(("_", ".")))
+
+
+def escribir_particiones(df: pd.DataFrame, ruta_dataset: str, prefijo: str = "parte") -> list:
+    """
+    Agrega los registros al dataset escribiendo SOLO archivos nuevos, uno por partición
+    (Empresa, año y mes de 'Fecha Agendamiento'). Nunca se reescriben archivos existentes,
+    así que el costo de cada carga es proporcional a los datos nuevos.
+    Devuelve la lista de archivos escritos.
+    """
+    if df.empty:
+        return []
+
+    fechas = pd.to_datetime(df["Fecha Agendamiento"], errors="coerce", dayfirst=True)
+    df = df.assign(
+        anio=fechas.dt.year.fillna(0).astype("int32"),
+        mes=fechas.dt.month.fillna(0).astype("int32"),
+    )
+    # Columnas de texto como 'string' para que un Excel con una columna vacía
+    # no genere un archivo con tipo 'null' distinto al resto.
+    for col in df.select_dtypes(include="object").columns:
+        df[col] = df[col].astype("string")
+
+    sello = datetime.now().strftime("%Y%m%d%H%M%S")
+    escritos = []
+    for (empresa, anio, mes), grupo in df.groupby(COLUMNAS_PARTICION, sort=False):
+        carpeta = os.path.join(ruta_dataset, f"Empresa={empresa}", f"anio={anio}", f"mes={mes}")
+        os.makedirs(carpeta, exist_ok=True)
+        ruta = os.path.join(carpeta, f"{prefijo}_{sello}_{uuid.uuid4().hex[:8]}.parquet")
+        grupo.drop(columns=COLUMNAS_PARTICION).to_parquet(ruta, index=False)
+        escritos.append(ruta)
+    return escritos
+
+
+def abrir_dataset(ruta_dataset: str) -> ds.Dataset:
+    """
+    Abre el dataset unificando los esquemas de todos los archivos. Los Excel no siempre
+    traen las mismas columnas y, sin unificar, pyarrow usaría solo el esquema del primer archivo.
+    """
+    base = ds.dataset(ruta_dataset, format="parquet", partitioning=_particionado())
+    esquemas = [fragmento.physical_schema for fragmento in base.get_fragments()]
+    if not esquemas:
+        return base
+    esquema = pa.unify_schemas(esquemas + [ESQUEMA_PARTICION], promote_options="permissive")
+    return ds.dataset(ruta_dataset, schema=esquema, format="parquet", partitioning=_particionado())
+
+
+def leer_dataset(ruta_dataset: str, columnas: list = None, filtro=None) -> pd.DataFrame:
+    """
+    Lee el dataset particionado como DataFrame. 'columnas' permite leer solo lo necesario
+    y 'filtro' (expresión de pyarrow.dataset, ej. ds.field("anio") == 2025) descarta
+    particiones completas sin abrirlas.
+    """
+    if not os.path.isdir(ruta_dataset):
+        return pd.DataFrame(columns=columnas or [])
+    tabla = abrir_dataset(ruta_dataset).to_table(columns=columnas, filter=filtro)
+    return tabla.to_pandas()
+
+
+def compactar(ruta_dataset: str, min_archivos: int = 2) -> int:
+    """
+    Une los archivos pequeños de cada partición en uno solo. El archivo compacto se escribe
+    primero con nombre temporal y recién después se borran los originales, de modo que una
+    interrupción nunca deja la partición sin datos. Devuelve cuántas particiones se compactaron.
+    """
+    compactadas = 0
+    for carpeta, _, nombres in os.walk(ruta_dataset):
+        partes = _archivos_de_datos(nombres)
+        if len(partes) < min_archivos:
+            continue
+
+        rutas = [os.path.join(carpeta, nombre) for nombre in partes]
+        tabla = pa.concat_tables([pq.ParquetFile(ruta).read() for ruta in rutas], promote_options="permissive")
+
+        sufijo = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        temporal = os.path.join(carpeta, f"_compactando_{sufijo}.parquet")
+        pq.write_table(tabla, temporal)
+        os.replace(temporal, os.path.join(carpeta, f"compacto_{sufijo}.parquet"))
+        for ruta in rutas:
+            os.remove(ruta)
+
+        compactadas += 1
+        print(f"🗜️  {os.path.relpath(carpeta, ruta_dataset)}: {len(rutas)} archivos -> 1 ({tabla.num_rows:,} filas)")
+    return compactadas
+
+
+def eliminar_archivo_origen(ruta_dataset: str, empresa: str, archivo: str) -> int:
+    """
+    Quita del dataset las filas que vinieron de un Excel (para recargarlo cuando se re-exporta).
+    Solo se revisan las particiones de esa empresa y solo se reescriben los archivos que
+    contienen filas del Excel. Devuelve la cantidad de filas eliminadas.
+    """
+    eliminadas = 0
+    for carpeta, _, nombres in os.walk(os.path.join(ruta_dataset, f"Empresa={empresa}")):
+        for nombre in _archivos_de_datos(nombres):
+            ruta = os.path.join(carpeta, nombre)
+            if "Archivo_Origen" not in pq.ParquetFile(ruta).schema_arrow.names:
+                continue
+            origen = pq.read_table(ruta, columns=["Archivo_Origen"])["Archivo_Origen"]
+            mascara = pc.fill_null(pc.equal(origen, archivo), False)
+            coincidencias = pc.sum(mascara).as_py() or 0
+            if coincidencias == 0:
+                continue
+
+            restante = pq.ParquetFile(ruta).read().filter(pc.invert(mascara))
+            if restante.num_rows == 0:
+                os.remove(ruta)
+            else:
+                temporal = os.path.join(carpeta, f"_reescribiendo_{uuid.uuid4().hex[:8]}.parquet")
+                pq.write_table(restante, temporal)
+                os.replace(temporal, ruta)
+            eliminadas += coincidencias
+    return eliminadas
+
+
+def migrar_parquet_unico(ruta_parquet: str, ruta_dataset: str) -> int:
+    """
+    Convierte el antiguo 'datos_unificados.parquet' (archivo único) al dataset particionado.
+    El archivo original no se borra. Devuelve la cantidad de registros migrados.
+    """
+    df = pd.read_parquet(ruta_parquet)
+    escribir_particiones(df, ruta_dataset, prefijo="migrado")
+    return len(df)
@@ -1,16 +1,44 @@
+import re
 import pandas as pd
 import numpy as np
 import sqlalchemy as sa
 from sqlalchemy import text
 from datetime import datetime, timedelta
 import streamlit as st
+from funciones.visitas import TABLA_VISITAS, condicion_reincidencia, condicion_falla_temprana
+from funciones.kpi_diario import TABLA_KPI_DIARIO
+from funciones.ventanas_kpi import TABLA_VENTANAS, INDICADORES, tasas_mensuales
+from funciones.cache_consultas import cache_por_version
+from funciones.lectura_arrow import leer_arrow
+from funciones.kpi_ratios import porcentaje
+from funciones.exclusiones import (
+    sql_en_grupo, sql_sin_ids_excluidos, sql_sin_nombres_excluidos, sql_sin_comunas_excluidas
+)
 
 
-def safe_read_sql(connection, query, params):
+def _consulta_con_parametros(query: str, params: dict):
+    """
+    Arma el text() marcando las tuplas como parámetros 'expanding': SQLAlchemy escribe el
+    IN (...) y la consulta no depende de que el driver sepa adaptar tuplas (psycopg2 sí,
+    el driver async de analisis_async.py no).
+    """
+    consulta = text(query)
+    expandibles = [
+        sa.bindparam(nombre, expanding=True)
+        for nombre, valor in (params or {}).items()
+        if isinstance(valor, tuple) and re.search(rf"(?<!:):{nombre}\b", query)
+    ]
+    return consulta.bindparams(*expandibles) if expandibles else consulta
+
+
+def safe_read_sql(connection, query, params=None, formato: str = "pandas"):
     """
     Una envoltura segura para pd.read_sql que garantiza que siempre se devuelva un DataFrame.
+    Con formato="arrow" el resultado llega por COPY binario a columnas Arrow (ver lectura_arrow.py).
     """
-    result = pd.read_sql(text(query), connection, params=params)
+    if formato == "arrow":
+        return leer_arrow(connection, _consulta_con_parametros(query, params), params)
+    result = pd.read_sql(_consulta_con_parametros(query, params), connection, params=params)
     if not isinstance(result, pd.DataFrame):
         print(f"ALERTA: pd.read_sql devolvió un tipo inesperado: {type(result)}. Se forzará a DataFrame.")
         try:
@@ -22,45 +50,71 @@ def safe_read_sql(connection, query, params):
             result = pd.DataFrame()
     return result
 
+
+# --- LECTURA EN BLOQUES ---
+# Para las consultas que traen filas crudas solo para promediarlas o contarlas. Un cursor del lado
+# del servidor (stream_results; en psycopg2 es un cursor con nombre) entrega el resultado de a
+# TAMANO_BLOQUE filas y cada bloque se resume antes de leer el siguiente, así la memoria depende
+# de la cantidad de grupos y no del rango de fechas.
+TAMANO_BLOQUE = 20000
+_CLAVE_NULA = "\x00"  # reemplaza a los nulos en las claves mientras se acumula
+
+
+def leer_en_bloques(connection, query, params=None, tamano: int = TAMANO_BLOQUE):
+    """Generador de DataFrames de hasta 'tamano' filas, leídos con un cursor del lado del servidor."""
+    conexion = connection.execution_options(stream_results=True, max_row_buffer=tamano)
+    yield from pd.read_sql(_consulta_con_parametros(query, params), conexion, params=params, chunksize=tamano)
+
+
+def agregar_en_bloques(bloques, claves: list, columna_suma: str = None, preparar=None) -> pd.DataFrame:
+    """
+    Resume los bloques por 'claves' sin juntarlos: acumula 'registros' (filas) y, si se indica,
+    la suma de 'columna_suma'. 'preparar(bloque)' normaliza cada bloque antes de agruparlo.
+    Las claves nulas forman su propio grupo y vuelven como nulas en el resultado.
+    """
+    acumulado = None
+    for bloque in bloques:
+        if preparar is not None:
+            bloque = preparar(bloque)
+        bloque = bloque.assign(**{clave: bloque[clave].fillna(_CLAVE_NULA) for clave in claves})
+        grupos = bloque.groupby(claves)
+        parcial = grupos.size().to_frame("registros")
+        if columna_suma is not None:
+            parcial[columna_suma] = grupos[columna_suma].sum()
+        acumulado = parcial if acumulado is None else acumulado.add(parcial, fill_value=0)
+
+    if acumulado is None:
+        return pd.DataFrame(columns=claves + ["registros"] + ([columna_suma] if columna_suma else []))
+    resultado = acumulado.reset_index()
+    resultado[claves] = resultado[claves].mask(resultado[claves] == _CLAVE_NULA)
+    resultado["registros"] = resultado["registros"].astype(int)
+    return resultado
+
+
+@cache_por_version
 def obtener_kpi_multiskill(engine: sa.Engine, fecha_inicio: str = None, fecha_fin: str = None) -> pd.DataFrame:
     """
     Devuelve un DataFrame con KPIs de efectividad por Empresa y Propietario de Red.
     """
-    multiskill = ('instalación-hogar-fibra', 'instalación-masivo-fibra', 'incidencia manual', 'postventa-hogar-fibra', 'reparación 3play light', 'postventa-masivo-equipo', 'postventa-masivo-fibra', 'reparación empresa masivo fibra', 'reparación-hogar-fibra')
-    estados_asign = ('finalizada', 'no realizado')
-    estados_fin = ('finalizada',)
-    ids_excl = (3826, 3824, 3825, 5286, 3823, 3822)
-    noms_excl = ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')
-
-    filtro_fecha_sql = "AND a.\"Fecha Agendamiento\" BETWEEN :f_inicio AND :f_fin" if fecha_inicio else ""
+    # Se lee la tabla de hechos diaria (los IDs excluidos ya vienen fuera)
+    filtro_fecha_sql = "AND fecha BETWEEN :f_inicio AND :f_fin" if fecha_inicio else ""
 
     query = f"""
-    WITH base_filtrada AS (
-        SELECT 
-            "Empresa", 
-            lower("Estado de actividad") as estado,
-            -- <<< LÍNEA AÑADIDA >>>
-            "Propietario de Red"
-        FROM public.actividades a
-        WHERE
-            lower("Tipo de actividad") IN :multiskill
-            AND a."ID de recurso"::text NOT IN :ids_excl
-            AND lower(a."Recurso") NOT IN :noms_excl
-            {filtro_fecha_sql}
-    )
     SELECT
         "Empresa",
-        -- <<< LÍNEA AÑADIDA >>>
         "Propietario de Red",
-        COUNT(*) FILTER (WHERE estado IN :estados_asign) AS total_asignadas,
-        COUNT(*) FILTER (WHERE estado IN :estados_fin) AS total_finalizadas
-    FROM base_filtrada
-    -- <<< LÍNEA MODIFICADA >>>
+        SUM(asignadas) AS total_asignadas,
+        SUM(finalizadas) AS total_finalizadas
+    FROM public.{TABLA_KPI_DIARIO}
+    WHERE
+        {sql_en_grupo("multiskill")}
+        AND {sql_sin_nombres_excluidos()}
+        {filtro_fecha_sql}
     GROUP BY "Empresa", "Propietario de Red"
     ORDER BY "Empresa";
     """
     
-    params = { "multiskill": multiskill, "ids_excl": tuple(str(i) for i in ids_excl), "noms_excl": noms_excl, "estados_asign": estados_asign, "estados_fin": estados_fin }
+    params = {}
     if fecha_inicio:
         params["f_inicio"] = fecha_inicio
         params["f_fin"] = fecha_fin
@@ -69,62 +123,40 @@ def obtener_kpi_multiskill(engine: sa.Engine, fecha_inicio: str = None, fecha_fi
         df = safe_read_sql(connection, query, params=params)
 
     if not df.empty:
-        df['pct_efectividad'] = df.apply(
-            lambda row: (row['total_finalizadas'] / row['total_asignadas'] * 100) if row['total_asignadas'] > 0 else 0,
-            axis=1
-        )
+        df['pct_efectividad'] = porcentaje(df['total_finalizadas'], df['total_asignadas'])
         # Ahora agrupamos en Pandas para obtener el total por empresa, pero mantenemos el Propietario
         # Esto nos da flexibilidad en la app
         df_final = df.groupby(['Empresa', 'Propietario de Red']).sum().reset_index()
-        df_final['pct_efectividad'] = df_final.apply(
-            lambda row: (row['total_finalizadas'] / row['total_asignadas'] * 100) if row['total_asignadas'] > 0 else 0,
-            axis=1
-        )
+        df_final['pct_efectividad'] = porcentaje(df_final['total_finalizadas'], df_final['total_asignadas'])
         df = df_final.sort_values(by="pct_efectividad", ascending=False)
 
     return df
 
+@cache_por_version
 def obtener_kpi_mantencion(engine: sa.Engine, fecha_inicio: str = None, fecha_fin: str = None) -> pd.DataFrame:
     """
     Calcula el KPI de efectividad del mantenimiento (reparaciones) por empresa.
     Compara trabajos finalizados vs. asignados (finalizado + no realizado).
     """
-    tipos_mantenimiento = ('reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
-    # Estados para el denominador (total asignado)
-    estados_asignados = ('finalizada', 'no realizado')
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl = ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')
+    filtro_fecha_sql = "AND fecha BETWEEN :f_inicio AND :f_fin" if fecha_inicio else ""
 
-    filtro_fecha_sql = "AND \"Fecha Agendamiento\" BETWEEN :f_inicio AND :f_fin" if fecha_inicio else ""
-
-    # La consulta ahora usa COUNT(*) FILTER para contar ambos grupos en una sola pasada.
+    # Se suma sobre la tabla de hechos diaria: asignadas = finalizada + no realizado.
     query = f"""
-    WITH base_filtrada AS (
-        SELECT "Empresa", lower("Estado de actividad") as estado
-        FROM public.actividades
-        WHERE
-            lower("Tipo de actividad") IN :tipos_mantenimiento
-            AND lower("Estado de actividad") IN :estados_asignados
-            AND "ID de recurso"::text NOT IN :ids_excl
-            AND lower("Recurso") NOT IN :noms_excl
-            {filtro_fecha_sql}
-    )
     SELECT
         "Empresa" as empresa,
-        COUNT(*) as total_asignadas,
-        COUNT(*) FILTER (WHERE estado = 'finalizada') AS total_finalizadas
-    FROM
-        base_filtrada
+        SUM(asignadas) as total_asignadas,
+        SUM(finalizadas) AS total_finalizadas
+    FROM public.{TABLA_KPI_DIARIO}
+    WHERE
+        {sql_en_grupo("reparacion")}
+        AND {sql_sin_nombres_excluidos()}
+        {filtro_fecha_sql}
     GROUP BY
-        "Empresa";
+        "Empresa"
+    HAVING SUM(asignadas) > 0;
     """
     
-    params = {
-        "tipos_mantenimiento": tipos_mantenimiento,
-        "estados_asignados": estados_asignados,
-        "ids_excl": ids_excl,
-        "noms_excl": noms_excl
-    }
+    params = {}
     
     if fecha_inicio:
         params["f_inicio"] = fecha_inicio
@@ -135,42 +167,33 @@ def obtener_kpi_mantencion(engine: sa.Engine, fecha_inicio: str = None, fecha_fi
 
     # El cálculo del porcentaje se hace en Pandas para mayor seguridad.
     if not df.empty:
-        df['pct_efectividad'] = df.apply(
-            lambda row: (row['total_finalizadas'] / row['total_asignadas'] * 100) if row['total_asignadas'] > 0 else 0,
-            axis=1
-        )
+        df['pct_efectividad'] = porcentaje(df['total_finalizadas'], df['total_asignadas'])
         df = df.sort_values(by="pct_efectividad", ascending=False)
 
     return df
 
 
+@cache_por_version
 def obtener_mantenimiento_por_tecnico(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, empresa: str) -> pd.DataFrame:
     """
     Calcula el KPI de efectividad del mantenimiento por técnico para una empresa específica.
     CORREGIDO: Se ajustó la lógica de filtros y parámetros para ser robusta y consistente.
     """
-    tipos_mantenimiento = ('reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
     estados_asignados = ('finalizada', 'no realizado')
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl = ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')
     
     # --- INICIO DE LA CORRECCIÓN ---
 
-    # Se preparan los patrones para la búsqueda con ILIKE
-    noms_excl_patterns = [f'%{nom}%' for nom in noms_excl]
-
     # La consulta ahora tiene la sintaxis y lógica de filtros correcta
-    query = """
+    query = f"""
     WITH base_filtrada AS (
-        SELECT "Recurso", lower("Estado de actividad") as estado
+        SELECT "Recurso", estado_norm as estado
         FROM public.actividades
         WHERE
-            lower("Empresa") = :empresa -- CORREGIDO: lower() va en la columna
-            AND lower("Tipo de actividad") IN :tipos_mantenimiento
-            AND lower("Estado de actividad") IN :estados_asignados
-            AND "ID de recurso"::text NOT IN :ids_excl
-            -- CORREGIDO: Se usa ILIKE ANY para buscar si el nombre CONTIENE alguna de las exclusiones
-            AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
+            empresa_norm = :empresa -- columna ya normalizada (minúsculas) en la carga
+            AND {sql_en_grupo("reparacion")}
+            AND estado_norm IN :estados_asignados
+            AND {sql_sin_ids_excluidos()}
+            AND {sql_sin_nombres_excluidos()}
             AND "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
     )
     SELECT
@@ -187,10 +210,7 @@ def obtener_mantenimiento_por_tecnico(engine: sa.Engine, fecha_inicio: str, fech
     
     # El diccionario de parámetros ahora está completo y correcto
     params = {
-        "tipos_mantenimiento": tipos_mantenimiento,
         "estados_asignados": estados_asignados,
-        "ids_excl": ids_excl,
-        "noms_excl_patterns": noms_excl_patterns, # Se pasa la lista de patrones
         "empresa": empresa.lower(), # Se pasa la empresa ya en minúsculas
         "f_inicio": fecha_inicio,
         "f_fin": fecha_fin
@@ -203,54 +223,36 @@ def obtener_mantenimiento_por_tecnico(engine: sa.Engine, fecha_inicio: str, fech
         df = safe_read_sql(connection, query, params=params)
 
     if not df.empty:
-        df['pct_efectividad'] = df.apply(
-            lambda row: (row['total_finalizadas'] / row['total_asignadas'] * 100) if row['total_asignadas'] > 0 else 0,
-            axis=1
-        )
+        df['pct_efectividad'] = porcentaje(df['total_finalizadas'], df['total_asignadas'])
         df = df.sort_values(by="pct_efectividad", ascending=False).reset_index(drop=True)
 
     return df
 
 
+@cache_por_version
 def obtener_kpi_provision(engine: sa.Engine, fecha_inicio: str = None, fecha_fin: str = None) -> pd.DataFrame:
     """
     Calcula el KPI de efectividad de la provisión (instalaciones) por empresa.
     Compara trabajos finalizados vs. asignados (finalizado + no realizado).
     """
-    tipos_provision = ('instalación-hogar-fibra', 'instalación-masivo-fibra')
-    estados_asignados = ('finalizada', 'no realizado')
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl = ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')
-
-    filtro_fecha_sql = "AND \"Fecha Agendamiento\" BETWEEN :f_inicio AND :f_fin" if fecha_inicio else ""
+    filtro_fecha_sql = "AND fecha BETWEEN :f_inicio AND :f_fin" if fecha_inicio else ""
 
     query = f"""
-    WITH base_filtrada AS (
-        SELECT "Empresa", lower("Estado de actividad") as estado
-        FROM public.actividades
-        WHERE
-            lower("Tipo de actividad") IN :tipos_provision
-            AND lower("Estado de actividad") IN :estados_asignados
-            AND "ID de recurso"::text NOT IN :ids_excl
-            AND lower("Recurso") NOT IN :noms_excl
-            {filtro_fecha_sql}
-    )
     SELECT
         "Empresa" as empresa,
-        COUNT(*) as total_asignadas,
-        COUNT(*) FILTER (WHERE estado = 'finalizada') AS total_finalizadas
-    FROM
-        base_filtrada
+        SUM(asignadas) as total_asignadas,
+        SUM(finalizadas) AS total_finalizadas
+    FROM public.{TABLA_KPI_DIARIO}
+    WHERE
+        {sql_en_grupo("instalacion")}
+        AND {sql_sin_nombres_excluidos()}
+        {filtro_fecha_sql}
     GROUP BY
-        "Empresa";
+        "Empresa"
+    HAVING SUM(asignadas) > 0;
     """
     
-    params = {
-        "tipos_provision": tipos_provision,
-        "estados_asignados": estados_asignados,
-        "ids_excl": ids_excl,
-        "noms_excl": noms_excl
-    }
+    params = {}
     
     if fecha_inicio:
         params["f_inicio"] = fecha_inicio
@@ -260,10 +262,7 @@ def obtener_kpi_provision(engine: sa.Engine, fecha_inicio: str = None, fecha_fin
         df = safe_read_sql(connection, query, params=params)
 
     if not df.empty:
-        df['pct_efectividad'] = df.apply(
-            lambda row: (row['total_finalizadas'] / row['total_asignadas'] * 100) if row['total_asignadas'] > 0 else 0,
-            axis=1
-        )
+        df['pct_efectividad'] = porcentaje(df['total_finalizadas'], df['total_asignadas'])
         df = df.sort_values(by="pct_efectividad", ascending=False)
 
     return df
@@ -271,32 +270,29 @@ def obtener_kpi_provision(engine: sa.Engine, fecha_inicio: str = None, fecha_fin
 
 # En tu archivo: analisis.py
 
+@cache_por_version
 def obtener_provision_por_tecnico(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, empresa: str) -> pd.DataFrame:
     """
     Calcula el KPI de efectividad de la provisión (instalaciones) por técnico.
     CORREGIDO: Se unificaron los filtros para ser consistentes con los otros KPIs.
     """
-    # Listas de filtros
-    tipos_provision = ('instalación-hogar-fibra', 'instalación-masivo-fibra')
+    # Listas de filtros (las exclusiones vienen del registro de exclusiones)
     estados_asignados = ('finalizada', 'no realizado')
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl = ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')
-    noms_excl_patterns = [f'%{nom}%' for nom in noms_excl]
 
     # La consulta ahora incluye todos los filtros estándar y la sintaxis correcta
     query = f"""
     WITH base_filtrada AS (
-        SELECT "Recurso", lower("Estado de actividad") as estado
+        SELECT "Recurso", estado_norm as estado
         FROM public.actividades
         WHERE
             -- Se aplica el filtro de empresa a la columna, no al parámetro
-            lower("Empresa") = :empresa
-            AND lower("Tipo de actividad") IN :tipos_provision
-            AND lower("Estado de actividad") IN :estados_asignados
+            empresa_norm = :empresa
+            AND {sql_en_grupo("instalacion")}
+            AND estado_norm IN :estados_asignados
             -- Se usa la columna correcta para la exclusión de IDs
-            AND "ID de recurso"::text NOT IN :ids_excl
+            AND {sql_sin_ids_excluidos()}
             -- Se añade el filtro de exclusión por nombre de Recurso
-            AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
+            AND {sql_sin_nombres_excluidos()}
             -- El filtro de fecha está siempre presente
             AND "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
     )
@@ -314,10 +310,7 @@ def obtener_provision_por_tecnico(engine: sa.Engine, fecha_inicio: str, fecha_fi
     
     # El diccionario de parámetros ahora está completo y es correcto
     params = {
-        "tipos_provision": tipos_provision,
         "estados_asignados": estados_asignados,
-        "ids_excl": ids_excl,
-        "noms_excl_patterns": noms_excl_patterns,
         "empresa": empresa.lower(),
         "f_inicio": fecha_inicio,
         "f_fin": fecha_fin
@@ -327,24 +320,21 @@ def obtener_provision_por_tecnico(engine: sa.Engine, fecha_inicio: str, fecha_fi
         df = safe_read_sql(connection, query, params=params)
 
     if not df.empty:
-        df['pct_efectividad'] = df.apply(
-            lambda row: (row['total_finalizadas'] / row['total_asignadas'] * 100) if row['total_asignadas'] > 0 else 0,
-            axis=1
-        )
+        df['pct_efectividad'] = porcentaje(df['total_finalizadas'], df['total_asignadas'])
         df = df.sort_values(by="pct_efectividad", ascending=False).reset_index(drop=True)
 
     return df
 
 
+@cache_por_version
 def get_company_list(engine: sa.Engine) -> list:
-    """Obtiene una lista única de todas las empresas en la base de datos."""
-    try:
-        with engine.connect() as connection:
-            df_empresas = pd.read_sql(text('SELECT DISTINCT "Empresa" FROM public.actividades ORDER BY "Empresa"'), connection)
-        return df_empresas["Empresa"].tolist()
-    except Exception as e:
-        print(f"Error al obtener lista de empresas: {e}")
-        return []
+    """
+    Obtiene una lista única de todas las empresas en la base de datos. Los errores se propagan:
+    una lista vacía quedaría en caché hasta la próxima carga (el llamador decide cómo degradar).
+    """
+    with engine.connect() as connection:
+        df_empresas = safe_read_sql(connection, 'SELECT DISTINCT "Empresa" FROM public.actividades ORDER BY "Empresa"')
+    return df_empresas["Empresa"].tolist()
 
 
 
@@ -352,65 +342,32 @@ def get_company_list(engine: sa.Engine) -> list:
 
 # En analisis.py
 
+@cache_por_version
 def obtener_resumen_general_rt(engine: sa.Engine, fecha_inicio: str = None, fecha_fin: str = None) -> pd.DataFrame:
     """
     Calcula un resumen de reincidencias por empresa.
-    CORRECCIÓN FINAL: Se estandarizan todos los filtros para ser idénticos a los del Ranking.
+    Lee la tabla visitas_enriquecidas (mismo universo y filtros que el Ranking).
     """
-    tipos_validos = ('reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl = ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')
-    noms_excl_patterns = [f'%{nom}%' for nom in noms_excl]
-    
-    filtro_fecha_sql = "AND \"Fecha Agendamiento\" BETWEEN :f_inicio AND :f_fin" if fecha_inicio else ""
+    con_rango = bool(fecha_inicio)
+    filtro_fecha_sql = "AND \"Fecha Agendamiento\" BETWEEN :f_inicio AND :f_fin" if con_rango else ""
+    es_reincidencia = condicion_reincidencia(con_rango)
 
+    # La reincidencia se atribuye a la empresa de la primera visita, que es la misma fila
     query = f"""
-    WITH visitas_enriquecidas AS (
-        SELECT 
-            "Empresa", "Cod_Servicio", "Fecha Agendamiento", "ID de recurso", "Recurso",
-            FIRST_VALUE("Empresa") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as primera_empresa_servicio,
-            ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita,
-            LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
-        FROM public.actividades
-        WHERE 
-            lower("Estado de actividad") = 'finalizada'
-            AND lower("Tipo de actividad") IN :tipos_validos
-            AND "ID de recurso"::text NOT IN :ids_excl
-            AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns]) -- <<< LÓGICA CORREGIDA
-            {filtro_fecha_sql}
-    ),
-    totales_por_empresa AS (
-        SELECT "Empresa", COUNT(*) AS total_actividades
-        FROM visitas_enriquecidas
-        GROUP BY "Empresa"
-    ),
-    reincidencias_por_empresa AS (
-        SELECT 
-            primera_empresa_servicio AS "Empresa",
-            COUNT(*) as total_reincidencias
-        FROM visitas_enriquecidas
-        WHERE orden_visita = 1
-            AND fecha_siguiente_visita IS NOT NULL
-            AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days'
-        GROUP BY primera_empresa_servicio
-    )
     SELECT
-        tpe."Empresa" AS empresa,
-        COALESCE(rpe.total_reincidencias, 0) AS reincidencias,
-        tpe.total_actividades AS total_finalizadas,
-        ROUND(COALESCE((rpe.total_reincidencias::NUMERIC * 100.0) / NULLIF(tpe.total_actividades, 0), 0.0), 2) AS porcentaje_reincidencia
-    FROM totales_por_empresa tpe
-    LEFT JOIN reincidencias_por_empresa rpe ON tpe."Empresa" = rpe."Empresa"
+        "Empresa" AS empresa,
+        COUNT(*) FILTER (WHERE {es_reincidencia}) AS reincidencias,
+        COUNT(*) AS total_finalizadas,
+        ROUND(COALESCE((COUNT(*) FILTER (WHERE {es_reincidencia}))::NUMERIC * 100.0 / NULLIF(COUNT(*), 0), 0.0), 2) AS porcentaje_reincidencia
+    FROM public.{TABLA_VISITAS}
+    WHERE es_reparacion
+        {filtro_fecha_sql}
+    GROUP BY "Empresa"
     ORDER BY porcentaje_reincidencia DESC;
     """
-    
-    params = {
-        "tipos_validos": tipos_validos,
-        "ids_excl": ids_excl,
-        "noms_excl_patterns": noms_excl_patterns
-    }
-    
-    if fecha_inicio:
+
+    params = {}
+    if con_rango:
         params["f_inicio"] = fecha_inicio
         params["f_fin"] = fecha_fin
 
@@ -418,53 +375,37 @@ def obtener_resumen_general_rt(engine: sa.Engine, fecha_inicio: str = None, fech
         df = safe_read_sql(connection, query, params=params)
     return df
 
+@cache_por_version
 def obtener_distribucion_reincidencias(engine: sa.Engine, fecha_inicio: str = None, fecha_fin: str = None) -> pd.DataFrame:
     """
     Calcula el número total de reincidencias para cada tipo de actividad de reparación.
     CORREGIDO: Maneja correctamente las fechas opcionales.
     """
-    tipos_reparacion = ('reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl = ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')
-
-    # Se preparan la consulta y los parámetros
-    params = {"tipos_reparacion": tipos_reparacion, "ids_excl": ids_excl, "noms_excl": noms_excl}
+    params = {}
     filtro_fecha_sql = ""
-    
+    con_rango = False
+
     # Esta condición robusta comprueba que las fechas sean válidas
     if fecha_inicio and str(fecha_inicio).lower() != 'none' and fecha_fin and str(fecha_fin).lower() != 'none':
+        con_rango = True
         filtro_fecha_sql = 'AND "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin'
         params["f_inicio"] = fecha_inicio
         params["f_fin"] = fecha_fin
-    
+
     query = f"""
-    WITH visitas_enriquecidas AS (
-        SELECT 
-            lower("Tipo de actividad") as tipo_actividad,
-            "Cod_Servicio", "Fecha Agendamiento",
-            ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita,
-            LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
-        FROM public.actividades
-        WHERE 
-            lower("Estado de actividad") = 'finalizada'
-            AND lower("Tipo de actividad") IN :tipos_reparacion
-            AND "ID de recurso"::text NOT IN :ids_excl
-            AND lower("Recurso") NOT IN :noms_excl
-            {filtro_fecha_sql}
-    )
-    SELECT 
-        tipo_actividad,
+    SELECT
+        tipo_actividad_norm AS tipo_actividad,
         COUNT(*) as total_reincidencias
-    FROM visitas_enriquecidas
-    WHERE orden_visita = 1
-        AND fecha_siguiente_visita IS NOT NULL
-        AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days'
-    GROUP BY tipo_actividad
+    FROM public.{TABLA_VISITAS}
+    WHERE es_reparacion
+        AND {condicion_reincidencia(con_rango)}
+        {filtro_fecha_sql}
+    GROUP BY tipo_actividad_norm
     ORDER BY total_reincidencias DESC;
     """
-    
+
     with engine.connect() as connection:
-        df = pd.read_sql_query(text(query), connection, params=params)
+        df = safe_read_sql(connection, query, params)
     return df
 
 ############################### Resuemen General Fallas tempranas ########################################################
@@ -472,493 +413,341 @@ def obtener_distribucion_reincidencias(engine: sa.Engine, fecha_inicio: str = No
 
 # En tu archivo: analisis.py
 
+@cache_por_version
 def obtener_resumen_general_ft(engine: sa.Engine, fecha_inicio: str = None, fecha_fin: str = None) -> pd.DataFrame:
     """
     Calcula un resumen de Fallas Tempranas por empresa para la vista general.
-    VERSIÓN DEFINITIVA: Utiliza la misma lógica y filtros que la función de Ranking
-    para garantizar 100% de consistencia en los resultados.
+    Lee la tabla visitas_enriquecidas, con la misma lógica y filtros que la función de Ranking.
     """
-    # Listas de filtros y exclusiones estándar
-    tipos_reparacion = ('reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
-    tipos_instalacion = ('instalación-hogar-fibra', 'instalación-masivo-fibra')
-    todos_tipos = tipos_reparacion + tipos_instalacion
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl_patterns = [f'%{nom}%' for nom in ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')]
+    es_falla = condicion_falla_temprana()
 
-    # La consulta ahora es un espejo de la lógica del Ranking
-    query = """
-    WITH base_calidad_falla_temprana AS (
-        -- Universo de datos para fallas tempranas (INSTALACIONES Y REPARACIONES)
-        -- Esta CTE es idéntica a la de la función de Ranking
-        SELECT 
-            "Empresa", "Cod_Servicio", "Fecha Agendamiento", "ID de recurso", "Recurso",
-            lower("Tipo de actividad") as tipo_actividad,
-            FIRST_VALUE("Empresa") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as primera_empresa_servicio,
-            ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita,
-            LEAD(lower("Tipo de actividad")) OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as tipo_siguiente_visita,
-            LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
-        FROM public.actividades
-        WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
-            AND lower("Estado de actividad") = 'finalizada'
-            AND (lower("Tipo de actividad") IN :tipos_reparacion OR lower("Tipo de actividad") IN :tipos_instalacion)
-            AND "ID de recurso"::text NOT IN :ids_excl
-            AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
-    ),
-    kpis_produccion AS (
-        -- El denominador (total de instalaciones) se calcula sobre la empresa que hizo el trabajo
-        SELECT "Empresa", COUNT(*) as total_instalaciones
-        FROM base_calidad_falla_temprana
-        WHERE tipo_actividad IN :tipos_instalacion
-        GROUP BY "Empresa"
-    ),
-    kpis_fallas AS (
-        -- El numerador (fallas) se atribuye a la PRIMERA empresa que atendió el servicio
-        SELECT primera_empresa_servicio as "Empresa", COUNT(*) as total_fallas_tempranas
-        FROM base_calidad_falla_temprana
-        WHERE tipo_actividad IN :tipos_instalacion 
-          AND orden_visita = 1 
-          AND fecha_siguiente_visita IS NOT NULL 
-          AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days' 
-          AND tipo_siguiente_visita IN :tipos_reparacion
-        GROUP BY primera_empresa_servicio
-    )
-    -- Unimos los resultados y calculamos el KPI
-    SELECT 
-        p."Empresa" as empresa,
-        p.total_instalaciones,
-        COALESCE(f.total_fallas_tempranas, 0) as fallas_tempranas,
+    # El denominador son las instalaciones de la empresa; la falla se atribuye a la empresa
+    # de la primera visita, que en una instalación-primera-visita es la misma fila.
+    query = f"""
+    SELECT
+        "Empresa" as empresa,
+        COUNT(*) as total_instalaciones,
+        COUNT(*) FILTER (WHERE {es_falla}) as fallas_tempranas,
         ROUND(
-            COALESCE((f.total_fallas_tempranas::NUMERIC * 100.0) / NULLIF(p.total_instalaciones, 0), 0.0), 2
+            COALESCE((COUNT(*) FILTER (WHERE {es_falla}))::NUMERIC * 100.0 / NULLIF(COUNT(*), 0), 0.0), 2
         ) AS porcentaje_falla
-    FROM kpis_produccion p
-    LEFT JOIN kpis_fallas f ON p."Empresa" = f."Empresa"
-    WHERE p.total_instalaciones > 0
+    FROM public.{TABLA_VISITAS}
+    WHERE es_instalacion
+        AND "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
+    GROUP BY "Empresa"
     ORDER BY porcentaje_falla DESC;
     """
-    
-    # El diccionario de parámetros ahora está completo y es robusto
+
     params = {
         "f_inicio": fecha_inicio if fecha_inicio else '1900-01-01',
         "f_fin": fecha_fin if fecha_fin else '2999-12-31',
-        "tipos_reparacion": tipos_reparacion,
-        "tipos_instalacion": tipos_instalacion,
-        "ids_excl": ids_excl,
-        "noms_excl_patterns": noms_excl_patterns
     }
-    
+
     with engine.begin() as connection:
         df = safe_read_sql(connection, query, params=params)
-        
+
     return df
 ########################################### Reincidencias#################################################################
 
 # En tu archivo: analisis.py
 
+@cache_por_version
 def obtener_resumen_rt_por_empresa(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, empresa: str) -> pd.DataFrame:
     """
     Calcula el desglose de Reincidencias por técnico para una empresa específica.
-    CORRECCIÓN DEFINITIVA: Se clona la lógica de la función general para 100% de consistencia.
+    Usa la misma tabla visitas_enriquecidas que la función general para 100% de consistencia.
     """
-    # Se usan los mismos filtros estándar que la función de referencia
-    tipos_validos = ('reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl_patterns = [f'%{nom}%' for nom in ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')]
-    
-    # Se usa el mismo método de filtro de fecha que te funciona
     filtro_fecha_sql = "AND \"Fecha Agendamiento\" BETWEEN :f_inicio AND :f_fin" if fecha_inicio else ""
+    es_reincidencia = condicion_reincidencia(bool(fecha_inicio))
 
     query = f"""
-    WITH visitas_enriquecidas AS (
-        -- Este CTE es idéntico al de la función general de reincidencias
-        SELECT 
-            "Recurso", "Cod_Servicio", "Empresa", "Fecha Agendamiento", "ID de recurso",
-            FIRST_VALUE("Empresa") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as primera_empresa_servicio,
-            ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita,
-            LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
-        FROM public.actividades
-        WHERE 
-            lower("Estado de actividad") = 'finalizada'
-            AND lower("Tipo de actividad") IN :tipos_validos
-            AND "ID de recurso"::text NOT IN :ids_excl
-            AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
-            {filtro_fecha_sql}
-    ),
-    total_por_recurso AS (
-        -- El denominador: total de reparaciones del técnico en la empresa seleccionada
-        SELECT "Recurso", COUNT(*) as total_finalizadas
-        FROM visitas_enriquecidas 
-        WHERE lower("Empresa") = lower(:empresa) 
-        GROUP BY "Recurso"
-    ),
-    reincidencias_por_recurso AS (
-        -- El numerador: reincidencias atribuidas al técnico si la empresa de la primera visita es la seleccionada
-        SELECT "Recurso", COUNT(*) as total_reincidencias
-        FROM visitas_enriquecidas
-        WHERE orden_visita = 1 
-          AND lower(primera_empresa_servicio) = lower(:empresa)
-          AND fecha_siguiente_visita IS NOT NULL
-          AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days'
-        GROUP BY "Recurso"
-    )
-    -- El SELECT final une los resultados por técnico
     SELECT
-        tpr."Recurso" AS recurso, 
-        tpr.total_finalizadas, 
-        COALESCE(rpr.total_reincidencias, 0) AS total_reincidencias,
-        ROUND((COALESCE(rpr.total_reincidencias, 0)::NUMERIC * 100) / NULLIF(tpr.total_finalizadas, 0)::NUMERIC, 2) AS porcentaje_reincidencia
-    FROM total_por_recurso tpr
-    LEFT JOIN reincidencias_por_recurso rpr ON tpr."Recurso" = rpr."Recurso"
-    ORDER BY porcentaje_reincidencia DESC, tpr."Recurso";
+        "Recurso" AS recurso,
+        COUNT(*) AS total_finalizadas,
+        COUNT(*) FILTER (WHERE {es_reincidencia}) AS total_reincidencias,
+        ROUND((COUNT(*) FILTER (WHERE {es_reincidencia}))::NUMERIC * 100 / NULLIF(COUNT(*), 0)::NUMERIC, 2) AS porcentaje_reincidencia
+    FROM public.{TABLA_VISITAS}
+    WHERE es_reparacion
+        AND empresa_norm = lower(:empresa)
+        {filtro_fecha_sql}
+    GROUP BY "Recurso"
+    ORDER BY porcentaje_reincidencia DESC, "Recurso";
     """
-    
+
     params = {
-        'f_inicio': fecha_inicio, 
-        'f_fin': fecha_fin, 
+        'f_inicio': fecha_inicio,
+        'f_fin': fecha_fin,
         'empresa': empresa,
-        'tipos_validos': tipos_validos,
-        'ids_excl': ids_excl,
-        'noms_excl_patterns': noms_excl_patterns
     }
-    
+
     with engine.begin() as connection:
         df = safe_read_sql(connection, query, params=params)
-        
+
     return df
 
 
-def obtener_detalle_rt(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, empresa: str, recurso: str) -> pd.DataFrame:
-    # (El código SQL de esta función no cambia, es correcto)
-    query = """
-    WITH visitas_enriquecidas AS (
-        SELECT 
-            "Recurso", "Cod_Servicio", "Empresa", "Fecha Agendamiento", "Tipo de actividad", "Observación", "Acción realizada", 
-            "Nombre Cliente", "Dirección", "Comuna", "Propietario de Red",
-            FIRST_VALUE("Empresa") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as primera_empresa_servicio,
-            LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita,
-            ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita
-        FROM public.actividades
-        WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin AND lower("Estado de actividad") = 'finalizada'
-            AND lower("Tipo de actividad") IN ('reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
-            AND "ID de recurso"::text NOT IN ('3826', '3824', '3825', '5286', '3823', '3822')
-    ),
-    servicios_fallidos_del_tecnico AS (
+@cache_por_version
+def obtener_detalle_rt(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, empresa: str, recurso: str, formato: str = "pandas") -> pd.DataFrame:
+    """Lista todas las visitas del período de los servicios donde el técnico generó una reincidencia."""
+    query = f"""
+    WITH servicios_fallidos_del_tecnico AS (
         SELECT DISTINCT "Cod_Servicio"
-        FROM visitas_enriquecidas
-        WHERE orden_visita = 1 AND lower(primera_empresa_servicio) = lower(:empresa) AND "Recurso" = :recurso
-            AND fecha_siguiente_visita IS NOT NULL AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days'
+        FROM public.{TABLA_VISITAS}
+        WHERE es_reparacion
+            AND "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
+            AND empresa_norm = lower(:empresa) AND "Recurso" = :recurso
+            AND {condicion_reincidencia()}
     )
     SELECT "Empresa", "Cod_Servicio", "Recurso", "Fecha Agendamiento", "Tipo de actividad", "Observación", "Acción realizada", "Nombre Cliente", "Dirección", "Comuna", "Propietario de Red"
-    FROM visitas_enriquecidas ve
-    WHERE ve."Cod_Servicio" IN (SELECT "Cod_Servicio" FROM servicios_fallidos_del_tecnico)
+    FROM public.{TABLA_VISITAS} ve
+    WHERE ve.es_reparacion
+        AND ve."Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
+        AND ve."Cod_Servicio" IN (SELECT "Cod_Servicio" FROM servicios_fallidos_del_tecnico)
     ORDER BY ve."Cod_Servicio", ve."Fecha Agendamiento";
     """
     # Se crea el diccionario de parámetros
     params = {
-        'f_inicio': fecha_inicio, 
-        'f_fin': fecha_fin, 
-        'empresa': empresa, 
+        'f_inicio': fecha_inicio,
+        'f_fin': fecha_fin,
+        'empresa': empresa,
         'recurso': recurso
     }
 
-    # Se ejecuta la consulta usando la función de seguridad con los argumentos en el orden correcto
     with engine.begin() as connection:
-        df = safe_read_sql(connection, query, params=params) # <-- CORRECCIÓN AQUÍ
-        
-    return df
-
-# En funciones/analisis.py
+        df = safe_read_sql(connection, query, params, formato=formato)
 
-def obtener_historial_rodante_rt(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, recurso: str) -> pd.DataFrame:
-    """Calcula la tasa de reincidencia móvil de 10 días para un técnico (VERSIÓN CORREGIDA)."""
-    f_inicio_obj = datetime.strptime(fecha_inicio, '%Y-%m-%d')
-    f_inicio_ampliado_obj = f_inicio_obj - timedelta(days=10)
-    f_inicio_ampliado_str = f_inicio_ampliado_obj.strftime('%Y-%m-%d')
-    
-    tipos_validos = ('reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
+    return df
 
-    query = f"""
-    WITH visitas_enriquecidas AS (
-        -- Paso 1: Obtenemos TODAS las visitas de reparación relevantes, sin filtrar por técnico aún.
-        SELECT 
-            "Recurso", "Cod_Servicio", "Fecha Agendamiento",
-            ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita,
-            LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
-        FROM public.actividades
-        WHERE 
-            "Fecha Agendamiento" BETWEEN :f_inicio_ampliado AND :f_fin
-            AND lower("Estado de actividad") = 'finalizada'
-            AND lower("Tipo de actividad") IN :tipos_validos
-            AND "ID de recurso"::text NOT IN :ids_excl
-    ),
-    visitas_con_logica_reincidencia AS (
-        -- Paso 2: Aplicamos la lógica de reincidencia. Marcamos la visita que causó la falla.
-        SELECT
-            "Recurso",
-            "Fecha Agendamiento"::date as fecha_visita,
-            1 as es_actividad, -- Cada fila es una actividad de reparación
-            CASE 
-                WHEN orden_visita = 1
-                AND fecha_siguiente_visita IS NOT NULL
-                AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days'
-            THEN 1 ELSE 0 END as es_reincidencia_causada
-        FROM visitas_enriquecidas
-    ),
-    stats_diarias_tecnico AS (
-        -- Paso 3: AHORA SÍ filtramos por el técnico y agrupamos por día.
-        SELECT 
-            fecha_visita, 
-            SUM(es_actividad) as total_actividades_dia, 
-            SUM(es_reincidencia_causada) as total_reincidencias_dia
-        FROM visitas_con_logica_reincidencia
-        WHERE "Recurso" = :recurso
-        GROUP BY fecha_visita
-    )
-    -- Paso 4: Calculamos la suma móvil de 10 días.
-    SELECT
-        fecha_visita,
-        SUM(total_actividades_dia) OVER (ORDER BY fecha_visita RANGE BETWEEN INTERVAL '9 days' PRECEDING AND CURRENT ROW) as total_movil_10_dias,
-        SUM(total_reincidencias_dia) OVER (ORDER BY fecha_visita RANGE BETWEEN INTERVAL '9 days' PRECEDING AND CURRENT ROW) as reincidencias_movil_10_dias
-    FROM stats_diarias_tecnico
-    WHERE fecha_visita BETWEEN :f_inicio AND :f_fin;
+def obtener_historial_rodante_rt(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, recurso: str,
+                                 empresa: str = None) -> pd.DataFrame:
     """
-    
-    params = {
-        'f_inicio': fecha_inicio, 
-        'f_fin': fecha_fin, 
-        'recurso': recurso, 
-        'f_inicio_ampliado': f_inicio_ampliado_str,
-        'tipos_validos': tipos_validos,
-        'ids_excl': ids_excl
-    }
-    
-    with engine.begin() as connection:
-        # Usamos la función segura que ya tienes definida
-        df = safe_read_sql(connection, query, params=params)
-
-    if not df.empty:
-        df['tasa_reincidencia_movil'] = df.apply(
-            lambda row: (row['reincidencias_movil_10_dias'] / row['total_movil_10_dias'] * 100) if row['total_movil_10_dias'] > 0 else 0, 
-            axis=1
-        )
-        df = df.set_index('fecha_visita')
-        
-    return df
+    Tasa de reincidencia móvil de 10 días para un técnico: su tramo de obtener_historiales_rodantes.
+    Con 'empresa' solo se calculan las series de los técnicos de esa empresa.
+    """
+    return historial_de_tecnico(obtener_historiales_rodantes(engine, fecha_inicio, fecha_fin, empresa), recurso, "rt")
 
 ####################################  fallas Tempranas #########################################
 
 # En tu archivo: analisis.py
 
+@cache_por_version
 def obtener_resumen_ft_por_empresa(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, empresa: str) -> pd.DataFrame:
     """
     Calcula el desglose de Fallas Tempranas por técnico para una empresa específica.
-    CORRECCIÓN DEFINITIVA: Se estandariza la consulta para ser 100% consistente con la del Ranking.
+    Lee la tabla visitas_enriquecidas, 100% consistente con la del Ranking.
     """
-    # Listas de filtros y exclusiones estándar
-    instalacion_tipos = ('instalación-hogar-fibra', 'instalación-masivo-fibra')
-    reparacion_tipos = ('reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
-    todos_tipos = instalacion_tipos + reparacion_tipos
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl = ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')
-    noms_excl_patterns = [f'%{nom}%' for nom in noms_excl]
-
-    # Consulta reestructurada para máxima precisión y consistencia
-    query = """
-    WITH visitas_enriquecidas AS (
-        -- Obtenemos el universo de datos completo y limpio, con todos los filtros estándar
-        SELECT 
-            "Recurso", "Cod_Servicio", "Empresa", "Fecha Agendamiento", "ID de recurso",
-            lower("Tipo de actividad") as tipo_actividad,
-            ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita,
-            LEAD(lower("Tipo de actividad")) OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as tipo_siguiente_visita,
-            LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
-        FROM public.actividades
-        WHERE 
-            "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
-            AND lower("Estado de actividad") = 'finalizada'
-            AND lower("Tipo de actividad") IN :todos_tipos
-            AND "ID de recurso"::text NOT IN :ids_excl
-            AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
-    )
-    -- Agrupamos directamente por técnico para la empresa seleccionada
+    query = f"""
     SELECT
         "Recurso" AS recurso,
-        -- Contamos las instalaciones hechas por el técnico en la empresa seleccionada
-        COUNT(*) FILTER (WHERE tipo_actividad IN :instalacion_tipos) as total_instalaciones,
-        -- Contamos las fallas generadas por esas mismas instalaciones
-        COUNT(*) FILTER (
-            WHERE tipo_actividad IN :instalacion_tipos
-            AND orden_visita = 1 -- Asegura que fue la primera visita (la instalación)
-            AND fecha_siguiente_visita IS NOT NULL
-            AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days'
-            AND tipo_siguiente_visita IN :reparacion_tipos
-        ) AS total_fallas_tempranas
-    FROM visitas_enriquecidas
-    WHERE lower("Empresa") = lower(:empresa) AND "Recurso" IS NOT NULL AND trim("Recurso") <> ''
+        -- Instalaciones hechas por el técnico en la empresa seleccionada
+        COUNT(*) as total_instalaciones,
+        -- Fallas generadas por esas mismas instalaciones (primera visita del período)
+        COUNT(*) FILTER (WHERE {condicion_falla_temprana()}) AS total_fallas_tempranas
+    FROM public.{TABLA_VISITAS}
+    WHERE es_instalacion
+        AND "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
+        AND empresa_norm = lower(:empresa) AND "Recurso" IS NOT NULL AND trim("Recurso") <> ''
     GROUP BY "Recurso"
-    HAVING COUNT(*) FILTER (WHERE tipo_actividad IN :instalacion_tipos) > 0 -- Solo técnicos con instalaciones
     """
-    
+
     params = {
-        'f_inicio': fecha_inicio, 
-        'f_fin': fecha_fin, 
+        'f_inicio': fecha_inicio,
+        'f_fin': fecha_fin,
         'empresa': empresa,
-        'instalacion_tipos': instalacion_tipos,
-        'reparacion_tipos': reparacion_tipos,
-        'todos_tipos': todos_tipos,
-        'ids_excl': ids_excl,
-        'noms_excl_patterns': noms_excl_patterns
     }
-    
+
     with engine.begin() as connection:
         df = safe_read_sql(connection, query, params=params)
-    
+
     if not df.empty:
-        df['porcentaje_falla'] = df.apply(
-            lambda row: (row['total_fallas_tempranas'] / row['total_instalaciones'] * 100) if row['total_instalaciones'] > 0 else 0,
-            axis=1
-        ).round(2)
+        df['porcentaje_falla'] = porcentaje(df['total_fallas_tempranas'], df['total_instalaciones'], decimales=2)
         df = df.sort_values(by="porcentaje_falla", ascending=False).reset_index(drop=True)
 
     return df
 
 
 
-def obtener_detalle_ft(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, empresa: str, recurso: str) -> pd.DataFrame:
-    # (El código SQL de esta función no cambia, es correcto)
-    query = """
-    WITH visitas_enriquecidas AS (
-        SELECT 
-            "Recurso", "Cod_Servicio", "Empresa", "Fecha Agendamiento", "Tipo de actividad", "Observación", "Acción realizada", 
-            "Nombre Cliente", "Dirección", "Comuna",
-            lower("Tipo de actividad") as tipo_actividad,
-            FIRST_VALUE("Empresa") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as primera_empresa_servicio,
-            LEAD(lower("Tipo de actividad")) OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as tipo_siguiente_visita,
-            LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
-        FROM public.actividades
-        WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin AND lower("Estado de actividad") = 'finalizada'
-            AND lower("Tipo de actividad") IN ('instalación-hogar-fibra', 'instalación-masivo-fibra', 'reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
-            AND "ID de recurso"::text NOT IN ('3826', '3824', '3825', '5286', '3823', '3822')
-    ),
-    servicios_con_falla_del_tecnico AS (
+@cache_por_version
+def obtener_detalle_ft(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, empresa: str, recurso: str, formato: str = "pandas") -> pd.DataFrame:
+    """Lista todas las visitas del período de los servicios donde una instalación del técnico tuvo falla temprana."""
+    query = f"""
+    WITH servicios_con_falla_del_tecnico AS (
         SELECT DISTINCT "Cod_Servicio"
-        FROM visitas_enriquecidas
-        WHERE tipo_actividad IN ('instalación-hogar-fibra', 'instalación-masivo-fibra')
-            AND lower(primera_empresa_servicio) = lower(:empresa) AND "Recurso" = :recurso
-            AND fecha_siguiente_visita IS NOT NULL AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days'
-            AND tipo_siguiente_visita IN ('reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
+        FROM public.{TABLA_VISITAS}
+        WHERE es_instalacion
+            AND "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
+            AND empresa_norm = lower(:empresa) AND "Recurso" = :recurso
+            AND {condicion_falla_temprana()}
     )
     SELECT "Empresa", "Cod_Servicio", "Recurso", "Fecha Agendamiento", "Tipo de actividad", "Observación", "Acción realizada", "Nombre Cliente", "Dirección", "Comuna"
-    FROM visitas_enriquecidas
-    WHERE "Cod_Servicio" IN (SELECT "Cod_Servicio" FROM servicios_con_falla_del_tecnico)
+    FROM public.{TABLA_VISITAS}
+    WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
+        AND "Cod_Servicio" IN (SELECT "Cod_Servicio" FROM servicios_con_falla_del_tecnico)
     ORDER BY "Cod_Servicio", "Fecha Agendamiento";
     """
     # Se crea el diccionario de parámetros
     params = {
-        'f_inicio': fecha_inicio, 
-        'f_fin': fecha_fin, 
-        'empresa': empresa, 
+        'f_inicio': fecha_inicio,
+        'f_fin': fecha_fin,
+        'empresa': empresa,
         'recurso': recurso
     }
 
-    # Se ejecuta la consulta usando la función de seguridad con los argumentos en el orden correcto
     with engine.begin() as connection:
-        df = safe_read_sql(connection, query, params=params) # <-- CORRECCIÓN AQUÍ
-        
+        df = safe_read_sql(connection, query, params, formato=formato)
+
     return df
 
 
 # En tu archivo: analisis.py
 
-def obtener_historial_rodante_ft(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, recurso: str) -> pd.DataFrame:
-    """Calcula la tasa de Falla Temprana móvil de 10 días para un técnico (VERSIÓN CORREGIDA)."""
-    f_inicio_obj = datetime.strptime(fecha_inicio, '%Y-%m-%d')
-    f_inicio_ampliado_obj = f_inicio_obj - timedelta(days=10)
-    f_inicio_ampliado_str = f_inicio_ampliado_obj.strftime('%Y-%m-%d')
+def obtener_historial_rodante_ft(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, recurso: str,
+                                 empresa: str = None) -> pd.DataFrame:
+    """
+    Tasa de Falla Temprana móvil de 10 días para un técnico: su tramo de obtener_historiales_rodantes.
+    Con 'empresa' solo se calculan las series de los técnicos de esa empresa.
+    """
+    return historial_de_tecnico(obtener_historiales_rodantes(engine, fecha_inicio, fecha_fin, empresa), recurso, "ft")
+
+######################### Historial móvil de todos los técnicos ##############################
+
+# Columnas de obtener_historiales_rodantes que forman cada serie, con los nombres que tenían
+# los historiales por técnico: indicador -> (actividades del día, {columna: nombre en la serie})
+SERIES_HISTORIAL = {
+    "rt": ("reparaciones_dia", {
+        "reparaciones_movil_10_dias": "total_movil_10_dias",
+        "reincidencias_movil_10_dias": "reincidencias_movil_10_dias",
+        "tasa_reincidencia_movil": "tasa_reincidencia_movil",
+    }),
+    "ft": ("instalaciones_dia", {
+        "instalaciones_movil_10_dias": "total_movil_10_dias",
+        "fallas_movil_10_dias": "fallas_movil_10_dias",
+        "tasa_falla_movil": "tasa_falla_movil",
+    }),
+}
+
+
+@cache_por_version
+def obtener_historiales_rodantes(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, empresa: str = None) -> pd.DataFrame:
+    """
+    Tasas móviles de 10 días de reincidencia y de falla temprana de todos los técnicos, en una sola
+    pasada por visitas_enriquecidas (ventana PARTITION BY técnico). Con 'empresa' se limita a los
+    técnicos que trabajaron para ella en el período; sin ella, todos. Una fila por técnico y día
+    con actividad; el gráfico de un técnico es un tramo de este resultado (historial_de_tecnico).
+    """
+    f_inicio_ampliado = (datetime.strptime(fecha_inicio, '%Y-%m-%d') - timedelta(days=10)).strftime('%Y-%m-%d')
+    filtro_empresa = ""
+    if empresa:
+        # Se filtra por técnico y no por visita: la serie de cada técnico incluye todas sus visitas
+        filtro_empresa = f"""
+            AND "Recurso" IN (
+                SELECT DISTINCT "Recurso" FROM public.{TABLA_VISITAS}
+                WHERE empresa_norm = lower(:empresa) AND "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
+            )"""
 
-    # --- INICIO DE LA CORRECCIÓN ---
-    # Se definen todas las listas de filtros y exclusiones para consistencia
-    instalacion_tipos = ('instalación-hogar-fibra', 'instalación-masivo-fibra')
-    reparacion_tipos = ('reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
-    todos_tipos = instalacion_tipos + reparacion_tipos
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl = ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')
-    noms_excl_patterns = [f'%{nom}%' for nom in noms_excl]
-    # --- FIN DE LA CORRECIÓN ---
-    
-    # La consulta ahora incluye los filtros de exclusión que faltaban
     query = f"""
-    WITH visitas_enriquecidas AS (
-        SELECT 
-            "Recurso", "Cod_Servicio", "Fecha Agendamiento",
-            lower("Tipo de actividad") as tipo_actividad,
-            LEAD(lower("Tipo de actividad")) OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as tipo_siguiente_visita,
-            LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
-        FROM public.actividades
-        WHERE 
-            "Fecha Agendamiento" BETWEEN :f_inicio_ampliado AND :f_fin
-            AND lower("Estado de actividad") = 'finalizada'
-            AND lower("Tipo de actividad") IN :todos_tipos
-            -- <<< FILTROS AÑADIDOS >>>
-            AND "ID de recurso"::text NOT IN :ids_excl
-            AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
-    ),
-    visitas_con_logica_falla AS (
+    WITH stats_diarias AS (
+        -- Paso 1: Actividades, reincidencias y fallas de cada técnico por día, desde el inicio ampliado
         SELECT
-            "Recurso",
-            "Fecha Agendamiento"::date as fecha_visita,
-            CASE WHEN tipo_actividad IN :instalacion_tipos THEN 1 ELSE 0 END as es_instalacion,
-            CASE 
-                WHEN tipo_actividad IN :instalacion_tipos
-                AND fecha_siguiente_visita IS NOT NULL
-                AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days'
-                AND tipo_siguiente_visita IN :reparacion_tipos
-            THEN 1 ELSE 0 END as es_falla_causada
-        FROM visitas_enriquecidas
+            "Recurso" AS recurso,
+            "Fecha Agendamiento"::date AS fecha_visita,
+            COUNT(*) FILTER (WHERE es_reparacion) AS reparaciones_dia,
+            COUNT(*) FILTER (WHERE es_reparacion AND {condicion_reincidencia(param_inicio="f_inicio_ampliado")}) AS reincidencias_dia,
+            COUNT(*) FILTER (WHERE es_instalacion) AS instalaciones_dia,
+            COUNT(*) FILTER (WHERE es_instalacion AND {condicion_falla_temprana(param_inicio="f_inicio_ampliado", solo_primera=False)}) AS fallas_dia
+        FROM public.{TABLA_VISITAS}
+        WHERE (es_reparacion OR es_instalacion)
+            AND "Fecha Agendamiento" BETWEEN :f_inicio_ampliado AND :f_fin
+            AND "Recurso" IS NOT NULL{filtro_empresa}
+        GROUP BY 1, 2
     ),
-    stats_diarias_tecnico AS (
-        SELECT 
-            fecha_visita, 
-            SUM(es_instalacion) as total_instalaciones_dia, 
-            SUM(es_falla_causada) as total_fallas_dia
-        FROM visitas_con_logica_falla
-        WHERE "Recurso" = :recurso
-        GROUP BY fecha_visita
+    moviles AS (
+        -- Paso 2: Sumas móviles de 10 días por técnico (incluyen los días previos al inicio)
+        SELECT
+            recurso,
+            fecha_visita,
+            reparaciones_dia,
+            instalaciones_dia,
+            SUM(reparaciones_dia) OVER w AS reparaciones_movil_10_dias,
+            SUM(reincidencias_dia) OVER w AS reincidencias_movil_10_dias,
+            SUM(instalaciones_dia) OVER w AS instalaciones_movil_10_dias,
+            SUM(fallas_dia) OVER w AS fallas_movil_10_dias
+        FROM stats_diarias
+        WINDOW w AS (PARTITION BY recurso ORDER BY fecha_visita RANGE BETWEEN INTERVAL '9 days' PRECEDING AND CURRENT ROW)
     )
-    SELECT
-        fecha_visita,
-        SUM(total_instalaciones_dia) OVER (ORDER BY fecha_visita RANGE BETWEEN INTERVAL '9 days' PRECEDING AND CURRENT ROW) as total_movil_10_dias,
-        SUM(total_fallas_dia) OVER (ORDER BY fecha_visita RANGE BETWEEN INTERVAL '9 days' PRECEDING AND CURRENT ROW) as fallas_movil_10_dias
-    FROM stats_diarias_tecnico
-    WHERE fecha_visita BETWEEN :f_inicio AND :f_fin;
+    SELECT * FROM moviles
+    WHERE fecha_visita BETWEEN :f_inicio AND :f_fin
+    ORDER BY recurso, fecha_visita
     """
-    
-    # El diccionario de parámetros ahora está completo
+
     params = {
-        'f_inicio': fecha_inicio, 
-        'f_fin': fecha_fin, 
-        'recurso': recurso, 
-        'f_inicio_ampliado': f_inicio_ampliado_str,
-        'instalacion_tipos': instalacion_tipos,
-        'reparacion_tipos': reparacion_tipos,
-        'todos_tipos': todos_tipos,
-        'ids_excl': ids_excl,
-        'noms_excl_patterns': noms_excl_patterns
+        'f_inicio': fecha_inicio,
+        'f_fin': fecha_fin,
+        'f_inicio_ampliado': f_inicio_ampliado,
+        'empresa': empresa,
     }
-    
-    with engine.begin() as connection:
-        df = pd.read_sql(text(query), connection, params=params)
 
-    if not df.empty:
-        df['tasa_falla_movil'] = df.apply(lambda row: (row['fallas_movil_10_dias'] / row['total_movil_10_dias'] * 100) if row['total_movil_10_dias'] > 0 else 0, axis=1)
-        df = df.set_index('fecha_visita')
-        
+    with engine.connect() as connection:
+        df = safe_read_sql(connection, query, params)
+
+    df['tasa_reincidencia_movil'] = porcentaje(df['reincidencias_movil_10_dias'], df['reparaciones_movil_10_dias'])
+    df['tasa_falla_movil'] = porcentaje(df['fallas_movil_10_dias'], df['instalaciones_movil_10_dias'])
     return df
 
+
+def historial_de_tecnico(historiales: pd.DataFrame, recurso: str, indicador: str) -> pd.DataFrame:
+    """
+    Serie de un técnico ('rt' o 'ft') tomada de obtener_historiales_rodantes, indexada por fecha_visita
+    y con las columnas de los historiales por técnico. Solo los días con actividades de ese universo.
+    """
+    columna_dia, columnas = SERIES_HISTORIAL[indicador]
+    filas = historiales[(historiales['recurso'] == recurso) & (historiales[columna_dia] > 0)]
+    return filas.set_index('fecha_visita')[list(columnas)].rename(columns=columnas)
+
+@cache_por_version
+def obtener_matriz_mensual(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, indicador: str = "rt",
+                           empresa: str = None) -> pd.DataFrame:
+    """
+    Porcentaje de reincidencia ('rt') o de falla temprana ('ft') por mes: filas = empresas o, con
+    'empresa', sus técnicos; columnas = meses ('YYYY-MM'). Suma las casillas diarias de
+    kpi_ventanas_diarias (cada visita ya evaluada en su ventana de 10 días), sin recorrer las visitas.
+    """
+    numerador, denominador = INDICADORES[indicador]
+    por = "Recurso" if empresa else "Empresa"
+    filtro_empresa = "AND empresa_norm = lower(:empresa)" if empresa else ""
+
+    query = f"""
+    SELECT
+        date_trunc('month', fecha)::date AS fecha,
+        "{por}",
+        SUM({numerador}) AS {numerador},
+        SUM({denominador}) AS {denominador}
+    FROM public.{TABLA_VENTANAS}
+    WHERE nivel = :nivel
+        AND fecha BETWEEN :f_inicio AND :f_fin
+        {filtro_empresa}
+    GROUP BY 1, 2
+    """
+
+    params = {
+        'f_inicio': fecha_inicio,
+        'f_fin': fecha_fin,
+        'nivel': 'tecnico' if empresa else 'empresa',
+        'empresa': empresa,
+    }
+
+    with engine.connect() as connection:
+        df = safe_read_sql(connection, query, params)
+
+    if df.empty:
+        return pd.DataFrame()
+    return tasas_mensuales(df, indicador, por)
+
 ################################certificacion#################################################
 
 
 
+@cache_por_version
 def obtener_kpi_certificacion(engine: sa.Engine, fecha_inicio: str = None, fecha_fin: str = None) -> pd.DataFrame:
     """
     Calcula el KPI de certificación de trabajos por empresa.
@@ -966,43 +755,28 @@ def obtener_kpi_certificacion(engine: sa.Engine, fecha_inicio: str = None, fecha
     """
     # --- INICIO DE LA CORRECCIÓN ---
     
-    # Se definen todas las listas de filtros necesarias
-    tipos_actividad = ('reparación 3play light', 'reparación-hogar-fibra')
-    mensaje_pattern = "certificación entregada a schaman%"
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl = ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')
+    # Los tipos y las exclusiones vienen del registro de exclusiones
     
-    # La consulta ahora incluye los filtros de exclusión que faltaban
-    query = """
-    WITH base_filtrada AS (
-        SELECT "Empresa", "Mensaje certificación"
-        FROM public.actividades
-        WHERE
-            lower("Estado de actividad") = 'finalizada'
-            AND lower("Tipo de actividad") IN :tipos_actividad
-            -- Se añaden los filtros de exclusión para consistencia con otros KPIs
-            AND "ID de recurso"::text NOT IN :ids_excl
-            AND lower("Recurso") NOT IN :noms_excl
-            AND "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
-    )
+    # Las certificadas (mensaje "certificación entregada a schaman...") vienen contadas en la tabla de hechos diaria
+    query = f"""
     SELECT
         "Empresa" as empresa,
-        COUNT(*) as total_finalizadas,
-        COUNT(*) FILTER (WHERE lower(trim("Mensaje certificación")) LIKE :mensaje_pattern) AS certificadas
-    FROM
-        base_filtrada
+        SUM(certificables) as total_finalizadas,
+        SUM(certificadas) AS certificadas
+    FROM public.{TABLA_KPI_DIARIO}
+    WHERE
+        {sql_en_grupo("certificacion")}
+        AND {sql_sin_nombres_excluidos()}
+        AND fecha BETWEEN :f_inicio AND :f_fin
     GROUP BY
         "Empresa"
+    HAVING SUM(certificables) > 0
     ORDER BY
         certificadas DESC, total_finalizadas DESC;
     """
     
     # Se crea el diccionario de parámetros completo
     params = {
-        "tipos_actividad": tipos_actividad,
-        "mensaje_pattern": mensaje_pattern,
-        "ids_excl": ids_excl,
-        "noms_excl": noms_excl,
         "f_inicio": fecha_inicio,
         "f_fin": fecha_fin
     }
@@ -1013,10 +787,7 @@ def obtener_kpi_certificacion(engine: sa.Engine, fecha_inicio: str = None, fecha
         df = safe_read_sql(connection, query, params=params)
 
     if not df.empty:
-        df['porcentaje_certificacion'] = df.apply(
-            lambda row: (row['certificadas'] / row['total_finalizadas'] * 100) if row['total_finalizadas'] > 0 else 0,
-            axis=1
-        ).round(2)
+        df['porcentaje_certificacion'] = porcentaje(df['certificadas'], df['total_finalizadas'], decimales=2)
 
     return df
 
@@ -1027,29 +798,26 @@ def obtener_kpi_certificacion(engine: sa.Engine, fecha_inicio: str = None, fecha
 
 # En tu archivo: analisis.py
 
+@cache_por_version
 def obtener_certificacion_por_tecnico(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, empresa: str) -> pd.DataFrame:
     """
     Calcula el desglose de certificación de trabajos por técnico para una empresa específica.
     CORREGIDO: Se añaden los filtros de exclusión estándar para consistencia.
     """
     # Listas de filtros y exclusiones
-    tipos_actividad = ('reparación 3play light', 'reparación-hogar-fibra')
     mensaje_certificacion_pattern = "certificación entregada a schaman%"
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl = ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')
-    noms_excl_patterns = [f'%{nom}%' for nom in noms_excl]
 
     # Consulta SQL con todos los filtros y sintaxis correcta
-    query = """
+    query = f"""
     WITH base_filtrada AS (
         SELECT "Recurso", "Mensaje certificación"
         FROM public.actividades
         WHERE
-            lower("Empresa") = :empresa
-            AND lower("Estado de actividad") = 'finalizada'
-            AND lower("Tipo de actividad") IN :tipos_actividad
-            AND "ID de recurso"::text NOT IN :ids_excl
-            AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
+            empresa_norm = :empresa
+            AND estado_norm = 'finalizada'
+            AND {sql_en_grupo("certificacion")}
+            AND {sql_sin_ids_excluidos()}
+            AND {sql_sin_nombres_excluidos()}
             AND "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
     )
     SELECT
@@ -1066,10 +834,7 @@ def obtener_certificacion_por_tecnico(engine: sa.Engine, fecha_inicio: str, fech
     
     # Diccionario de parámetros completo
     params = {
-        "tipos_actividad": tipos_actividad,
         "mensaje_pattern": mensaje_certificacion_pattern,
-        "ids_excl": ids_excl,
-        "noms_excl_patterns": noms_excl_patterns,
         "empresa": empresa.lower(),
         "f_inicio": fecha_inicio,
         "f_fin": fecha_fin
@@ -1079,10 +844,7 @@ def obtener_certificacion_por_tecnico(engine: sa.Engine, fecha_inicio: str, fech
         df = safe_read_sql(connection, query, params=params)
 
     if not df.empty:
-        df['porcentaje_certificacion'] = df.apply(
-            lambda row: (row['certificadas'] / row['total_finalizadas'] * 100) if row['total_finalizadas'] > 0 else 0,
-            axis=1
-        ).round(2)
+        df['porcentaje_certificacion'] = porcentaje(df['certificadas'], df['total_finalizadas'], decimales=2)
         df = df.sort_values(by="porcentaje_certificacion", ascending=False).reset_index(drop=True)
 
     return df
@@ -1091,107 +853,100 @@ def obtener_certificacion_por_tecnico(engine: sa.Engine, fecha_inicio: str, fech
 
 ###########################Ranking de mejores tecnicos#####################################################
 
-def obtener_benchmarks_globales(engine: sa.Engine, fecha_inicio: str, fecha_fin: str) -> dict:
+def _calcular_kpis_tecnicos(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, empresa: str = None) -> pd.DataFrame:
     """
-    Obtiene los benchmarks globales (min/max) de todos los técnicos para normalización consistente.
-    Calcula directamente desde la BD para evitar dependencia circular.
+    Motor único de KPIs del Ranking. Devuelve, por técnico y empresa, los totales de producción,
+    certificación, reincidencias y fallas tempranas del período en UNA consulta: la producción sale
+    de la tabla de hechos diaria y la calidad de visitas_enriquecidas, sin funciones de ventana.
+    No aplica umbrales: cada vista (ranking, benchmarks, empresas) filtra y agrupa su resultado.
     """
-    tipos_reparacion = ('reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
-    tipos_instalacion = ('instalación-hogar-fibra', 'instalación-masivo-fibra')
-    tipos_certificacion = ('reparación 3play light', 'reparación-hogar-fibra')
-    mensaje_cert_pattern = "certificación entregada a schaman%"
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl_patterns = [f'%{nom}%' for nom in ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')]
+    filtro_empresa_sql = "AND empresa_norm = :empresa" if empresa else ""
 
-    # Consulta simplificada para obtener solo los datos necesarios para benchmarks
-    query = """
-    WITH base_produccion AS (
-        SELECT "Recurso", "Empresa", lower("Tipo de actividad") as tipo_actividad, lower("Mensaje certificación") as mensaje_cert
-        FROM public.actividades
-        WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin AND lower("Estado de actividad") = 'finalizada'
-          AND "ID de recurso"::text NOT IN :ids_excl AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
-    ),
-    base_calidad_reincidencia AS (
-        SELECT "Recurso", "Empresa", "Cod_Servicio", "Fecha Agendamiento",
-               FIRST_VALUE("Empresa") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as primera_empresa_servicio,
-               ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita,
-               LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
-        FROM public.actividades
-        WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin AND lower("Estado de actividad") = 'finalizada'
-          AND lower("Tipo de actividad") IN :tipos_reparacion AND "ID de recurso"::text NOT IN :ids_excl
-          AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
-    ),
-    base_calidad_falla_temprana AS (
-        SELECT "Recurso", "Empresa", "Cod_Servicio", "Fecha Agendamiento",
-               lower("Tipo de actividad") as tipo_actividad,
-               FIRST_VALUE("Empresa") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as primera_empresa_servicio,
-               ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita,
-               LEAD(lower("Tipo de actividad")) OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as tipo_siguiente_visita,
-               LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
-        FROM public.actividades
-        WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin AND lower("Estado de actividad") = 'finalizada'
-          AND (lower("Tipo de actividad") IN :tipos_reparacion OR lower("Tipo de actividad") IN :tipos_instalacion)
-          AND "ID de recurso"::text NOT IN :ids_excl AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
-    ),
-    kpis_produccion AS (
+    query = f"""
+    WITH kpis_produccion AS (
         SELECT "Recurso", "Empresa",
-               COUNT(*) FILTER (WHERE tipo_actividad IN :tipos_instalacion) as total_instalaciones,
-               COUNT(*) FILTER (WHERE tipo_actividad IN :tipos_reparacion) as total_reparaciones,
-               COUNT(*) FILTER (WHERE tipo_actividad IN :tipos_certificacion) as total_certificables,
-               COUNT(*) FILTER (WHERE tipo_actividad IN :tipos_certificacion AND trim(mensaje_cert) LIKE :mensaje_cert_pattern) as total_certificadas
-        FROM base_produccion WHERE "Recurso" IS NOT NULL AND trim("Recurso") <> ''
+               SUM(instalaciones) as total_instalaciones,
+               SUM(reparaciones) as total_reparaciones,
+               SUM(certificables) as total_certificables,
+               SUM(certificadas) as total_certificadas
+        FROM public.{TABLA_KPI_DIARIO}
+        WHERE fecha BETWEEN :f_inicio AND :f_fin {filtro_empresa_sql}
+          AND {sql_sin_nombres_excluidos()}
         GROUP BY "Recurso", "Empresa"
     ),
-    kpis_reincidencias AS (
-        SELECT "Recurso", primera_empresa_servicio as "Empresa", COUNT(*) as total_reincidencias
-        FROM base_calidad_reincidencia
-        WHERE orden_visita = 1 AND fecha_siguiente_visita IS NOT NULL AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days'
-        GROUP BY "Recurso", primera_empresa_servicio
-    ),
-    kpis_fallas AS (
-        SELECT "Recurso", primera_empresa_servicio as "Empresa", COUNT(*) as total_fallas_tempranas
-        FROM base_calidad_falla_temprana
-        WHERE tipo_actividad IN :tipos_instalacion AND orden_visita = 1 AND fecha_siguiente_visita IS NOT NULL AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days' AND tipo_siguiente_visita IN :tipos_reparacion
-        GROUP BY "Recurso", primera_empresa_servicio
+    kpis_calidad AS (
+        SELECT "Recurso", "Empresa",
+               COUNT(*) FILTER (WHERE es_reparacion AND {condicion_reincidencia()}) as total_reincidencias,
+               COUNT(*) FILTER (WHERE es_instalacion AND {condicion_falla_temprana()}) as total_fallas_tempranas
+        FROM public.{TABLA_VISITAS}
+        WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin {filtro_empresa_sql}
+          AND (es_reincidencia OR es_falla_temprana)
+        GROUP BY "Recurso", "Empresa"
     )
-    SELECT 
+    SELECT
         p."Recurso", p."Empresa",
         p.total_instalaciones, p.total_reparaciones, p.total_certificables, p.total_certificadas,
-        COALESCE(r.total_reincidencias, 0) as total_reincidencias,
-        COALESCE(f.total_fallas_tempranas, 0) as total_fallas_tempranas
+        COALESCE(c.total_reincidencias, 0) as total_reincidencias,
+        COALESCE(c.total_fallas_tempranas, 0) as total_fallas_tempranas
     FROM kpis_produccion p
-    LEFT JOIN kpis_reincidencias r ON p."Recurso" = r."Recurso" AND p."Empresa" = r."Empresa"
-    LEFT JOIN kpis_fallas f ON p."Recurso" = f."Recurso" AND p."Empresa" = f."Empresa"
-    WHERE p.total_reparaciones + p.total_instalaciones > 5;
+    LEFT JOIN kpis_calidad c ON p."Recurso" = c."Recurso" AND p."Empresa" = c."Empresa";
     """
-    
-    params = {
-        "f_inicio": fecha_inicio, "f_fin": fecha_fin,
-        "tipos_reparacion": tipos_reparacion, "tipos_instalacion": tipos_instalacion,
-        "tipos_certificacion": tipos_certificacion, "mensaje_cert_pattern": mensaje_cert_pattern,
-        "ids_excl": ids_excl, "noms_excl_patterns": noms_excl_patterns
-    }
-    
+
+    params = {"f_inicio": fecha_inicio, "f_fin": fecha_fin}
+    if empresa:
+        params["empresa"] = empresa.lower()
+
     with engine.begin() as connection:
-        df = pd.read_sql(text(query), connection, params=params)
-    
+        return safe_read_sql(connection, query, params=params)
+
+
+def _tecnicos_del_ranking(df: pd.DataFrame) -> pd.DataFrame:
+    """Técnicos que entran al ranking general y a los benchmarks: con nombre y más de 5 trabajos."""
+    con_nombre = df["Recurso"].notna() & (df["Recurso"].str.strip() != '')
+    return df[con_nombre & (df['total_reparaciones'] + df['total_instalaciones'] > 5)].reset_index(drop=True)
+
+
+def _agregar_porcentajes(df: pd.DataFrame) -> pd.DataFrame:
+    df['pct_reincidencia'] = porcentaje(df['total_reincidencias'], df['total_reparaciones'], decimales=2)
+    df['pct_falla_temprana'] = porcentaje(df['total_fallas_tempranas'], df['total_instalaciones'], decimales=2)
+    df['pct_certificacion'] = porcentaje(df['total_certificadas'], df['total_certificables'], decimales=2)
+    return df
+
+
+def _calcular_benchmarks(df: pd.DataFrame) -> dict:
+    metricas = ['total_reparaciones', 'total_instalaciones', 'pct_reincidencia', 'pct_falla_temprana', 'pct_certificacion']
+    return {m: {'min': df[m].min(), 'max': df[m].max()} for m in metricas}
+
+
+def _calcular_puntajes(df: pd.DataFrame, benchmarks: dict) -> pd.DataFrame:
+    """Normaliza cada KPI con los benchmarks y calcula el puntaje final ponderado."""
+    df['score_prod_mantenimiento'] = global_min_max_scaler(df['total_reparaciones'], benchmarks, 'total_reparaciones')
+    df['score_prod_provision'] = global_min_max_scaler(df['total_instalaciones'], benchmarks, 'total_instalaciones')
+    df['score_calidad_reincidencia'] = global_min_max_scaler(df['pct_reincidencia'], benchmarks, 'pct_reincidencia', higher_is_better=False)
+    df['score_calidad_falla'] = global_min_max_scaler(df['pct_falla_temprana'], benchmarks, 'pct_falla_temprana', higher_is_better=False)
+    df['score_certificacion'] = global_min_max_scaler(df['pct_certificacion'], benchmarks, 'pct_certificacion')
+
+    df.fillna(0, inplace=True)
+
+    peso_produccion = 0.30; peso_calidad = 0.40; peso_certificacion = 0.30
+    df['puntaje_final'] = ((df['score_prod_mantenimiento'] + df['score_prod_provision']) / 2 * peso_produccion +
+                          (df['score_calidad_reincidencia'] + df['score_calidad_falla']) / 2 * peso_calidad +
+                          df['score_certificacion'] * peso_certificacion)
+
+    return df.sort_values(by='puntaje_final', ascending=False).reset_index(drop=True)
+
+
+@cache_por_version
+def obtener_benchmarks_globales(engine: sa.Engine, fecha_inicio: str, fecha_fin: str) -> dict:
+    """
+    Obtiene los benchmarks globales (min/max) de todos los técnicos para normalización consistente.
+    Usa el mismo motor de KPIs que el ranking general. La caché no depende de la empresa, así que
+    todas las sesiones y empresas comparten el resultado hasta la próxima carga.
+    """
+    df = _tecnicos_del_ranking(_calcular_kpis_tecnicos(engine, fecha_inicio, fecha_fin))
     if df.empty:
         return {}
-    
-    # Calcular porcentajes para obtener los benchmarks
-    df['pct_reincidencia'] = ((df['total_reincidencias'] / df['total_reparaciones'] * 100).fillna(0)).round(2)
-    df['pct_falla_temprana'] = ((df['total_fallas_tempranas'] / df['total_instalaciones'] * 100).fillna(0)).round(2)
-    df['pct_certificacion'] = ((df['total_certificadas'] / df['total_certificables'] * 100).fillna(0)).round(2)
-    
-    benchmarks = {
-        'total_reparaciones': {'min': df['total_reparaciones'].min(), 'max': df['total_reparaciones'].max()},
-        'total_instalaciones': {'min': df['total_instalaciones'].min(), 'max': df['total_instalaciones'].max()},
-        'pct_reincidencia': {'min': df['pct_reincidencia'].min(), 'max': df['pct_reincidencia'].max()},
-        'pct_falla_temprana': {'min': df['pct_falla_temprana'].min(), 'max': df['pct_falla_temprana'].max()},
-        'pct_certificacion': {'min': df['pct_certificacion'].min(), 'max': df['pct_certificacion'].max()}
-    }
-    
-    return benchmarks
+    return _calcular_benchmarks(_agregar_porcentajes(df))
 
 def global_min_max_scaler(series, benchmarks, metric_name, higher_is_better=True):
     """
@@ -1209,372 +964,70 @@ def global_min_max_scaler(series, benchmarks, metric_name, higher_is_better=True
     return normalized if higher_is_better else 100 - normalized
 
 
+@cache_por_version
 def obtener_ranking_por_empresa(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, empresa: str) -> pd.DataFrame:
     """
     Calcula un ranking para los técnicos de UNA empresa seleccionada, usando 
     normalización global consistente con el ranking general.
     """
-    tipos_reparacion = ('reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
-    tipos_instalacion = ('instalación-hogar-fibra', 'instalación-masivo-fibra')
-    tipos_certificacion = ('reparación 3play light', 'reparación-hogar-fibra')
-    mensaje_cert_pattern = "certificación entregada a schaman%"
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl_patterns = [f'%{nom}%' for nom in ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')]
-
-    query = """
-    WITH base_produccion AS (
-        SELECT "Recurso", "Empresa", lower("Tipo de actividad") as tipo_actividad, lower("Mensaje certificación") as mensaje_cert
-        FROM public.actividades
-        WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
-          AND lower("Estado de actividad") = 'finalizada'
-          AND lower("Empresa") = :empresa
-          AND "ID de recurso"::text NOT IN :ids_excl
-          AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
-    ),
-    base_calidad_reincidencia AS (
-        SELECT "Recurso", "Empresa", "Cod_Servicio", "Fecha Agendamiento",
-               FIRST_VALUE("Empresa") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as primera_empresa_servicio,
-               ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita,
-               LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
-        FROM public.actividades
-        WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
-          AND lower("Estado de actividad") = 'finalizada'
-          AND lower("Tipo de actividad") IN :tipos_reparacion
-          AND "ID de recurso"::text NOT IN :ids_excl
-          AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
-    ),
-    base_calidad_falla_temprana AS (
-        SELECT "Recurso", "Empresa", "Cod_Servicio", "Fecha Agendamiento",
-               lower("Tipo de actividad") as tipo_actividad,
-               FIRST_VALUE("Empresa") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as primera_empresa_servicio,
-               ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita,
-               LEAD(lower("Tipo de actividad")) OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as tipo_siguiente_visita,
-               LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
-        FROM public.actividades
-        WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
-          AND lower("Estado de actividad") = 'finalizada'
-          AND (lower("Tipo de actividad") IN :tipos_reparacion OR lower("Tipo de actividad") IN :tipos_instalacion)
-          AND "ID de recurso"::text NOT IN :ids_excl
-          AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
-    ),
-    kpis_produccion AS (
-        SELECT "Recurso", "Empresa",
-               COUNT(*) FILTER (WHERE tipo_actividad IN :tipos_instalacion) as total_instalaciones,
-               COUNT(*) FILTER (WHERE tipo_actividad IN :tipos_reparacion) as total_reparaciones,
-               COUNT(*) FILTER (WHERE tipo_actividad IN :tipos_certificacion) as total_certificables,
-               COUNT(*) FILTER (WHERE tipo_actividad IN :tipos_certificacion AND trim(mensaje_cert) LIKE :mensaje_cert_pattern) as total_certificadas
-        FROM base_produccion GROUP BY "Recurso", "Empresa"
-    ),
-    kpis_reincidencias AS (
-        SELECT "Recurso", COUNT(*) as total_reincidencias
-        FROM base_calidad_reincidencia
-        WHERE orden_visita = 1 AND lower(primera_empresa_servicio) = :empresa AND fecha_siguiente_visita IS NOT NULL AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days'
-        GROUP BY "Recurso"
-    ),
-    kpis_fallas AS (
-        SELECT "Recurso", COUNT(*) as total_fallas_tempranas
-        FROM base_calidad_falla_temprana
-        WHERE tipo_actividad IN :tipos_instalacion AND orden_visita = 1 AND lower(primera_empresa_servicio) = :empresa AND fecha_siguiente_visita IS NOT NULL AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days' AND tipo_siguiente_visita IN :tipos_reparacion
-        GROUP BY "Recurso"
-    )
-    SELECT 
-        p."Recurso", p."Empresa",
-        p.total_instalaciones, p.total_reparaciones, p.total_certificables, p.total_certificadas,
-        COALESCE(r.total_reincidencias, 0) as total_reincidencias,
-        COALESCE(f.total_fallas_tempranas, 0) as total_fallas_tempranas
-    FROM kpis_produccion p
-    LEFT JOIN kpis_reincidencias r ON p."Recurso" = r."Recurso"
-    LEFT JOIN kpis_fallas f ON p."Recurso" = f."Recurso"
-    WHERE p.total_reparaciones + p.total_instalaciones > 0;
-    """
-    
-    params = {
-        "f_inicio": fecha_inicio, "f_fin": fecha_fin, "empresa": empresa.lower(),
-        "tipos_reparacion": tipos_reparacion, "tipos_instalacion": tipos_instalacion,
-        "tipos_certificacion": tipos_certificacion, "mensaje_cert_pattern": mensaje_cert_pattern,
-        "ids_excl": ids_excl, "noms_excl_patterns": noms_excl_patterns
-    }
-    
-    with engine.begin() as connection:
-        df = safe_read_sql(connection, query, params=params)
-
-    if df.empty: 
+    df = _calcular_kpis_tecnicos(engine, fecha_inicio, fecha_fin, empresa=empresa)
+    if df.empty:
         return pd.DataFrame()
-    
-    # 1. Obtener benchmarks globales
+    df = df[df['total_reparaciones'] + df['total_instalaciones'] > 0].reset_index(drop=True)
+    if df.empty:
+        return pd.DataFrame()
+
+    # Los puntajes se normalizan con los benchmarks de TODOS los técnicos, no solo los de la empresa
     benchmarks = obtener_benchmarks_globales(engine, fecha_inicio, fecha_fin)
-    
     if not benchmarks:
         return pd.DataFrame()
-    
-    # 2. Calcular porcentajes (igual que antes)
-    df['pct_reincidencia'] = ((df['total_reincidencias'] / df['total_reparaciones'] * 100).fillna(0)).round(2)
-    df['pct_falla_temprana'] = ((df['total_fallas_tempranas'] / df['total_instalaciones'] * 100).fillna(0)).round(2)
-    df['pct_certificacion'] = ((df['total_certificadas'] / df['total_certificables'] * 100).fillna(0)).round(2)
-    
-    # 3. NUEVA NORMALIZACIÓN USANDO BENCHMARKS GLOBALES
-    df['score_prod_mantenimiento'] = global_min_max_scaler(df['total_reparaciones'], benchmarks, 'total_reparaciones')
-    df['score_prod_provision'] = global_min_max_scaler(df['total_instalaciones'], benchmarks, 'total_instalaciones')
-    df['score_calidad_reincidencia'] = global_min_max_scaler(df['pct_reincidencia'], benchmarks, 'pct_reincidencia', higher_is_better=False)
-    df['score_calidad_falla'] = global_min_max_scaler(df['pct_falla_temprana'], benchmarks, 'pct_falla_temprana', higher_is_better=False)
-    df['score_certificacion'] = global_min_max_scaler(df['pct_certificacion'], benchmarks, 'pct_certificacion')
-    
-    df.fillna(0, inplace=True)
-    
-    # 4. Cálculo final (igual que antes)
-    peso_produccion = 0.30; peso_calidad = 0.40; peso_certificacion = 0.30
-    df['puntaje_final'] = ((df['score_prod_mantenimiento'] + df['score_prod_provision']) / 2 * peso_produccion + 
-                          (df['score_calidad_reincidencia'] + df['score_calidad_falla']) / 2 * peso_calidad + 
-                          df['score_certificacion'] * peso_certificacion)
-    
-    df_ranking = df.sort_values(by='puntaje_final', ascending=False).reset_index(drop=True)
-    return df_ranking
+
+    return _calcular_puntajes(_agregar_porcentajes(df), benchmarks)
 
 # FUNCIÓN MODIFICADA PARA RANKING GENERAL (REEMPLAZA LA ORIGINAL)
+@cache_por_version
 def obtener_ranking_tecnicos(engine: sa.Engine, fecha_inicio: str, fecha_fin: str) -> pd.DataFrame:
     """
     Calcula un puntaje y ranking unificado para TODOS los técnicos de TODAS las empresas.
     VERSIÓN CON NORMALIZACIÓN CONSISTENTE.
     """
-    tipos_reparacion = ('reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
-    tipos_instalacion = ('instalación-hogar-fibra', 'instalación-masivo-fibra')
-    tipos_certificacion = ('reparación 3play light', 'reparación-hogar-fibra')
-    mensaje_cert_pattern = "certificación entregada a schaman%"
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl_patterns = [f'%{nom}%' for nom in ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')]
-
-    query = """
-    WITH base_produccion AS (
-        SELECT "Recurso", "Empresa", lower("Tipo de actividad") as tipo_actividad, lower("Mensaje certificación") as mensaje_cert
-        FROM public.actividades
-        WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin AND lower("Estado de actividad") = 'finalizada'
-          AND "ID de recurso"::text NOT IN :ids_excl AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
-    ),
-    base_calidad_reincidencia AS (
-        SELECT "Recurso", "Empresa", "Cod_Servicio", "Fecha Agendamiento",
-               FIRST_VALUE("Empresa") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as primera_empresa_servicio,
-               ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita,
-               LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
-        FROM public.actividades
-        WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin AND lower("Estado de actividad") = 'finalizada'
-          AND lower("Tipo de actividad") IN :tipos_reparacion AND "ID de recurso"::text NOT IN :ids_excl
-          AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
-    ),
-    base_calidad_falla_temprana AS (
-        SELECT "Recurso", "Empresa", "Cod_Servicio", "Fecha Agendamiento",
-               lower("Tipo de actividad") as tipo_actividad,
-               FIRST_VALUE("Empresa") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as primera_empresa_servicio,
-               ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita,
-               LEAD(lower("Tipo de actividad")) OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as tipo_siguiente_visita,
-               LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
-        FROM public.actividades
-        WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin AND lower("Estado de actividad") = 'finalizada'
-          AND (lower("Tipo de actividad") IN :tipos_reparacion OR lower("Tipo de actividad") IN :tipos_instalacion)
-          AND "ID de recurso"::text NOT IN :ids_excl AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
-    ),
-    kpis_produccion AS (
-        SELECT "Recurso", "Empresa",
-               COUNT(*) FILTER (WHERE tipo_actividad IN :tipos_instalacion) as total_instalaciones,
-               COUNT(*) FILTER (WHERE tipo_actividad IN :tipos_reparacion) as total_reparaciones,
-               COUNT(*) FILTER (WHERE tipo_actividad IN :tipos_certificacion) as total_certificables,
-               COUNT(*) FILTER (WHERE tipo_actividad IN :tipos_certificacion AND trim(mensaje_cert) LIKE :mensaje_cert_pattern) as total_certificadas
-        FROM base_produccion WHERE "Recurso" IS NOT NULL AND trim("Recurso") <> ''
-        GROUP BY "Recurso", "Empresa"
-    ),
-    kpis_reincidencias AS (
-        SELECT "Recurso", primera_empresa_servicio as "Empresa", COUNT(*) as total_reincidencias
-        FROM base_calidad_reincidencia
-        WHERE orden_visita = 1 AND fecha_siguiente_visita IS NOT NULL AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days'
-        GROUP BY "Recurso", primera_empresa_servicio
-    ),
-    kpis_fallas AS (
-        SELECT "Recurso", primera_empresa_servicio as "Empresa", COUNT(*) as total_fallas_tempranas
-        FROM base_calidad_falla_temprana
-        WHERE tipo_actividad IN :tipos_instalacion AND orden_visita = 1 AND fecha_siguiente_visita IS NOT NULL AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days' AND tipo_siguiente_visita IN :tipos_reparacion
-        GROUP BY "Recurso", primera_empresa_servicio
-    )
-    SELECT 
-        p."Recurso", p."Empresa",
-        p.total_instalaciones, p.total_reparaciones, p.total_certificables, p.total_certificadas,
-        COALESCE(r.total_reincidencias, 0) as total_reincidencias,
-        COALESCE(f.total_fallas_tempranas, 0) as total_fallas_tempranas
-    FROM kpis_produccion p
-    LEFT JOIN kpis_reincidencias r ON p."Recurso" = r."Recurso" AND p."Empresa" = r."Empresa"
-    LEFT JOIN kpis_fallas f ON p."Recurso" = f."Recurso" AND p."Empresa" = f."Empresa"
-    WHERE p.total_reparaciones + p.total_instalaciones > 5;
-    """
-    
-    params = {
-        "f_inicio": fecha_inicio, "f_fin": fecha_fin,
-        "tipos_reparacion": tipos_reparacion, "tipos_instalacion": tipos_instalacion,
-        "tipos_certificacion": tipos_certificacion, "mensaje_cert_pattern": mensaje_cert_pattern,
-        "ids_excl": ids_excl, "noms_excl_patterns": noms_excl_patterns
-    }
-    
-    with engine.begin() as connection:
-        df = safe_read_sql(connection, query, params=params)
-
-    if df.empty: 
+    df = _tecnicos_del_ranking(_calcular_kpis_tecnicos(engine, fecha_inicio, fecha_fin))
+    if df.empty:
         return pd.DataFrame()
-    
-    # Calcular porcentajes
-    df['pct_reincidencia'] = ((df['total_reincidencias'] / df['total_reparaciones'] * 100).fillna(0)).round(2)
-    df['pct_falla_temprana'] = ((df['total_fallas_tempranas'] / df['total_instalaciones'] * 100).fillna(0)).round(2)
-    df['pct_certificacion'] = ((df['total_certificadas'] / df['total_certificables'] * 100).fillna(0)).round(2)
-    
-    # Crear benchmarks de los datos actuales (para ranking general es lo mismo que antes)
-    benchmarks = {
-        'total_reparaciones': {'min': df['total_reparaciones'].min(), 'max': df['total_reparaciones'].max()},
-        'total_instalaciones': {'min': df['total_instalaciones'].min(), 'max': df['total_instalaciones'].max()},
-        'pct_reincidencia': {'min': df['pct_reincidencia'].min(), 'max': df['pct_reincidencia'].max()},
-        'pct_falla_temprana': {'min': df['pct_falla_temprana'].min(), 'max': df['pct_falla_temprana'].max()},
-        'pct_certificacion': {'min': df['pct_certificacion'].min(), 'max': df['pct_certificacion'].max()}
-    }
-    
-    # Usar la misma función de normalización
-    df['score_prod_mantenimiento'] = global_min_max_scaler(df['total_reparaciones'], benchmarks, 'total_reparaciones')
-    df['score_prod_provision'] = global_min_max_scaler(df['total_instalaciones'], benchmarks, 'total_instalaciones')
-    df['score_calidad_reincidencia'] = global_min_max_scaler(df['pct_reincidencia'], benchmarks, 'pct_reincidencia', higher_is_better=False)
-    df['score_calidad_falla'] = global_min_max_scaler(df['pct_falla_temprana'], benchmarks, 'pct_falla_temprana', higher_is_better=False)
-    df['score_certificacion'] = global_min_max_scaler(df['pct_certificacion'], benchmarks, 'pct_certificacion')
-    
-    df.fillna(0, inplace=True)
-    
-    peso_produccion = 0.30; peso_calidad = 0.40; peso_certificacion = 0.30
-    df['puntaje_final'] = ((df['score_prod_mantenimiento'] + df['score_prod_provision']) / 2 * peso_produccion + 
-                          (df['score_calidad_reincidencia'] + df['score_calidad_falla']) / 2 * peso_calidad + 
-                          df['score_certificacion'] * peso_certificacion)
-    
-    df_ranking = df.sort_values(by='puntaje_final', ascending=False).reset_index(drop=True)
-    return df_ranking
 
+    # Los benchmarks del ranking general son los mismos técnicos que se están rankeando
+    df = _agregar_porcentajes(df)
+    return _calcular_puntajes(df, _calcular_benchmarks(df))
 
+
+@cache_por_version
 def obtener_ranking_empresas(engine: sa.Engine, fecha_inicio: str, fecha_fin: str) -> pd.DataFrame:
     """
-    Calcula un puntaje y ranking unificado.
-    VERSIÓN DEFINITIVA: Se corrige la lógica de la consulta para que todos los KPIs
-    se calculen sobre universos de datos 100% consistentes.
+    Calcula un puntaje y ranking unificado por empresa, sumando los KPIs de sus técnicos
+    (mismo motor y universo de datos que el ranking de técnicos).
     """
-    # Listas de tipos de actividad y exclusiones estándar
-    tipos_reparacion = ('reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
-    tipos_instalacion = ('instalación-hogar-fibra', 'instalación-masivo-fibra')
-    tipos_certificacion = ('reparación 3play light', 'reparación-hogar-fibra')
-    mensaje_cert_pattern = "certificación entregada a schaman%"
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl_patterns = [f'%{nom}%' for nom in ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')]
+    df = _calcular_kpis_tecnicos(engine, fecha_inicio, fecha_fin)
+    if df.empty:
+        return pd.DataFrame()
+
+    columnas = ['total_instalaciones', 'total_reparaciones', 'total_certificables', 'total_certificadas',
+                'total_reincidencias', 'total_fallas_tempranas']
+    df = df.groupby('Empresa', as_index=False)[columnas].sum()
+    df = df[df['total_reparaciones'] + df['total_instalaciones'] > 5].reset_index(drop=True)
+    if df.empty:
+        return pd.DataFrame()
+
+    df = _agregar_porcentajes(df)
+    return _calcular_puntajes(df, _calcular_benchmarks(df))
 
-    query = """
-    WITH base_produccion AS (
-        SELECT "Empresa", "Recurso", lower("Tipo de actividad") as tipo_actividad, lower("Mensaje certificación") as mensaje_cert
-        FROM public.actividades
-        WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
-          AND lower("Estado de actividad") = 'finalizada'
-          AND "ID de recurso"::text NOT IN :ids_excl
-          AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
-    ),
-    base_calidad_reincidencia AS (
-        SELECT "Empresa", "Cod_Servicio", "Fecha Agendamiento",
-               FIRST_VALUE("Empresa") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as primera_empresa_servicio,
-               ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita,
-               LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
-        FROM public.actividades
-        WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
-          AND lower("Estado de actividad") = 'finalizada'
-          AND lower("Tipo de actividad") IN :tipos_reparacion
-          AND "ID de recurso"::text NOT IN :ids_excl
-          AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
-    ),
-    base_calidad_falla_temprana AS (
-        SELECT "Empresa", "Cod_Servicio", "Fecha Agendamiento",
-               lower("Tipo de actividad") as tipo_actividad,
-               FIRST_VALUE("Empresa") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as primera_empresa_servicio,
-               ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita,
-               LEAD(lower("Tipo de actividad")) OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as tipo_siguiente_visita,
-               LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
-        FROM public.actividades
-        WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
-          AND lower("Estado de actividad") = 'finalizada'
-          -- <<< INICIO DE LA CORRECCIÓN CLAVE >>>
-          -- Se añaden paréntesis para asegurar que los filtros se apliquen a ambos tipos de actividad
-          AND (lower("Tipo de actividad") IN :tipos_reparacion OR lower("Tipo de actividad") IN :tipos_instalacion)
-          -- <<< FIN DE LA CORRECCIÓN CLAVE >>>
-          AND "ID de recurso"::text NOT IN :ids_excl
-          AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
-    ),
-    kpis_produccion AS (
-        SELECT "Empresa",
-               COUNT(*) FILTER (WHERE tipo_actividad IN :tipos_instalacion) as total_instalaciones,
-               COUNT(*) FILTER (WHERE tipo_actividad IN :tipos_reparacion) as total_reparaciones,
-               COUNT(*) FILTER (WHERE tipo_actividad IN :tipos_certificacion) as total_certificables,
-               COUNT(*) FILTER (WHERE tipo_actividad IN :tipos_certificacion AND trim(mensaje_cert) LIKE :mensaje_cert_pattern) as total_certificadas
-        FROM base_produccion GROUP BY "Empresa"
-    ),
-    kpis_reincidencias AS (
-        SELECT primera_empresa_servicio as "Empresa", COUNT(*) as total_reincidencias
-        FROM base_calidad_reincidencia
-        WHERE orden_visita = 1 AND fecha_siguiente_visita IS NOT NULL AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days'
-        GROUP BY primera_empresa_servicio
-    ),
-    kpis_fallas AS (
-        SELECT primera_empresa_servicio as "Empresa", COUNT(*) as total_fallas_tempranas
-        FROM base_calidad_falla_temprana
-        WHERE tipo_actividad IN :tipos_instalacion AND orden_visita = 1 AND fecha_siguiente_visita IS NOT NULL AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days' AND tipo_siguiente_visita IN :tipos_reparacion
-        GROUP BY primera_empresa_servicio
-    )
-    SELECT 
-        p."Empresa",
-        p.total_instalaciones, p.total_reparaciones, p.total_certificables, p.total_certificadas,
-        COALESCE(r.total_reincidencias, 0) as total_reincidencias,
-        COALESCE(f.total_fallas_tempranas, 0) as total_fallas_tempranas
-    FROM kpis_produccion p
-    LEFT JOIN kpis_reincidencias r ON p."Empresa" = r."Empresa"
-    LEFT JOIN kpis_fallas f ON p."Empresa" = f."Empresa"
-    WHERE p.total_reparaciones + p.total_instalaciones > 5;
-    """
-    
-    params = {
-        "f_inicio": fecha_inicio, "f_fin": fecha_fin,
-        "tipos_reparacion": tipos_reparacion, "tipos_instalacion": tipos_instalacion,
-        "tipos_certificacion": tipos_certificacion, "mensaje_cert_pattern": mensaje_cert_pattern,
-        "ids_excl": ids_excl, "noms_excl_patterns": noms_excl_patterns
-    }
-    
-    with engine.begin() as connection:
-        df = pd.read_sql(text(query), connection, params=params)
-
-        if df.empty: return pd.DataFrame()
-
-    # --- CÁLCULO DEL PUNTAJE EN PANDAS (sin cambios) ---
-    df['pct_reincidencia'] = ((df['total_reincidencias'] / df['total_reparaciones'] * 100).fillna(0)).round(2)
-    df['pct_falla_temprana'] = ((df['total_fallas_tempranas'] / df['total_instalaciones'] * 100).fillna(0)).round(2)
-    df['pct_certificacion'] = ((df['total_certificadas'] / df['total_certificables'] * 100).fillna(0)).round(2)
-    def min_max_scaler(series, higher_is_better=True):
-        min_val, max_val = series.min(), series.max()
-        if min_val == max_val: return pd.Series([100] * len(series), index=series.index)
-        normalized = (series - min_val) / (max_val - min_val) * 100
-        return normalized if higher_is_better else 100 - normalized
-    df['score_prod_mantenimiento'] = min_max_scaler(df['total_reparaciones'])
-    df['score_prod_provision'] = min_max_scaler(df['total_instalaciones'])
-    df['score_calidad_reincidencia'] = min_max_scaler(df['pct_reincidencia'], higher_is_better=False)
-    df['score_calidad_falla'] = min_max_scaler(df['pct_falla_temprana'], higher_is_better=False)
-    df['score_certificacion'] = min_max_scaler(df['pct_certificacion'])
-    df.fillna(0, inplace=True)
-    peso_produccion = 0.30; peso_calidad = 0.40; peso_certificacion = 0.30
-    df['puntaje_final'] = ((df['score_prod_mantenimiento'] + df['score_prod_provision']) / 2 * peso_produccion + (df['score_calidad_reincidencia'] + df['score_calidad_falla']) / 2 * peso_calidad + df['score_certificacion'] * peso_certificacion)
-    df_ranking = df.sort_values(by='puntaje_final', ascending=False).reset_index(drop=True)
-    return df_ranking
 # En tu archivo: analisis.py
 
+@cache_por_version
 def obtener_reparaciones_por_comuna(engine: sa.Engine, fecha_inicio: str = None, fecha_fin: str = None) -> pd.DataFrame:
     """
     Cuenta el total de trabajos de reparación agrupados por Comuna.
     CORREGIDO: Se añaden los filtros de exclusión estándar para consistencia.
     """
-    tipos_reparacion = ('reparación 3play light', 'reparación empresa masivo fibra', 'reparación-hogar-fibra')
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl = ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')
-    noms_excl_patterns = [f'%{nom}%' for nom in noms_excl]
-
     filtro_fecha_sql = "AND \"Fecha Agendamiento\" BETWEEN :f_inicio AND :f_fin" if fecha_inicio else ""
 
     query = f"""
@@ -1584,11 +1037,11 @@ def obtener_reparaciones_por_comuna(engine: sa.Engine, fecha_inicio: str = None,
     FROM
         public.actividades
     WHERE
-        lower("Tipo de actividad") IN :tipos_reparacion
+        {sql_en_grupo("reparacion")}
         AND "Comuna" IS NOT NULL AND trim("Comuna") <> ''
         -- <<< FILTROS DE EXCLUSIÓN AÑADIDOS >>>
-        AND "ID de recurso"::text NOT IN :ids_excl
-        AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
+        AND {sql_sin_ids_excluidos()}
+        AND {sql_sin_nombres_excluidos()}
         {filtro_fecha_sql}
     GROUP BY
         "Comuna"
@@ -1596,11 +1049,7 @@ def obtener_reparaciones_por_comuna(engine: sa.Engine, fecha_inicio: str = None,
         total_reparaciones DESC;
     """
     
-    params = {
-        "tipos_reparacion": tipos_reparacion,
-        "ids_excl": ids_excl,
-        "noms_excl_patterns": noms_excl_patterns
-    }
+    params = {}
     if fecha_inicio:
         params["f_inicio"] = fecha_inicio
         params["f_fin"] = fecha_fin
@@ -1611,19 +1060,12 @@ def obtener_reparaciones_por_comuna(engine: sa.Engine, fecha_inicio: str = None,
 
 # En tu archivo: analisis.py
 
+@cache_por_version
 def obtener_instalaciones_por_comuna(engine: sa.Engine, fecha_inicio: str = None, fecha_fin: str = None) -> pd.DataFrame:
     """
     Cuenta el total de trabajos de instalación y postventa agrupados por Comuna.
     CORREGIDO: Se añaden los filtros de exclusión estándar para consistencia.
     """
-    tipos_instalacion = (
-        'instalación-hogar-fibra', 'instalación-masivo-fibra', 'postventa-hogar-fibra',
-        'postventa-masivo-equipo', 'postventa-masivo-fibra'
-    )
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl = ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')
-    noms_excl_patterns = [f'%{nom}%' for nom in noms_excl]
-
     filtro_fecha_sql = "AND \"Fecha Agendamiento\" BETWEEN :f_inicio AND :f_fin" if fecha_inicio else ""
 
     query = f"""
@@ -1633,11 +1075,11 @@ def obtener_instalaciones_por_comuna(engine: sa.Engine, fecha_inicio: str = None
     FROM
         public.actividades
     WHERE
-        lower("Tipo de actividad") IN :tipos_instalacion
+        {sql_en_grupo("instalacion_postventa")}
         AND "Comuna" IS NOT NULL AND trim("Comuna") <> ''
         -- <<< FILTROS DE EXCLUSIÓN AÑADIDOS >>>
-        AND "ID de recurso"::text NOT IN :ids_excl
-        AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
+        AND {sql_sin_ids_excluidos()}
+        AND {sql_sin_nombres_excluidos()}
         {filtro_fecha_sql}
     GROUP BY
         "Comuna"
@@ -1645,11 +1087,7 @@ def obtener_instalaciones_por_comuna(engine: sa.Engine, fecha_inicio: str = None
         total_instalaciones DESC;
     """
 
-    params = {
-        "tipos_instalacion": tipos_instalacion,
-        "ids_excl": ids_excl,
-        "noms_excl_patterns": noms_excl_patterns
-    }
+    params = {}
     if fecha_inicio:
         params["f_inicio"] = fecha_inicio
         params["f_fin"] = fecha_fin
@@ -1661,77 +1099,31 @@ def obtener_instalaciones_por_comuna(engine: sa.Engine, fecha_inicio: str = None
 
 # En tu archivo: analisis.py
 
+@cache_por_version
 def obtener_stats_calidad_por_comuna(engine: sa.Engine, fecha_inicio: str = None, fecha_fin: str = None) -> pd.DataFrame:
     """
-    Calcula el total de Reincidencias y Fallas Tempranas generadas 
-    por cada empresa en cada comuna.
-    CORREGIDO: Se añaden los filtros de exclusión estándar.
+    Calcula el total de Reincidencias y Fallas Tempranas generadas
+    por cada empresa en cada comuna (desde visitas_enriquecidas, con los filtros estándar).
     """
-    tipos_reparacion = ('reparación 3play light', 'reparación empresa masivo fibra', 'reparación-hogar-fibra')
-    tipos_instalacion = ('instalación-hogar-fibra', 'instalación-masivo-fibra')
-    todos_tipos = tipos_reparacion + tipos_instalacion
-    
-    # --- INICIO DE LA MODIFICACIÓN ---
-    # 1. Se definen las listas de exclusión
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl = ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')
-    noms_excl_patterns = [f'%{nom}%' for nom in noms_excl]
-    # --- FIN DE LA MODIFICACIÓN ---
-
-    filtro_fecha_sql = "AND \"Fecha Agendamiento\" BETWEEN :f_inicio AND :f_fin" if fecha_inicio else ""
+    con_rango = bool(fecha_inicio)
+    filtro_fecha_sql = "AND \"Fecha Agendamiento\" BETWEEN :f_inicio AND :f_fin" if con_rango else ""
 
     query = f"""
-    WITH visitas_enriquecidas AS (
-        SELECT 
-            "Comuna" as comuna, "Empresa" as empresa, "Cod_Servicio", "Fecha Agendamiento",
-            "ID de recurso", "Recurso", -- Se añaden para poder filtrar
-            lower("Tipo de actividad") as tipo_actividad,
-            ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita,
-            LEAD(lower("Tipo de actividad")) OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as tipo_siguiente_visita,
-            LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
-        FROM public.actividades
-        WHERE 
-            lower("Estado de actividad") = 'finalizada'
-            AND lower("Tipo de actividad") IN :todos_tipos
-            AND "Comuna" IS NOT NULL
-            -- <<< LÍNEAS DE EXCLUSIÓN AÑADIDAS >>>
-            AND "ID de recurso"::text NOT IN :ids_excl
-            AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
-            {filtro_fecha_sql}
-    ),
-    kpis_calculados AS (
+    SELECT * FROM (
         SELECT
-            comuna, empresa,
-            CASE WHEN tipo_actividad IN :tipos_reparacion AND orden_visita = 1
-                AND fecha_siguiente_visita IS NOT NULL AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days'
-            THEN 1 ELSE 0 END as es_reincidencia,
-            CASE WHEN tipo_actividad IN :tipos_instalacion AND orden_visita = 1
-                AND fecha_siguiente_visita IS NOT NULL AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days'
-                AND tipo_siguiente_visita IN :tipos_reparacion
-            THEN 1 ELSE 0 END as es_falla_temprana
-        FROM visitas_enriquecidas
-    )
-    SELECT 
-        comuna, empresa,
-        SUM(es_reincidencia) as total_reincidencias,
-        SUM(es_falla_temprana) as total_fallas_tempranas
-    FROM kpis_calculados
-    GROUP BY comuna, empresa
-    HAVING SUM(es_reincidencia) > 0 OR SUM(es_falla_temprana) > 0;
+            "Comuna" as comuna, "Empresa" as empresa,
+            COUNT(*) FILTER (WHERE es_reparacion AND {condicion_reincidencia(con_rango)}) as total_reincidencias,
+            COUNT(*) FILTER (WHERE es_instalacion AND {condicion_falla_temprana(con_rango)}) as total_fallas_tempranas
+        FROM public.{TABLA_VISITAS}
+        WHERE "Comuna" IS NOT NULL
+            {filtro_fecha_sql}
+        GROUP BY "Comuna", "Empresa"
+    ) stats
+    WHERE total_reincidencias > 0 OR total_fallas_tempranas > 0
     """
-    
-    # --- INICIO DE LA MODIFICACIÓN ---
-    # Se añaden los nuevos parámetros
-    params = {
-        "tipos_reparacion": tipos_reparacion, 
-        "tipos_instalacion": tipos_instalacion, 
-        "todos_tipos": todos_tipos,
-        "ids_excl": ids_excl,
-        "noms_excl_patterns": noms_excl_patterns
-    }
-    # --- FIN DE LA MODIFICACIÓN ---
 
-    if fecha_inicio:
+    params = {}
+    if con_rango:
         params["f_inicio"] = fecha_inicio
         params["f_fin"] = fecha_fin
 
@@ -1739,61 +1131,53 @@ def obtener_stats_calidad_por_comuna(engine: sa.Engine, fecha_inicio: str = None
         df = safe_read_sql(connection, query, params=params)
     return df
 ############################ Tiempos Promedios #################################################
-def obtener_datos_duracion(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, tipos_seleccionados: list) -> pd.DataFrame:
+def _consulta_datos_duracion(fecha_inicio: str, fecha_fin: str, tipos_seleccionados: list = None, solo_con_duracion: bool = False) -> tuple:
     """
-    Obtiene los datos de actividades para el análisis de duración, APLICANDO
-    TODOS LOS FILTROS CONSISTENTES con los otros KPIs de la aplicación.
+    Consulta y parámetros de las actividades para el análisis de duración (con todos los filtros de los KPIs).
+    Sin 'tipos_seleccionados' (None) no se filtra por tipo de actividad.
     """
-    
-    # Se definen las mismas listas de exclusión que en tus otros KPIs
-    comunas_a_excluir = (
-        'algarrobo', 'antofagasta', 'calama', 'calera', 'canete', 'casablanca',
-        'catemu', 'chiguayante', 'chillan', 'chillan viejo', 'cnt', 'concepcion',
-        'conchali|', 'copiapo', 'coquimbo', 'coronel', 'curacavi', 'curico',
-        'donihue', 'el monte', 'el quisco', 'el tabo', 'hijuelas', 'la cruz',
-        'las. ondes', 'limache', 'linares', 'los angeles', 'los andes', 'machali',
-        'melipilla', 'nogales', 'none', 'padre las casas', 'olmuhe',
-        'pedro aguirres cerda', 'penaflor', 'penco', 'puerto montt', 'quillota',
-        'quilpue', 'rancagua', 'rengo', 'rinconada', 'san antonio', 'san esteban',
-        'san felipe', 'san bernardo', 'san javier', 'san pedro',
-        'san pedro de la paz', 'santa cruz', 'talca', 'talcahuano', 'temuco',
-        'tiltil', 'tome', 'ura dario urzua', 'valaparaiso', 'villa alemana',
-        'villa rica', 'viña del mar', 'x'
-    )
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-    noms_excl = ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')
-
+    filtro_tipos_sql = "AND tipo_actividad_norm IN :tipos" if tipos_seleccionados is not None else ""
 
     # La consulta SQL ahora incluye TODOS los filtros para ser consistente
-    query = """
+    query = f"""
         SELECT
             "Fecha Agendamiento",
             "Comuna",
             "Tipo de actividad",
             "Estado de actividad",
             "Propietario de Red",
+            "Recurso",
             "Duración"
         FROM public.actividades
         WHERE
             "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
-            AND lower("Tipo de actividad") IN :tipos
-            AND lower("Comuna") NOT IN :comunas_excluidas
-            AND "ID externo"::text NOT IN :ids_excl         -- <-- FILTRO AÑADIDO
-            AND lower("Recurso") NOT IN :noms_excl      -- <-- FILTRO AÑADIDO
+            {filtro_tipos_sql}
+            AND {sql_sin_comunas_excluidas()}
+            AND {sql_sin_ids_excluidos()}
+            AND {sql_sin_nombres_excluidos()}
     """
+    if solo_con_duracion:
+        query += """            AND estado_norm = 'finalizada' AND "Duración" > INTERVAL '0 seconds'\n"""
     
     # Parámetros para la consulta
     params = {
         "f_inicio": fecha_inicio,
-        "f_fin": fecha_fin,
-        "tipos": tuple(t.lower() for t in tipos_seleccionados),
-        "comunas_excluidas": comunas_a_excluir,
-        "ids_excl": ids_excl,         # <-- PARÁMETRO AÑADIDO
-        "noms_excl": noms_excl        # <-- PARÁMETRO AÑADIDO
+        "f_fin": fecha_fin
     }
-    
+    if tipos_seleccionados is not None:
+        params["tipos"] = tuple(t.lower() for t in tipos_seleccionados)
+    return query, params
+
+
+@cache_por_version
+def obtener_datos_duracion(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, tipos_seleccionados: list) -> pd.DataFrame:
+    """
+    Obtiene los datos de actividades para el análisis de duración, APLICANDO
+    TODOS LOS FILTROS CONSISTENTES con los otros KPIs de la aplicación.
+    """
+    query, params = _consulta_datos_duracion(fecha_inicio, fecha_fin, tipos_seleccionados)
     with engine.connect() as connection:
-        df = pd.read_sql_query(text(query), connection, params=params)
+        df = safe_read_sql(connection, query, params)
 
     # Limpieza final y conversión de tipos en Pandas
     df['Duración'] = pd.to_timedelta(df['Duración'], errors='coerce')
@@ -1805,6 +1189,7 @@ def obtener_datos_duracion(engine: sa.Engine, fecha_inicio: str, fecha_fin: str,
     return df
 
 
+@cache_por_version
 def obtener_opciones_filtros(engine: sa.Engine) -> tuple:
     """Obtiene listas únicas de comunas y tipos de actividad para poblar los filtros."""
     query = """
@@ -1813,7 +1198,7 @@ def obtener_opciones_filtros(engine: sa.Engine) -> tuple:
     WHERE "Comuna" IS NOT NULL AND "Tipo de actividad" IS NOT NULL;
     """
     with engine.connect() as connection:
-        df_opciones = pd.read_sql_query(text(query), connection)
+        df_opciones = safe_read_sql(connection, query)
     
     comunas = sorted(df_opciones['Comuna'].str.lower().str.strip().unique())
     tipos = sorted(df_opciones['Tipo de actividad'].str.lower().str.strip().unique())
@@ -1823,46 +1208,44 @@ def obtener_opciones_filtros(engine: sa.Engine) -> tuple:
 
 # En tu archivo: analisis.py
 
-def obtener_tiempos_promedio_empresa(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, empresa: str) -> pd.DataFrame:
-    """
-    Obtiene todas las actividades finalizadas con duración para una empresa específica,
-    filtrando por una lista predefinida de tipos de actividad y excluyendo ciertos IDs de RECURSO.
-    """
-    
-    tipos_a_incluir = (
-        'instalación-hogar-fibra', 'instalación-masivo-fibra', 'incidencia manual',
-        'postventa-hogar-fibra', 'reparación 3play light', 'postventa-masivo-equipo',
-        'postventa-masivo-fibra', 'reparación empresa masivo fibra', 'reparación-hogar-fibra'
-    )
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
-
-    query = """
+def _consulta_tiempos_empresa(fecha_inicio: str, fecha_fin: str, empresa: str) -> tuple:
+    """Consulta y parámetros de las actividades finalizadas con duración de una empresa."""
+    query = f"""
         SELECT
             "Empresa",
             "Recurso",
             "Tipo de actividad",
+            "Comuna",
+            "Propietario de Red",
             "Duración"
         FROM public.actividades
         WHERE
             "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
-            AND lower("Empresa") = :empresa
-            AND lower("Estado de actividad") = 'finalizada'
+            AND empresa_norm = :empresa
+            AND estado_norm = 'finalizada'
             AND "Duración" IS NOT NULL AND "Duración" > INTERVAL '0 seconds'
-            AND lower("Tipo de actividad") IN :tipos_incluidos
+            AND {sql_en_grupo("multiskill")}
             -- <<< LÍNEA CORREGIDA: Ahora filtra por "ID de recurso" >>>
-            AND trim("ID de recurso"::text) NOT IN :ids_excl
+            AND {sql_sin_ids_excluidos()}
     """
     
     params = {
         "f_inicio": fecha_inicio,
         "f_fin": fecha_fin,
-        "empresa": empresa.lower(),
-        "tipos_incluidos": tipos_a_incluir,
-        "ids_excl": ids_excl
+        "empresa": empresa.lower()
     }
-    
+    return query, params
+
+
+@cache_por_version
+def obtener_tiempos_promedio_empresa(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, empresa: str) -> pd.DataFrame:
+    """
+    Obtiene todas las actividades finalizadas con duración para una empresa específica,
+    filtrando por una lista predefinida de tipos de actividad y excluyendo ciertos IDs de RECURSO.
+    """
+    query, params = _consulta_tiempos_empresa(fecha_inicio, fecha_fin, empresa)
     with engine.connect() as connection:
-        df = pd.read_sql_query(text(query), connection, params=params)
+        df = safe_read_sql(connection, query, params)
 
     # Aseguramos los tipos de datos correctos después de la consulta
     if not df.empty:
@@ -1872,17 +1255,79 @@ def obtener_tiempos_promedio_empresa(engine: sa.Engine, fecha_inicio: str, fecha
 
     return df
 
-######################### Causa de la falla ########################################################
 
-def obtener_datos_causa_falla(engine: sa.Engine, fecha_inicio: str, fecha_fin: str) -> pd.DataFrame:
+# --- ESTADÍSTICAS DE DURACIÓN EN SQL ---
+# Dimensiones por las que se pueden agrupar las duraciones, normalizadas igual que en pandas.
+DIMENSIONES_DURACION = {
+    "Propietario de Red": 'lower(trim(d."Propietario de Red"::text))',
+    "Tipo de actividad": 'lower(trim(d."Tipo de actividad"))',
+    "Comuna": 'lower(trim(d."Comuna"))',
+    "Recurso": 'trim(d."Recurso")',
+}
+
+
+@cache_por_version
+def obtener_estadisticas_duracion(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, agrupaciones: tuple,
+                                  tipos_seleccionados: list = None, empresa: str = None, comuna: str = None) -> pd.DataFrame:
     """
-    Obtiene las causas de falla y su comuna para actividades de reparación
-    dentro de un rango de fechas específico.
+    Promedio ('Duración'), mediana, percentil 90 y cantidad de registros de la duración de las
+    actividades finalizadas, calculados en PostgreSQL para varias agrupaciones en una sola consulta
+    (GROUPING SETS). 'agrupaciones' es una tupla de tuplas de DIMENSIONES_DURACION, ej.
+    (("Propietario de Red", "Tipo de actividad"), ("Tipo de actividad", "Comuna")).
+    Con 'empresa' usa los filtros de la página de tiempos por empresa; sin ella, los de la vista
+    general con 'tipos_seleccionados' (None = todos los tipos). La columna 'agrupacion' indica a
+    qué agrupación pertenece cada fila (ver estadisticas_por).
     """
+    if empresa:
+        base, params = _consulta_tiempos_empresa(fecha_inicio, fecha_fin, empresa)
+    else:
+        base, params = _consulta_datos_duracion(fecha_inicio, fecha_fin, tipos_seleccionados, solo_con_duracion=True)
+
+    dimensiones = [d for d in DIMENSIONES_DURACION if any(d in a for a in agrupaciones)]
+    columnas_sql = ",\n        ".join(f'{DIMENSIONES_DURACION[d]} AS "{d}"' for d in dimensiones)
+    conjuntos = ", ".join("(" + ", ".join(DIMENSIONES_DURACION[d] for d in a) + ")" for a in agrupaciones)
+    filtro_comuna = 'AND lower(trim(d."Comuna")) = :comuna' if comuna else ""
+
+    query = f"""
+    SELECT
+        {columnas_sql},
+        GROUPING({", ".join(DIMENSIONES_DURACION[d] for d in dimensiones)}) AS nivel,
+        COUNT(*) AS registros,
+        AVG(d."Duración") AS "Duración",
+        percentile_cont(0.5) WITHIN GROUP (ORDER BY d."Duración") AS "Mediana",
+        percentile_cont(0.9) WITHIN GROUP (ORDER BY d."Duración") AS "P90"
+    FROM ({base}) d
+    WHERE d."Duración" IS NOT NULL {filtro_comuna}
+    GROUP BY GROUPING SETS ({conjuntos})
+    """
+    params = dict(params, comuna=comuna.lower() if comuna else None)
+
+    with engine.connect() as connection:
+        df = safe_read_sql(connection, query, params)
+
+    # GROUPING() marca con 1 las dimensiones que no forman parte de la agrupación de la fila
+    niveles = {
+        sum(1 << (len(dimensiones) - 1 - i) for i, d in enumerate(dimensiones) if d not in a): "|".join(a)
+        for a in agrupaciones
+    }
+    df["agrupacion"] = df.pop("nivel").map(niveles)
+    for columna in ("Duración", "Mediana", "P90"):
+        df[columna] = pd.to_timedelta(df[columna], errors="coerce")
+    return df
+
+
+def estadisticas_por(estadisticas: pd.DataFrame, por) -> pd.DataFrame:
+    """Filas de obtener_estadisticas_duracion que corresponden a la agrupación 'por'."""
+    por = list(por)
+    filas = estadisticas[estadisticas["agrupacion"] == "|".join(por)]
+    return filas[por + ["registros", "Duración", "Mediana", "P90"]].reset_index(drop=True)
+
+######################### Causa de la falla ########################################################
+
+def _consulta_causa_falla(fecha_inicio: str, fecha_fin: str) -> tuple:
+    """Consulta y parámetros de las causas de falla de las reparaciones del período."""
     # Se consideran solo actividades que pueden tener una "causa de falla"
-    tipos_reparacion = ('reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
-    
-    query = """
+    query = f"""
         SELECT
             "Comuna",
             "Causa de la falla"
@@ -1891,17 +1336,25 @@ def obtener_datos_causa_falla(engine: sa.Engine, fecha_inicio: str, fecha_fin: s
             "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
             AND "Causa de la falla" IS NOT NULL
             AND trim("Causa de la falla") <> ''
-            AND lower("Tipo de actividad") IN :tipos_reparacion
+            AND {sql_en_grupo("reparacion")}
     """
     
     params = {
         "f_inicio": fecha_inicio,
-        "f_fin": fecha_fin,
-        "tipos_reparacion": tipos_reparacion
+        "f_fin": fecha_fin
     }
-    
+    return query, params
+
+
+@cache_por_version
+def obtener_datos_causa_falla(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, formato: str = "pandas") -> pd.DataFrame:
+    """
+    Obtiene las causas de falla y su comuna para actividades de reparación
+    dentro de un rango de fechas específico.
+    """
+    query, params = _consulta_causa_falla(fecha_inicio, fecha_fin)
     with engine.connect() as connection:
-        df = pd.read_sql_query(text(query), connection, params=params)
+        df = safe_read_sql(connection, query, params, formato=formato)
 
     # Limpieza de datos en Pandas para asegurar consistencia
     if not df.empty:
@@ -1911,9 +1364,25 @@ def obtener_datos_causa_falla(engine: sa.Engine, fecha_inicio: str, fecha_fin: s
     return df
 
 
+@cache_por_version
+def obtener_resumen_causa_falla(engine: sa.Engine, fecha_inicio: str, fecha_fin: str) -> pd.DataFrame:
+    """Versión en bloques de obtener_datos_causa_falla: cantidad de fallas ('registros') por Comuna y causa."""
+    query, params = _consulta_causa_falla(fecha_inicio, fecha_fin)
+
+    def preparar(bloque):
+        bloque["Comuna"] = bloque["Comuna"].str.lower().str.strip()
+        bloque["Causa de la falla"] = bloque["Causa de la falla"].str.lower().str.strip()
+        return bloque
+
+    with engine.connect() as connection:
+        return agregar_en_bloques(leer_en_bloques(connection, query, params), ["Comuna", "Causa de la falla"],
+                                  preparar=preparar)
+
+
 # En tu archivo analisis.py
 
-def buscar_actividades(engine: sa.Engine, termino_busqueda: str) -> pd.DataFrame:
+@cache_por_version
+def buscar_actividades(engine: sa.Engine, termino_busqueda: str, formato: str = "pandas") -> pd.DataFrame:
     """
     Busca un término en múltiples columnas de la tabla de actividades.
     CORREGIDO: Usa lower() y LIKE para una búsqueda case-insensitive robusta y consistente.
@@ -1936,7 +1405,7 @@ def buscar_actividades(engine: sa.Engine, termino_busqueda: str) -> pd.DataFrame
     FROM public.actividades
     WHERE
         lower("ID externo"::text) LIKE :search_pattern
-        OR lower("Recurso") LIKE :search_pattern
+        OR recurso_norm LIKE :search_pattern
         OR lower("Cod_Servicio"::text) LIKE :search_pattern
         OR lower("Rut Cliente") LIKE :search_pattern
         OR lower("Nombre Cliente") LIKE :search_pattern
@@ -1953,6 +1422,6 @@ def buscar_actividades(engine: sa.Engine, termino_busqueda: str) -> pd.DataFrame
     # --- FIN DE LA CORRECCIÓN ---
     
     with engine.connect() as connection:
-        df = pd.read_sql_query(text(query), connection, params=params)
+        df = safe_read_sql(connection, query, params, formato=formato)
 
     return df
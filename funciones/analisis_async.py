@@ -0,0 +1,116 @@
+# analisis_async.py
+
+import argparse
+import asyncio
+import functools
+import os
+import sys
+import time
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.util import greenlet_spawn
+
+# Permite importar el paquete 'funciones' cuando este archivo se ejecuta como script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from funciones import analisis
+from funciones.conexion import POOL_SIZE, crear_engine_async
+
+# Variante asyncio de analisis.py: las mismas funciones obtener_*, con los mismos argumentos,
+# como corrutinas que reciben un AsyncEngine (conexion.crear_engine_async). El SQL, el cálculo
+# en pandas y la caché son los de analisis.py; solo cambia el I/O. Cada función corre con
+# greenlet_spawn sobre el engine async (psycopg 3), así que mientras una consulta espera a la BD
+# el event loop atiende a las demás: decenas de consultas por técnico o por empresa en paralelo
+# sin un hilo por consulta.
+
+
+def _corrutina(funcion):
+    @functools.wraps(funcion)
+    async def envoltura(engine: AsyncEngine, *args, **kwargs):
+        return await greenlet_spawn(funcion, engine.sync_engine, *args, **kwargs)
+    return envoltura
+
+
+# --- KPIs GENERALES ---
+obtener_kpi_multiskill = _corrutina(analisis.obtener_kpi_multiskill)
+obtener_kpi_mantencion = _corrutina(analisis.obtener_kpi_mantencion)
+obtener_kpi_provision = _corrutina(analisis.obtener_kpi_provision)
+obtener_kpi_certificacion = _corrutina(analisis.obtener_kpi_certificacion)
+get_company_list = _corrutina(analisis.get_company_list)
+
+# --- POR TÉCNICO ---
+obtener_mantenimiento_por_tecnico = _corrutina(analisis.obtener_mantenimiento_por_tecnico)
+obtener_provision_por_tecnico = _corrutina(analisis.obtener_provision_por_tecnico)
+obtener_certificacion_por_tecnico = _corrutina(analisis.obtener_certificacion_por_tecnico)
+
+# --- REINCIDENCIAS Y FALLAS TEMPRANAS ---
+obtener_resumen_general_rt = _corrutina(analisis.obtener_resumen_general_rt)
+obtener_distribucion_reincidencias = _corrutina(analisis.obtener_distribucion_reincidencias)
+obtener_resumen_general_ft = _corrutina(analisis.obtener_resumen_general_ft)
+obtener_resumen_rt_por_empresa = _corrutina(analisis.obtener_resumen_rt_por_empresa)
+obtener_detalle_rt = _corrutina(analisis.obtener_detalle_rt)
+obtener_historial_rodante_rt = _corrutina(analisis.obtener_historial_rodante_rt)
+obtener_resumen_ft_por_empresa = _corrutina(analisis.obtener_resumen_ft_por_empresa)
+obtener_detalle_ft = _corrutina(analisis.obtener_detalle_ft)
+obtener_historial_rodante_ft = _corrutina(analisis.obtener_historial_rodante_ft)
+obtener_historiales_rodantes = _corrutina(analisis.obtener_historiales_rodantes)
+obtener_matriz_mensual = _corrutina(analisis.obtener_matriz_mensual)
+
+# --- RANKINGS ---
+obtener_benchmarks_globales = _corrutina(analisis.obtener_benchmarks_globales)
+obtener_ranking_por_empresa = _corrutina(analisis.obtener_ranking_por_empresa)
+obtener_ranking_tecnicos = _corrutina(analisis.obtener_ranking_tecnicos)
+obtener_ranking_empresas = _corrutina(analisis.obtener_ranking_empresas)
+
+# --- COMUNAS, DURACIÓN Y BÚSQUEDA ---
+obtener_reparaciones_por_comuna = _corrutina(analisis.obtener_reparaciones_por_comuna)
+obtener_instalaciones_por_comuna = _corrutina(analisis.obtener_instalaciones_por_comuna)
+obtener_stats_calidad_por_comuna = _corrutina(analisis.obtener_stats_calidad_por_comuna)
+obtener_datos_duracion = _corrutina(analisis.obtener_datos_duracion)
+obtener_opciones_filtros = _corrutina(analisis.obtener_opciones_filtros)
+obtener_tiempos_promedio_empresa = _corrutina(analisis.obtener_tiempos_promedio_empresa)
+obtener_estadisticas_duracion = _corrutina(analisis.obtener_estadisticas_duracion)
+obtener_datos_causa_falla = _corrutina(analisis.obtener_datos_causa_falla)
+obtener_resumen_causa_falla = _corrutina(analisis.obtener_resumen_causa_falla)
+buscar_actividades = _corrutina(analisis.buscar_actividades)
+
+
+async def reunir(corrutinas, limite: int = None) -> list:
+    """
+    Ejecuta las corrutinas en paralelo y devuelve los resultados en el mismo orden.
+    'limite' acota cuántas consultas van a la BD a la vez (por defecto, el tamaño del pool),
+    para que un lote grande haga cola aquí y no agote el pool con TimeoutError.
+    """
+    semaforo = asyncio.Semaphore(limite or POOL_SIZE)
+
+    async def con_limite(corrutina):
+        async with semaforo:
+            return await corrutina
+
+    return await asyncio.gather(*(con_limite(c) for c in corrutinas))
+
+
+async def ranking_de_todas_las_empresas(engine: AsyncEngine, fecha_inicio: str, fecha_fin: str) -> dict:
+    """Ranking de técnicos de cada empresa, todas consultadas a la vez. Devuelve {empresa: DataFrame}."""
+    empresas = await get_company_list(engine)
+    rankings = await reunir(obtener_ranking_por_empresa(engine, fecha_inicio, fecha_fin, e) for e in empresas)
+    return dict(zip(empresas, rankings))
+
+
+async def _main(fecha_inicio: str, fecha_fin: str) -> None:
+    engine = crear_engine_async(application_name="analisis_async")
+    try:
+        inicio = time.perf_counter()
+        rankings = await ranking_de_todas_las_empresas(engine, fecha_inicio, fecha_fin)
+        print(f"⚡ {len(rankings)} rankings por empresa en {time.perf_counter() - inicio:.2f} s")
+        for empresa, df in rankings.items():
+            print(f"   - {empresa}: {len(df)} técnicos")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Consulta en paralelo el ranking de técnicos de todas las empresas.")
+    parser.add_argument("fecha_inicio", help="YYYY-MM-DD")
+    parser.add_argument("fecha_fin", help="YYYY-MM-DD")
+    args = parser.parse_args()
+    asyncio.run(_main(args.fecha_inicio, args.fecha_fin))
@@ -0,0 +1,76 @@
+# benchmark_kpi.py
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# Permite importar el paquete 'funciones' cuando este archivo se ejecuta como script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from funciones.kpi_ratios import porcentaje, clasificar
+
+# Compara el cálculo anterior de los porcentajes (df.apply fila a fila) con kpi_ratios sobre
+# tablas sintéticas con la forma de los resultados por técnico (asignadas/finalizadas, con
+# denominadores en 0). No usa la BD.
+
+
+def tabla_sintetica(filas: int, semilla: int = 0) -> pd.DataFrame:
+    generador = np.random.default_rng(semilla)
+    asignadas = generador.integers(0, 60, filas)
+    return pd.DataFrame({
+        "total_asignadas": asignadas,
+        "total_finalizadas": (asignadas * generador.uniform(0.6, 1.0, filas)).astype(int),
+    })
+
+
+def con_apply(df: pd.DataFrame) -> tuple:
+    pct = df.apply(
+        lambda row: (row['total_finalizadas'] / row['total_asignadas'] * 100) if row['total_asignadas'] > 0 else 0,
+        axis=1
+    )
+    etiqueta = pct.apply(lambda x: 'Cumple (>= 90%)' if x >= 90 else 'No Cumple (< 90%)')
+    return pct, etiqueta
+
+
+def vectorizado(df: pd.DataFrame) -> tuple:
+    pct = porcentaje(df['total_finalizadas'], df['total_asignadas'])
+    etiqueta = clasificar(pct, 90, 'Cumple (>= 90%)', 'No Cumple (< 90%)')
+    return pct, etiqueta
+
+
+def medir(funcion, df: pd.DataFrame, repeticiones: int) -> float:
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        funcion(df)
+        tiempos.append(time.perf_counter() - inicio)
+    return statistics.median(tiempos)
+
+
+def ejecutar_benchmark(tamanos: list, repeticiones: int = 3) -> None:
+    print(f"📊 Porcentajes de KPI: df.apply vs vectorizado (mediana de {repeticiones} repeticiones)\n")
+    for filas in tamanos:
+        df = tabla_sintetica(filas)
+        pct_apply, etiqueta_apply = con_apply(df)
+        pct_vector, etiqueta_vector = vectorizado(df)
+        # Mismo resultado antes de comparar tiempos
+        np.testing.assert_allclose(pct_vector.to_numpy(), pct_apply.to_numpy(dtype="float64"))
+        assert (etiqueta_vector == etiqueta_apply).all()
+
+        t_apply = medir(con_apply, df, repeticiones)
+        t_vector = medir(vectorizado, df, repeticiones)
+        mejora = t_apply / t_vector if t_vector else float("inf")
+        print(f"🔹 {filas:>9,} filas | apply: {t_apply:8.3f} s | vectorizado: {t_vector:8.4f} s | {mejora:,.0f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara df.apply con los porcentajes vectorizados de kpi_ratios.")
+    parser.add_argument("--filas", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    ejecutar_benchmark(args.filas, args.repeticiones)
@@ -0,0 +1,93 @@
+# benchmark_lectura.py
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+import sqlalchemy as sa
+
+# Permite importar el paquete 'funciones' cuando este archivo se ejecuta como script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from funciones.analisis import safe_read_sql, obtener_datos_causa_falla, buscar_actividades
+from funciones.conexion import crear_engine
+from funciones.lectura_arrow import disponible
+from funciones.visitas import TABLA_VISITAS
+
+# Compara la lectura actual (pd.read_sql, objetos Python fila a fila) con la lectura Arrow
+# (COPY binario por ADBC) sobre las consultas que más datos traen. Las funciones se llaman
+# sin caché para medir siempre la ida a la BD.
+
+_SQL_VISITAS_PERIODO = f"""
+    SELECT "Empresa", "Cod_Servicio", "Recurso", "Fecha Agendamiento", "Tipo de actividad", "Observación",
+           "Acción realizada", "Nombre Cliente", "Dirección", "Comuna", "Propietario de Red"
+    FROM public.{TABLA_VISITAS}
+    WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
+"""
+
+_SQL_ACTIVIDADES_PERIODO = """
+    SELECT "Fecha Agendamiento", "Empresa", "Recurso", "Estado de actividad", "Tipo de actividad", "Cod_Servicio",
+           "Rut Cliente", "Nombre Cliente", "ID externo", "Observación", "Acción realizada", "Dirección", "Comuna"
+    FROM public.actividades
+    WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
+"""
+
+
+def _casos(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, termino: str) -> dict:
+    """Cada caso es una función formato -> DataFrame."""
+    params = {"f_inicio": fecha_inicio, "f_fin": fecha_fin}
+
+    def leer(sql):
+        def caso(formato):
+            with engine.connect() as conn:
+                return safe_read_sql(conn, sql, params, formato=formato)
+        return caso
+
+    return {
+        "visitas del período (detalle RT/FT)": leer(_SQL_VISITAS_PERIODO),
+        "actividades del período (búsqueda)": leer(_SQL_ACTIVIDADES_PERIODO),
+        "causas de falla": lambda formato: obtener_datos_causa_falla.sin_cache(engine, fecha_inicio, fecha_fin, formato=formato),
+        f"buscar_actividades('{termino}')": lambda formato: buscar_actividades.sin_cache(engine, termino, formato=formato),
+    }
+
+
+def medir(caso, formato: str, repeticiones: int) -> dict:
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        df = caso(formato)
+        tiempos.append(time.perf_counter() - inicio)
+    return {
+        "filas": len(df),
+        "mediana_s": statistics.median(tiempos),
+        "memoria_mb": df.memory_usage(deep=True).sum() / 1024 ** 2,
+    }
+
+
+def ejecutar_benchmark(engine: sa.Engine, fecha_inicio: str, fecha_fin: str, termino: str = "a", repeticiones: int = 3) -> None:
+    if not disponible():
+        print("❌ Falta adbc-driver-postgresql: solo se puede medir la lectura actual.")
+        return
+    print(f"📊 Lectura pandas vs Arrow ({fecha_inicio} → {fecha_fin}, mediana de {repeticiones} repeticiones)\n")
+    for nombre, caso in _casos(engine, fecha_inicio, fecha_fin, termino).items():
+        caso("pandas")  # calentamiento: conexiones abiertas y páginas en caché de la BD
+        caso("arrow")
+        pandas_ = medir(caso, "pandas", repeticiones)
+        arrow_ = medir(caso, "arrow", repeticiones)
+        mejora = pandas_["mediana_s"] / arrow_["mediana_s"] if arrow_["mediana_s"] else float("inf")
+        print(f"🔹 {nombre}: {pandas_['filas']:,} filas")
+        print(f"   pandas: {pandas_['mediana_s']:.3f} s | {pandas_['memoria_mb']:.1f} MB")
+        print(f"   arrow:  {arrow_['mediana_s']:.3f} s | {arrow_['memoria_mb']:.1f} MB | {mejora:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara la lectura pd.read_sql con la lectura Arrow (COPY binario).")
+    parser.add_argument("fecha_inicio", help="YYYY-MM-DD")
+    parser.add_argument("fecha_fin", help="YYYY-MM-DD")
+    parser.add_argument("--termino", default="a", help="Término para buscar_actividades.")
+    parser.add_argument("--repeticiones", type=int, default=3)
+    args = parser.parse_args()
+
+    ejecutar_benchmark(crear_engine(application_name="benchmark_lectura"), args.fecha_inicio, args.fecha_fin,
+                       args.termino, args.repeticiones)
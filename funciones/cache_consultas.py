@@ -0,0 +1,114 @@
+# cache_consultas.py
+
+import copy
+import functools
+import inspect
+import os
+import threading
+import time
+from datetime import date, datetime
+
+import pandas as pd
+import sqlalchemy as sa
+
+from funciones.almacen_cache import crear_almacen
+from funciones.version_datos import obtener_version_datos
+
+# Caché para las funciones obtener_* de analisis.py. Streamlit atiende todas las sesiones en el
+# mismo proceso, así que un resultado calculado para un usuario sirve a los demás; con el almacén
+# en disco o kv (almacen_cache.py) también lo aprovechan las otras réplicas del dashboard.
+# La clave incluye la versión de los datos: cuando cargar_datos.py termina una carga, la versión
+# cambia y las entradas anteriores dejan de usarse (y salen por LRU), sin adivinar un TTL.
+MAX_ENTRADAS = int(os.environ.get("CACHE_MAX_ENTRADAS", 256))
+# Dónde se guardan los resultados: 'memoria' (por proceso), 'disco' o 'kv' (compartidos entre
+# réplicas y persistentes). CACHE_RUTA es la carpeta (disco) o el archivo (kv).
+TIPO_ALMACEN = os.environ.get("CACHE_BACKEND", "memoria")
+RUTA_ALMACEN = os.environ.get("CACHE_RUTA")
+# Cada cuántos segundos se vuelve a consultar la versión de los datos en la BD
+SEGUNDOS_VERSION = float(os.environ.get("CACHE_SEGUNDOS_VERSION", 15))
+
+
+_cache = crear_almacen(TIPO_ALMACEN, MAX_ENTRADAS, RUTA_ALMACEN)
+_versiones = {}  # url del engine -> (versión, momento de la consulta)
+_lock_versiones = threading.Lock()
+
+
+def _version_actual(engine: sa.Engine) -> int:
+    url = str(engine.url)
+    ahora = time.monotonic()
+    with _lock_versiones:
+        guardada = _versiones.get(url)
+    if guardada is not None and ahora - guardada[1] < SEGUNDOS_VERSION:
+        return guardada[0]
+    version = obtener_version_datos(engine)
+    with _lock_versiones:
+        _versiones[url] = (version, ahora)
+    return version
+
+
+def _normalizar(valor):
+    """Lleva los argumentos a una forma canónica y hasheable ('2025-01-01' == date(2025, 1, 1))."""
+    if isinstance(valor, datetime):  # incluye pd.Timestamp
+        if valor.hour == valor.minute == valor.second == valor.microsecond == 0:
+            return valor.strftime("%Y-%m-%d")
+        return valor.isoformat()
+    if isinstance(valor, date):
+        return valor.isoformat()
+    if isinstance(valor, str):
+        return valor.strip()
+    if isinstance(valor, (set, frozenset)):
+        return tuple(sorted((_normalizar(v) for v in valor), key=repr))
+    if isinstance(valor, (list, tuple)):
+        return tuple(_normalizar(v) for v in valor)
+    return valor
+
+
+def _copiar(resultado):
+    # Las páginas modifican los DataFrames que reciben; la caché entrega siempre una copia
+    if isinstance(resultado, pd.DataFrame):
+        return resultado.copy()
+    return copy.deepcopy(resultado)
+
+
+def cache_por_version(funcion):
+    """
+    Decorador para funciones con firma (engine, ...). Guarda el resultado según el nombre de la
+    función, sus argumentos normalizados y la versión de los datos.
+    """
+    firma = inspect.signature(funcion)
+
+    @functools.wraps(funcion)
+    def envoltura(engine, *args, **kwargs):
+        argumentos = firma.bind(engine, *args, **kwargs)
+        argumentos.apply_defaults()
+        clave = (
+            funcion.__qualname__,
+            str(engine.url),
+            _version_actual(engine),
+            tuple((nombre, _normalizar(valor)) for nombre, valor in list(argumentos.arguments.items())[1:]),
+        )
+        resultado, encontrado = _cache.obtener(clave)
+        if not encontrado:
+            resultado = funcion(engine, *args, **kwargs)
+            _cache.guardar(clave, resultado)
+        return _copiar(resultado)
+
+    envoltura.sin_cache = funcion
+    return envoltura
+
+
+def configurar_cache(tipo: str, ruta: str = None, max_entradas: int = MAX_ENTRADAS) -> None:
+    """Cambia el almacén de la caché (ej. configurar_cache("disco", "/mnt/compartido/cache"))."""
+    global _cache
+    _cache = crear_almacen(tipo, max_entradas, ruta)
+
+
+def limpiar_cache() -> None:
+    _cache.limpiar()
+    with _lock_versiones:
+        _versiones.clear()
+
+
+def estadisticas_cache() -> dict:
+    return {"almacen": type(_cache).__name__, "entradas": len(_cache), "max_entradas": _cache.max_entradas,
+            "aciertos": _cache.aciertos, "fallos": _cache.fallos}
@@ -0,0 +1,136 @@
+# carga_staging.py
+
+import io
+import time
+
+import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy import text
+
+from funciones.esquema import TABLA, CLAVE_NATURAL, CATALOGOS
+from funciones.copy_binario import FlujoCopyBinario, tipo_postgres
+
+# Carga idempotente: los registros se copian con COPY a una tabla de staging temporal (sin WAL,
+# se borra sola al terminar la transacción) y desde ahí un único INSERT ... ON CONFLICT los fusiona
+# con 'actividades' usando la clave natural. Todo ocurre en una transacción: si algo falla no queda
+# nada a medias, y volver a ejecutar la carga (o recargar un Excel corregido) reemplaza las filas
+# en vez de duplicarlas.
+TABLA_STAGING = f"{TABLA}_staging"
+TAMANO_LOTE_COPY = 5000
+# Cómo se codifican los registros para el COPY: 'csv' (to_csv a un StringIO por lote) o
+# 'binario' (formato binario de PostgreSQL codificado con numpy, ver copy_binario.py)
+MODOS_COPY = ("csv", "binario")
+
+
+def _copiar_csv(cursor, df: pd.DataFrame, tamano_lote: int) -> None:
+    total_lotes = (len(df) + tamano_lote - 1) // tamano_lote
+    column_names = '","'.join(df.columns)
+    sql = f'COPY {TABLA_STAGING} ("{column_names}") FROM STDIN WITH (FORMAT CSV, DELIMITER E\'\\t\', NULL \'\\N\')'
+    for i in range(0, len(df), tamano_lote):
+        print(f"⏳ Copiando lote {i // tamano_lote + 1}/{total_lotes} a staging...")
+        buffer = io.StringIO()
+        df.iloc[i:i + tamano_lote].to_csv(buffer, sep='\t', header=False, index=False, na_rep='\\N',
+                                          date_format='%Y-%m-%d %H:%M:%S')
+        buffer.seek(0)
+        cursor.copy_expert(sql, buffer)
+
+
+def _copiar_binario(cursor, df: pd.DataFrame, tamano_lote: int) -> None:
+    # Un solo COPY para todos los lotes: cada lote se codifica recién cuando psycopg2 lo pide
+    column_names = '","'.join(df.columns)
+    flujo = FlujoCopyBinario(df, tamano_lote, al_codificar=lambda filas: print(f"⏳ {filas:,}/{len(df):,} filas codificadas..."))
+    cursor.copy_expert(f'COPY {TABLA_STAGING} ("{column_names}") FROM STDIN WITH (FORMAT binary)', flujo)
+
+
+def _tipos_destino(conn) -> dict:
+    return dict(conn.execute(text("""
+        SELECT attname, format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = CAST(:tabla AS regclass) AND attnum > 0 AND NOT attisdropped
+    """), {"tabla": f"public.{TABLA}"}).all())
+
+
+def _convertida(columna: str, tipos_destino: dict) -> str:
+    # La staging tiene los tipos del DataFrame (texto, salvo fechas y duraciones ya convertidas);
+    # se convierten a los de 'actividades', igual que lo hacía COPY al cargar directo.
+    return f'CAST("{columna}" AS {tipos_destino[columna]})'
+
+
+def _sql_fusion(columnas: list, tipos_destino: dict) -> str:
+    lista = ", ".join(f'"{c}"' for c in columnas)
+    convertidas = ", ".join(f'{_convertida(c, tipos_destino)} AS "{c}"' for c in columnas)
+    clave = ", ".join(f'"{c}"' for c in CLAVE_NATURAL)
+    clave_convertida = ", ".join(_convertida(c, tipos_destino) for c in CLAVE_NATURAL)
+    clave_completa = " AND ".join(f'"{c}" IS NOT NULL' for c in CLAVE_NATURAL)
+    actualizar = [f'"{c}" = EXCLUDED."{c}"' for c in columnas if c not in CLAVE_NATURAL]
+    # Si cambia el texto del estado o del tipo, asignar_codigos vuelve a calcular su código
+    actualizar += [f"{columna_cod} = NULL" for columna_cod in CATALOGOS]
+    return f"""
+        WITH fusion AS (
+            INSERT INTO public.{TABLA} ({lista})
+            SELECT {lista}
+            FROM (
+                -- Si el mismo registro viene dos veces en la carga, gana la última aparición
+                SELECT {convertidas}, row_number() OVER (PARTITION BY {clave_convertida} ORDER BY ctid DESC) AS n
+                FROM {TABLA_STAGING}
+            ) s
+            WHERE n = 1 OR NOT ({clave_completa})
+            ON CONFLICT ({clave}) DO UPDATE SET {", ".join(actualizar)}
+            RETURNING (xmax = 0) AS insertada
+        )
+        SELECT
+            COUNT(*) FILTER (WHERE insertada) AS insertadas,
+            COUNT(*) FILTER (WHERE NOT insertada) AS actualizadas
+        FROM fusion
+    """
+
+
+def cargar_con_upsert(engine: sa.Engine, df: pd.DataFrame, tamano_lote: int = TAMANO_LOTE_COPY,
+                      modo: str = "csv") -> dict:
+    """
+    Carga 'df' en 'actividades' en una sola transacción: COPY por lotes a la tabla de staging y
+    fusión con INSERT ... ON CONFLICT sobre CLAVE_NATURAL (las filas existentes se actualizan).
+    'modo' elige la codificación del COPY (MODOS_COPY).
+    Devuelve {'insertadas', 'actualizadas', 'servicios_previos', 'segundos', 'segundos_copy',
+    'filas_por_segundo'}; 'servicios_previos' son los Cod_Servicio que tenían antes las filas
+    actualizadas (sus visitas hay que recalcularlas) y 'filas_por_segundo' mide solo el COPY.
+    """
+    if modo not in MODOS_COPY:
+        raise ValueError(f"Modo de COPY desconocido: {modo!r} (opciones: {', '.join(MODOS_COPY)})")
+    faltantes = [c for c in CLAVE_NATURAL if c not in df.columns]
+    if faltantes:
+        raise ValueError(f"Los registros no traen las columnas de la clave natural: {faltantes}")
+
+    inicio = time.perf_counter()
+    columnas = list(df.columns)
+    definicion = ", ".join(f'"{c}" {tipo_postgres(df[c])}' for c in columnas)
+
+    with engine.begin() as conn:
+        tipos_destino = _tipos_destino(conn)
+        conn.execute(text(f"CREATE TEMP TABLE {TABLA_STAGING} ({definicion}) ON COMMIT DROP"))
+        inicio_copy = time.perf_counter()
+        with conn.connection.cursor() as cursor:
+            (_copiar_binario if modo == "binario" else _copiar_csv)(cursor, df, tamano_lote)
+        segundos_copy = time.perf_counter() - inicio_copy
+        conn.execute(text(f"ANALYZE {TABLA_STAGING}"))
+
+        # Antes de fusionar: servicios de las filas que se van a reemplazar (el Excel corregido
+        # puede traer otro Cod_Servicio para la misma actividad)
+        servicios_previos = set(conn.execute(text(f"""
+            SELECT DISTINCT a."Cod_Servicio"
+            FROM public.{TABLA} a
+            JOIN {TABLA_STAGING} s
+              ON {" AND ".join(f'a."{c}" = CAST(s."{c}" AS {tipos_destino[c]})' for c in CLAVE_NATURAL)}
+            WHERE a."Cod_Servicio" IS NOT NULL
+        """)).scalars())
+
+        insertadas, actualizadas = conn.execute(text(_sql_fusion(columnas, tipos_destino))).one()
+
+    return {
+        "insertadas": insertadas,
+        "actualizadas": actualizadas,
+        "servicios_previos": servicios_previos,
+        "segundos": time.perf_counter() - inicio,
+        "segundos_copy": segundos_copy,
+        "filas_por_segundo": len(df) / segundos_copy if segundos_copy else float("inf"),
+    }
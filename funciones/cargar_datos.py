@@ -3,122 +3,87 @@
 import pandas as pd
 from glob import glob
 import os
+import sys
 import sqlalchemy as sa
-from sqlalchemy import create_engine, DateTime, Time
-from sqlalchemy.dialects.postgresql import INTERVAL
 import time
 from datetime import datetime
-import io
+import argparse
 
-print(f"--- Inicio del proceso de carga: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---")
+# Permite importar el paquete 'funciones' cuando este archivo se ejecuta como script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from funciones.ingesta import leer_excels_en_paralelo, imprimir_reporte_tiempos
+from funciones.almacen_parquet import (
+    escribir_particiones, leer_dataset, compactar, migrar_parquet_unico, eliminar_archivo_origen
+)
+from funciones.esquema import (
+    TIPOS_COLUMNAS, COLUMNAS_NORMALIZADAS, migrar_esquema, asignar_codigos,
+    duplicadas_pendientes, marcar_duplicadas_recalculadas
+)
+from funciones.manifiesto import (
+    abrir_manifiesto, manifiesto_vacio, clasificar_archivos, registrar_archivos, sembrar_manifiesto
+)
+from funciones.visitas import TABLA_VISITAS, actualizar_visitas, reconstruir_visitas, fechas_de_servicios
+from funciones.kpi_diario import TABLA_KPI_DIARIO, actualizar_kpi_diario, reconstruir_kpi_diario
+from funciones.ventanas_kpi import TABLA_VENTANAS, actualizar_ventanas, reconstruir_ventanas
+from funciones.carga_staging import cargar_con_upsert, MODOS_COPY
+from funciones.version_datos import incrementar_version_datos
+from funciones.exclusiones import (
+    COMUNAS_EXCLUIDAS, crear_tablas_exclusiones, cargar_exclusiones, actualizar_dim_recurso, TABLA_DIM_RECURSO,
+    sincronizar_dim_recurso
+)
+from funciones import conexion
 
 # --- 1. CONFIGURACIÓN ---
 ruta_base_datos = r"C:\Users\alex_\Downloads\Proyecto_EntelRM\Datos"
+# Dataset particionado por Empresa/año/mes (cada carga agrega archivos, no reescribe nada)
+ruta_dataset = os.path.join(ruta_base_datos, "datos_unificados")
+# Formato anterior: un solo archivo con todo el histórico (solo se usa para migrar)
 ruta_parquet = os.path.join(ruta_base_datos, "datos_unificados.parquet")
+# Registro de los Excel ya cargados (ruta, tamaño, fecha de modificación y hash)
+ruta_manifiesto = os.path.join(ruta_base_datos, "manifiesto_ingesta.db")
 tabla_destino = "actividades"
+# Procesos que leen los Excel en paralelo (se puede cambiar con la variable de entorno CARGA_WORKERS).
+# Un valor 0 o negativo se lleva a 1 (lectura en el mismo proceso) en vez de fallar a mitad de la carga.
+num_workers_lectura = max(1, int(os.environ.get("CARGA_WORKERS", os.cpu_count() or 1)))
+# Codificación del COPY: 'csv' o 'binario' (se puede cambiar con CARGA_COPY o con --copy)
+modo_copy = os.environ.get("CARGA_COPY", "csv")
 
-# --- 2. LECTURA DE ARCHIVOS ---
-try:
-    if os.path.exists(ruta_parquet):
-        df_existente = pd.read_parquet(ruta_parquet)
-        archivos_procesados = set(df_existente["Archivo_Origen"].unique())
-        print(f"📦 Parquet existente con {len(df_existente):,} registros. {len(archivos_procesados)} archivos ya procesados.")
-    else:
-        df_existente = pd.DataFrame()
-        archivos_procesados = set()
-        print("📦 No hay parquet existente. Se procesará todo como si fuera nuevo.")
-
-    rutas_excel_nuevas = [
-        ruta for ruta in glob(os.path.join(ruta_base_datos, '**', '*.xlsx'), recursive=True)
-        if os.path.basename(ruta) not in archivos_procesados
-    ]
-    print(f"🔍 Se encontraron {len(rutas_excel_nuevas)} archivos Excel nuevos para procesar.")
-
-    if not rutas_excel_nuevas:
-        print("⏩ No hay archivos nuevos que agregar. Proceso terminado.")
-        exit()
-
-    # --- 3. PROCESAMIENTO DE NUEVOS ARCHIVOS ---
-    df_list = []
-    for ruta in rutas_excel_nuevas:
-        try:
-            df = pd.read_excel(ruta, dtype=str)
-            df["Archivo_Origen"] = os.path.basename(ruta)
-            df["Empresa"] = os.path.basename(os.path.dirname(ruta))
-            df_list.append(df)
-            print(f"✅ Leyendo archivo nuevo: {os.path.basename(ruta)}")
-        except Exception as e:
-            print(f"❌ Error cargando {ruta}: {e}")
-
-    if not df_list:
-        print("No se pudieron cargar datos de los nuevos archivos.")
-        exit()
-
-    df_nuevo = pd.concat(df_list, ignore_index=True)
-    print(f"⚙️  {len(df_nuevo):,} nuevos registros a procesar y agregar.")
-
-    # --- 4. TRANSFORMACIÓN DE DATOS (ETL) ---
-    print("⚙️  Iniciando limpieza y transformación de los datos nuevos...")
-    print(f"\n[DEBUG] Antes de cualquier filtro, df_nuevo tiene {len(df_nuevo)} filas.")
+
+def transformar_lote(df_nuevo: pd.DataFrame, comunas_excluidas=COMUNAS_EXCLUIDAS) -> tuple:
+    """
+    Aplica la limpieza y transformación (ETL) a los registros de un archivo recién leído.
+    Todas las reglas son fila a fila, por eso se pueden aplicar archivo por archivo
+    mientras el pool sigue leyendo el resto. Devuelve (DataFrame limpio, filas excluidas por comuna).
+    'comunas_excluidas' son las del registro de exclusiones (tabla excl_comuna).
+    """
     # ========================================================================
     # --- INICIO: FILTRADO DE EXCLUSIÓN DE COMUNAS ---
     # ========================================================================
-    
-    comunas_a_excluir = {
-        'algarrobo', 'antofagasta', 'calama', 'calera', 'canete', 'casablanca',
-        'catemu', 'chiguayante', 'chillan', 'chillan viejo', 'cnt', 'concepcion',
-        'conchali|', 'copiapo', 'coquimbo', 'coronel', 'curacavi', 'curico', 'peñalolen',
-        'donihue', 'el monte', 'el quisco', 'el tabo', 'hijuelas', 'la cruz',
-        'las. ondes', 'limache', 'linares', 'los angeles', 'los andes', 'machali',
-        'melipilla', 'nogales', 'none', 'padre las casas', 'villarrica', 'ñuñoa',
-        'pedro aguirres cerda', 'penaflor', 'penco', 'puerto montt', 'quillota',
-        'quilpue', 'rancagua', 'rengo', 'rinconada', 'san antonio', 'san esteban',
-        'san felipe', 'san bernardo', 'san javier', 'san pedro', 'hualpen', 'la serena',
-        'san pedro de la paz', 'santa cruz', 'talca', 'talcahuano', 'temuco',
-        'tiltil', 'tome', 'ura dario urzua', 'valaparaiso', 'villa alemana', 'pichilemu',
-        'villa rica', 'viña del mar', 'x', 'vina del mar', 'olmue', 'calle larga',
-        'concon', 'valparaiso', 'llaillay', 'vallenar', 'panquehue', 'mostazal', 'graneros',
-        'san fernando', 'olivar', 'hualqui', 'iquique', 'santo domingo', 'santa maria'
-    }
-
+    excluidos_comuna = 0
     if 'Comuna' in df_nuevo.columns:
         df_nuevo['Comuna'] = df_nuevo['Comuna'].fillna('').astype(str).str.lower().str.strip()
         registros_antes = len(df_nuevo)
-        df_nuevo = df_nuevo[~df_nuevo['Comuna'].isin(comunas_a_excluir)]
-        print(f"🧹 Filtro de comunas aplicado. Se excluyeron {registros_antes - len(df_nuevo)} registros.")
+        df_nuevo = df_nuevo[~df_nuevo['Comuna'].isin(comunas_excluidas)].copy()
+        excluidos_comuna = registros_antes - len(df_nuevo)
+
+    # --- 'ID de recurso' como número entero (en la BD es integer) ---
+    # El Excel a veces trae "3826.0"; se normaliza a "3826" y lo no numérico queda vacío.
+    if 'ID de recurso' in df_nuevo.columns:
+        df_nuevo['ID de recurso'] = pd.to_numeric(df_nuevo['ID de recurso'], errors='coerce').astype('Int64').astype('string')
 
-    
-         # --- CORRECCIÓN DE DATOS PARA 'Propietario de Red' ---
-    print("🔧 Aplicando regla de negocio final para 'Propietario de Red'...")
-    
+    # --- CORRECCIÓN DE DATOS PARA 'Propietario de Red' ---
     # 1. Normalizamos la columna para una comparación limpia
     if 'Propietario de Red' in df_nuevo.columns:
         df_nuevo['Propietario de Red'] = df_nuevo['Propietario de Red'].fillna('').astype(str).str.lower().str.strip()
 
         # 2. Creamos una condición que es Verdadera para CUALQUIER valor que NO sea 'onnet'
         condicion_no_es_onnet = df_nuevo['Propietario de Red'] != 'onnet'
-        
+
         # 3. A todas esas filas, les asignamos 'entel' como Propietario de Red
         df_nuevo.loc[condicion_no_es_onnet, 'Propietario de Red'] = 'entel'
-    
-    print("✅ 'Propietario de Red' estandarizado a 'entel' u 'onnet'.")
-    # ========================================================================
-    # --- FIN DE LA CORRECCIÓN -
-    # ========================================================================
-    # --- INICIO: SEGUNDO PUNTO DE CONTROL DE DIAGNÓSTICO ---
-    # ========================================================================
-    print(f"\n[DEBUG] Después de TODOS los filtros, df_nuevo tiene {len(df_nuevo)} filas.")
-    if df_nuevo.empty:
-        print("[DEBUG] El DataFrame de nuevos registros está VACÍO. No se cargará nada a PostgreSQL.")
-    else:
-        print("[DEBUG] El DataFrame de nuevos registros tiene datos. Debería cargarse a PostgreSQL.")
-    # ========================================================================
-    
 
-    # Si después de todos los filtros, no queda nada, podemos salir para ahorrar tiempo.
     if df_nuevo.empty:
-        print("⏩ No hay nuevos registros válidos que cargar después de aplicar los filtros. Proceso terminado.")
-        exit()
+        return df_nuevo, excluidos_comuna
 
     # Renombrar columnas si tienen espacios o caracteres problemáticos para un manejo más fácil
     df_nuevo = df_nuevo.rename(columns={'Fecha Agendamiento': 'Fecha_Agendamiento'})
@@ -137,65 +102,253 @@ try:
     if 'Inicio' in df_nuevo.columns and 'Finalización' in df_nuevo.columns:
         delta = df_nuevo['Finalización'] - df_nuevo['Inicio']
         df_nuevo['Duración'] = delta.where(delta >= pd.Timedelta(0), pd.NaT)
-    
+
     # Renombrar la columna de fecha a su nombre original para coincidir con la BD si es necesario
     df_nuevo = df_nuevo.rename(columns={'Fecha_Agendamiento': 'Fecha Agendamiento'})
-    
-    print("✅ Transformación de datos completada.")
-
-    # --- 5. CARGA A POSTGRESQL EN LOTES ---
-    print("\n📌 Iniciando carga INCREMENTAL a PostgreSQL...")
-    usuario = "postgres"; password = "postgres"; host = "localhost"; puerto = "5432"; base_datos = "entelrm"
-    conexion_str = f"postgresql://{usuario}:{password}@{host}:{puerto}/{base_datos}"
-    engine = create_engine(conexion_str)
-    
-    dtype_mapping = {
-        'Fecha Agendamiento': DateTime, 
-        'Inicio': DateTime, 
-        'Finalización': DateTime, 
-        'Duración': INTERVAL
-    }
-    
-    all_columns = {col: sa.types.TEXT for col in df_nuevo.columns}
-    all_columns.update(dtype_mapping)
-
-    with engine.connect() as conn, conn.begin():
-        inspector = sa.inspect(engine)
-        if not inspector.has_table(tabla_destino):
-            print(f"📐 La tabla '{tabla_destino}' no existe. Creando estructura...")
-            df_nuevo.head(0).to_sql(tabla_destino, conn, index=False, if_exists='replace', dtype=all_columns)
-            print("✅ Estructura de tabla creada.")
-
-    start_time_total = time.time()
-    
-    chunk_size = 5000 
-    for i in range(0, len(df_nuevo), chunk_size):
-        chunk_actual = df_nuevo.iloc[i:i+chunk_size]
-        print(f"\n⏳ Subiendo lote {i//chunk_size + 1}/{(len(df_nuevo) + chunk_size - 1) // chunk_size}...")
-        
+
+    # Paso 4: Columnas normalizadas (minúsculas, sin espacios) que usan los filtros de las consultas
+    for col_norm, col_origen in COLUMNAS_NORMALIZADAS.items():
+        if col_origen in df_nuevo.columns:
+            df_nuevo[col_norm] = df_nuevo[col_origen].str.lower().str.strip()
+
+    return df_nuevo, excluidos_comuna
+
+
+def crear_engine() -> sa.Engine:
+    # La carga y las reconstrucciones son largas a propósito: sin statement_timeout
+    return conexion.crear_engine(application_name="carga_datos", statement_timeout_ms=0)
+
+
+def eliminar_cargas_previas(engine: sa.Engine, rutas: list) -> tuple:
+    """
+    Borra de PostgreSQL y del dataset Parquet las filas de los Excel que cambiaron,
+    antes de volver a cargarlos, para no duplicar registros.
+    Devuelve (Cod_Servicio, días) que perdieron filas: hay que recalcular sus visitas y agregados.
+    """
+    existe_tabla = sa.inspect(engine).has_table(tabla_destino)
+    servicios_afectados, fechas_afectadas = set(), set()
+    for ruta in rutas:
+        empresa = os.path.basename(os.path.dirname(ruta))
+        archivo = os.path.basename(ruta)
+        borradas_bd = 0
+        if existe_tabla:
+            with engine.begin() as conn:
+                borradas = conn.execute(
+                    sa.text(f'DELETE FROM "{tabla_destino}" WHERE "Empresa" = :empresa AND "Archivo_Origen" = :archivo '
+                            'RETURNING "Cod_Servicio", fecha_agendamiento_dia'),
+                    {"empresa": empresa, "archivo": archivo},
+                ).all()
+            borradas_bd = len(borradas)
+            servicios_afectados.update(servicio for servicio, _ in borradas if servicio is not None)
+            fechas_afectadas.update(fecha for _, fecha in borradas)
+        borradas_parquet = eliminar_archivo_origen(ruta_dataset, empresa, archivo)
+        print(f"♻️  {empresa}/{archivo} cambió: se eliminaron {borradas_bd:,} filas de PostgreSQL y {borradas_parquet:,} del Parquet.")
+    return servicios_afectados, fechas_afectadas
+
+
+def main(modo_copy: str = modo_copy):
+    print(f"--- Inicio del proceso de carga: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')} ---")
+
+    # --- 2. LECTURA DE ARCHIVOS ---
+    try:
+        if not os.path.isdir(ruta_dataset) and os.path.exists(ruta_parquet):
+            print("📦 Se encontró el parquet de archivo único. Migrando al dataset particionado...")
+            migrados = migrar_parquet_unico(ruta_parquet, ruta_dataset)
+            print(f"✅ {migrados:,} registros migrados a '{ruta_dataset}'.")
+
+        rutas_excel = glob(os.path.join(ruta_base_datos, '**', '*.xlsx'), recursive=True)
+        manifiesto = abrir_manifiesto(ruta_manifiesto)
+
+        if manifiesto_vacio(manifiesto) and os.path.isdir(ruta_dataset):
+            # Primera ejecución con manifiesto: se registran los Excel que ya están en el dataset
+            df_origen = leer_dataset(ruta_dataset, columnas=["Empresa", "Archivo_Origen"]).drop_duplicates()
+            ya_cargados = set(df_origen.itertuples(index=False, name=None))
+            sembrados = sembrar_manifiesto(manifiesto, rutas_excel, ruta_base_datos, ya_cargados)
+            print(f"📒 Manifiesto inicializado con {sembrados} archivos ya cargados.")
+
+        rutas_nuevas, rutas_modificadas, firmas = clasificar_archivos(manifiesto, rutas_excel, ruta_base_datos)
+        rutas_excel_nuevas = rutas_nuevas + rutas_modificadas
+        print(f"🔍 Se encontraron {len(rutas_nuevas)} archivos Excel nuevos y {len(rutas_modificadas)} modificados para procesar.")
+
+        if not rutas_excel_nuevas:
+            print("⏩ No hay archivos nuevos que agregar. Proceso terminado.")
+            return
+
+        # --- 3. LECTURA PARALELA + 4. TRANSFORMACIÓN DE DATOS (ETL) ---
+        # Cada archivo se transforma apenas llega desde el pool, sin esperar a que terminen los demás.
+        print(f"⚙️  Leyendo y transformando con {num_workers_lectura} procesos...")
+        engine = crear_engine()
+        crear_tablas_exclusiones(engine)
+        # Nombres excluidos cambiados directamente en la BD: las tablas derivadas usaron la bandera
+        # anterior de esos técnicos (en cualquier día), así que se reconstruyen completas
+        resincronizados = sincronizar_dim_recurso(engine)
+        if resincronizados:
+            print(f"👷 {TABLA_DIM_RECURSO}: {len(resincronizados):,} técnicos cambiaron de exclusión "
+                  f"({', '.join(resincronizados[:5])}{'...' if len(resincronizados) > 5 else ''}). Reconstruyendo tablas derivadas...")
+            reconstruir_visitas(engine)
+            reconstruir_kpi_diario(engine)
+            reconstruir_ventanas(engine)
+            incrementar_version_datos(engine)
+        comunas_excluidas = cargar_exclusiones(engine).comunas
+        start_time_lectura = time.time()
+        df_list = []
+        tiempos_lectura = []
+        registros_leidos = 0
+        registros_excluidos_comuna = 0
+        filas_por_ruta = {}
+        for ruta, df, segundos, error in leer_excels_en_paralelo(rutas_excel_nuevas, num_workers_lectura):
+            tiempos_lectura.append((ruta, segundos))
+            if error is not None:
+                print(f"❌ Error cargando {ruta}: {error}")
+                continue
+            print(f"✅ Leyendo archivo nuevo: {os.path.basename(ruta)} ({segundos:.2f} s)")
+            registros_leidos += len(df)
+            df_limpio, excluidos = transformar_lote(df, comunas_excluidas)
+            registros_excluidos_comuna += excluidos
+            filas_por_ruta[ruta] = len(df_limpio)
+            if not df_limpio.empty:
+                df_list.append(df_limpio)
+
+        imprimir_reporte_tiempos(tiempos_lectura)
+        print(f"\n⏱️  Lectura y transformación completadas en {time.time() - start_time_lectura:.2f} segundos.")
+
+        print(f"\n[DEBUG] Antes de cualquier filtro, se leyeron {registros_leidos} filas.")
+        print(f"🧹 Filtro de comunas aplicado. Se excluyeron {registros_excluidos_comuna} registros.")
+        print("✅ 'Propietario de Red' estandarizado a 'entel' u 'onnet'.")
+
+        # Los Excel que cambiaron se recargan completos: primero se quitan sus filas anteriores.
+        rutas_recargadas = [ruta for ruta in rutas_modificadas if ruta in filas_por_ruta]
+        # Una tabla creada por una versión anterior se migra antes de tocarla: el borrado
+        # de las cargas previas ya usa las columnas nuevas (fecha_agendamiento_dia)
+        for cambio in migrar_esquema(engine):
+            print(f"📐 Esquema actualizado: {cambio}")
+        # Filas que la migración quitó al crear la clave natural: sus servicios y días se recalculan
+        # junto con los de los Excel recargados
+        servicios_borrados, fechas_borradas = duplicadas_pendientes(engine)
+        if servicios_borrados or fechas_borradas:
+            print(f"♻️  Duplicados respaldados: se recalculan {len(servicios_borrados):,} servicios y {len(fechas_borradas):,} días.")
+        if rutas_recargadas:
+            servicios_recargados, fechas_recargadas = eliminar_cargas_previas(engine, rutas_recargadas)
+            servicios_borrados |= servicios_recargados
+            fechas_borradas |= fechas_recargadas
+
+        # Si después de todos los filtros, no queda nada, podemos salir para ahorrar tiempo.
+        if not df_list:
+            if servicios_borrados or fechas_borradas:
+                actualizar_visitas(engine, servicios_borrados)
+                fechas_recalculadas = fechas_borradas | fechas_de_servicios(engine, servicios_borrados)
+                actualizar_kpi_diario(engine, fechas_recalculadas)
+                actualizar_ventanas(engine, fechas_recalculadas)
+                incrementar_version_datos(engine)
+                marcar_duplicadas_recalculadas(engine)
+            registrar_archivos(manifiesto, firmas, filas_por_ruta, ruta_base_datos)
+            print("⏩ No hay nuevos registros válidos que cargar después de aplicar los filtros. Proceso terminado.")
+            return
+
+        df_nuevo = pd.concat(df_list, ignore_index=True)
+        print(f"[DEBUG] Después de TODOS los filtros, df_nuevo tiene {len(df_nuevo)} filas.")
+        print(f"⚙️  {len(df_nuevo):,} nuevos registros a procesar y agregar.")
+        print("✅ Transformación de datos completada.")
+
+        # --- 5. CARGA A POSTGRESQL EN LOTES ---
+        print("\n📌 Iniciando carga INCREMENTAL a PostgreSQL...")
+
+        all_columns = {col: sa.types.TEXT for col in df_nuevo.columns}
+        all_columns.update({col: tipo for col, tipo in TIPOS_COLUMNAS.items() if col in df_nuevo.columns})
+
         with engine.connect() as conn, conn.begin():
-            buffer = io.StringIO()
-            chunk_actual.to_csv(buffer, sep='\t', header=False, index=False, na_rep='\\N', date_format='%Y-%m-%d %H:%M:%S')
-            buffer.seek(0)
-            
-            dbapi_conn = conn.connection
-            with dbapi_conn.cursor() as cursor:
-                column_names = '","'.join(chunk_actual.columns)
-                sql = f'COPY "{tabla_destino}" ("{column_names}") FROM STDIN WITH (FORMAT CSV, DELIMITER E\'\\t\', NULL \'\\N\')'
-                cursor.copy_expert(sql, buffer)
-        print(f"✅ Lote {i//chunk_size + 1} cargado.")
-
-    print(f"\n🚀 ¡Carga incremental completada en {time.time() - start_time_total:.2f} segundos!")
-
-    # --- 6. GUARDADO FINAL DEL PARQUET ---
-    print("\n💾 Guardando Parquet actualizado con todos los registros...")
-    df_total = pd.concat([df_existente, df_nuevo], ignore_index=True)
-    df_total.to_parquet(ruta_parquet, index=False)
-    print(f"✅ Parquet guardado. El total de registros en Parquet ahora es: {len(df_total):,}")
-
-except Exception as e:
-    print(f"\n❌❌❌ Error general en el proceso: {e}")
-    import traceback
-    traceback.print_exc()
-
-print(f"\n🎯 Proceso terminado a las {datetime.now().strftime('%H:%M:%S')}")
\ No newline at end of file
+            inspector = sa.inspect(engine)
+            if not inspector.has_table(tabla_destino):
+                print(f"📐 La tabla '{tabla_destino}' no existe. Creando estructura...")
+                df_nuevo.head(0).to_sql(tabla_destino, conn, index=False, if_exists='replace', dtype=all_columns)
+                print("✅ Estructura de tabla creada.")
+
+        # Deja la tabla con su esquema tipado (no hace nada si ya está migrada)
+        for cambio in migrar_esquema(engine):
+            print(f"📐 Esquema actualizado: {cambio}")
+
+        start_time_total = time.time()
+
+        # COPY a staging + UPSERT por la clave natural, en una transacción: re-ejecutable sin duplicar
+        resultado = cargar_con_upsert(engine, df_nuevo, modo=modo_copy)
+        print(f"📈 COPY {modo_copy}: {len(df_nuevo):,} filas en {resultado['segundos_copy']:.2f} segundos "
+              f"({resultado['filas_por_segundo']:,.0f} filas/s).")
+        print(f"✅ {resultado['insertadas']:,} registros nuevos y {resultado['actualizadas']:,} actualizados "
+              f"en {resultado['segundos']:.2f} segundos.")
+
+        with engine.begin() as conn:
+            asignar_codigos(conn)
+        print("🏷️  Códigos de estado y tipo de actividad asignados a los registros nuevos.")
+
+        # Exclusión por nombre evaluada una vez por técnico (las tablas derivadas filtran por esa bandera)
+        tecnicos = actualizar_dim_recurso(engine, df_nuevo["Recurso"].dropna().unique())
+        print(f"👷 {TABLA_DIM_RECURSO}: {tecnicos:,} técnicos evaluados.")
+
+        # Solo se recalculan las secuencias de visitas de los servicios que cambiaron
+        start_time_visitas = time.time()
+        servicios_tocados = set(df_nuevo["Cod_Servicio"].dropna()) | servicios_borrados | resultado["servicios_previos"]
+        reescritas = actualizar_visitas(engine, servicios_tocados)
+        print(f"🔗 {TABLA_VISITAS}: {reescritas:,} visitas recalculadas para {len(servicios_tocados):,} servicios "
+              f"en {time.time() - start_time_visitas:.2f} segundos.")
+
+        # Agregados diarios: días de las filas nuevas y eliminadas, más los días de las visitas recalculadas
+        start_time_kpi = time.time()
+        fechas_tocadas = (set(pd.to_datetime(df_nuevo["Fecha Agendamiento"], errors="coerce", dayfirst=True).dt.date)
+                          | fechas_borradas | fechas_de_servicios(engine, servicios_tocados))
+        filas_kpi = actualizar_kpi_diario(engine, fechas_tocadas)
+        print(f"📊 {TABLA_KPI_DIARIO}: {filas_kpi:,} filas recalculadas para {len(fechas_tocadas):,} días "
+              f"en {time.time() - start_time_kpi:.2f} segundos.")
+
+        # Casillas diarias por empresa y técnico (matriz mensual de reincidencias y fallas): solo esos días
+        start_time_ventanas = time.time()
+        filas_ventanas = actualizar_ventanas(engine, fechas_tocadas)
+        print(f"🪟 {TABLA_VENTANAS}: {filas_ventanas:,} casillas recalculadas "
+              f"en {time.time() - start_time_ventanas:.2f} segundos.")
+
+        # Invalida los resultados en caché del dashboard (benchmarks, consultas)
+        version = incrementar_version_datos(engine)
+        marcar_duplicadas_recalculadas(engine)
+        print(f"🔖 Versión de datos: {version}")
+
+        print(f"\n🚀 ¡Carga incremental completada en {time.time() - start_time_total:.2f} segundos!")
+
+        # --- 6. GUARDADO EN EL DATASET PARQUET ---
+        # Solo se escriben archivos nuevos en las particiones afectadas; el histórico no se toca.
+        print("\n💾 Agregando los nuevos registros al dataset Parquet...")
+        archivos_escritos = escribir_particiones(df_nuevo, ruta_dataset)
+        print(f"✅ {len(df_nuevo):,} registros guardados en {len(archivos_escritos)} archivos nuevos.")
+
+        # --- 7. REGISTRO EN EL MANIFIESTO ---
+        # Se registra al final: si algo falla antes, los archivos se vuelven a procesar en la próxima carga.
+        registrar_archivos(manifiesto, firmas, filas_por_ruta, ruta_base_datos)
+        print(f"📒 Manifiesto actualizado con {len(filas_por_ruta)} archivos.")
+        print("ℹ️  Para unir los archivos pequeños de cada partición: python cargar_datos.py --compactar")
+
+    except Exception as e:
+        print(f"\n❌❌❌ Error general en el proceso: {e}")
+        import traceback
+        traceback.print_exc()
+
+    print(f"\n🎯 Proceso terminado a las {datetime.now().strftime('%H:%M:%S')}")
+
+
+# El pool de procesos vuelve a importar este archivo en cada worker (Windows usa 'spawn'),
+# por eso la carga solo se ejecuta cuando el script se lanza directamente.
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Carga incremental de los Excel diarios a PostgreSQL y al dataset Parquet.")
+    parser.add_argument("--compactar", action="store_true",
+                        help="No carga nada: une los archivos pequeños de cada partición del dataset.")
+    parser.add_argument("--migrar-parquet", action="store_true",
+                        help="No carga nada: convierte el parquet de archivo único al dataset particionado.")
+    parser.add_argument("--copy", choices=MODOS_COPY, default=modo_copy,
+                        help="Codificación del COPY a PostgreSQL (por defecto, CARGA_COPY o 'csv').")
+    args = parser.parse_args()
+
+    if args.compactar:
+        total = compactar(ruta_dataset)
+        print(f"🎯 Compactación terminada. Particiones compactadas: {total}")
+    elif args.migrar_parquet:
+        migrados = migrar_parquet_unico(ruta_parquet, ruta_dataset)
+        print(f"🎯 Migración terminada. Registros migrados: {migrados:,}")
+    else:
+        main(modo_copy=args.copy)
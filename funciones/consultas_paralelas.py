@@ -0,0 +1,64 @@
+# consultas_paralelas.py
+
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from funciones.conexion import POOL_SIZE
+
+# Hilos compartidos por todas las sesiones del dashboard. Con tantos hilos como conexiones fijas
+# del pool (conexion.py), las consultas paralelas no abren conexiones de desborde ni hacen cola
+# en el pool: la cola queda aquí, antes de pedir la conexión.
+HILOS_CONSULTAS = int(os.environ.get("HILOS_CONSULTAS", POOL_SIZE))
+
+_ejecutor = ThreadPoolExecutor(max_workers=HILOS_CONSULTAS, thread_name_prefix="consulta")
+
+
+class PlanificadorConsultas:
+    """
+    Lanza consultas independientes en paralelo y entrega cada resultado apenas termina.
+    Las consultas corren en hilos y no deben llamar a Streamlit; los callbacks 'al_terminar'
+    y 'al_fallar' se ejecutan en el hilo de la página desde esperar_todas().
+    """
+
+    def __init__(self):
+        self._pendientes = {}  # future -> (nombre, al_terminar, al_fallar)
+        self.tiempos = {}      # nombre -> segundos que tardó la consulta
+        self.errores = {}      # nombre -> excepción de las consultas que fallaron
+
+    def enviar(self, nombre: str, funcion, *args, al_terminar=None, al_fallar=None, **kwargs):
+        def medir():
+            inicio = time.perf_counter()
+            try:
+                return funcion(*args, **kwargs)
+            finally:
+                self.tiempos[nombre] = time.perf_counter() - inicio
+
+        futuro = _ejecutor.submit(medir)
+        self._pendientes[futuro] = (nombre, al_terminar, al_fallar)
+        return futuro
+
+    def esperar_todas(self) -> dict:
+        """
+        Entrega los resultados en el orden en que terminan. Una consulta que falla (por ejemplo por
+        el statement_timeout) no detiene a las demás: su error va a 'al_fallar' y se siguen
+        esperando las que quedan. Si alguna falló sin 'al_fallar', se relanza su error al final.
+        Devuelve los tiempos por consulta.
+        """
+        sin_manejar = None
+        for futuro in as_completed(list(self._pendientes)):
+            nombre, al_terminar, al_fallar = self._pendientes.pop(futuro)
+            try:
+                resultado = futuro.result()
+            except Exception as error:
+                self.errores[nombre] = error
+                if al_fallar is not None:
+                    al_fallar(error)
+                elif sin_manejar is None:
+                    sin_manejar = error
+                continue
+            if al_terminar is not None:
+                al_terminar(resultado)
+        if sin_manejar is not None:
+            raise sin_manejar
+        return dict(self.tiempos)
@@ -0,0 +1,123 @@
+# copy_binario.py
+
+import numpy as np
+import pandas as pd
+
+# Escritor de COPY ... FROM STDIN (FORMAT binary). Cada lote del DataFrame se codifica columna por
+# columna con numpy directamente en el formato binario de PostgreSQL (sin pasar cada celda a texto
+# como hace to_csv) y los lotes se entregan uno a uno a copy_expert, así nunca se arma el archivo
+# completo en memoria. Formato: https://www.postgresql.org/docs/current/sql-copy.html (Binary Format)
+
+_ENCABEZADO = b"PGCOPY\n\xff\r\n\x00" + np.array([0, 0], dtype=">i4").tobytes()  # firma, flags, extensión
+_FIN = np.array([-1], dtype=">i2").tobytes()
+
+# Las fechas en binario son microsegundos desde 2000-01-01
+_EPOCH_POSTGRES_NS = pd.Timestamp("2000-01-01").value
+
+_INTERVAL = np.dtype([("microsegundos", ">i8"), ("dias", ">i4"), ("meses", ">i4")])
+
+
+def tipo_postgres(serie: pd.Series) -> str:
+    """Tipo de PostgreSQL con que se codifica la columna (el de su columna en la tabla de staging)."""
+    if pd.api.types.is_datetime64_any_dtype(serie) and getattr(serie.dt, "tz", None) is None:
+        return "timestamp"
+    if pd.api.types.is_timedelta64_dtype(serie):
+        return "interval"
+    if pd.api.types.is_bool_dtype(serie) and not serie.isna().any():
+        return "boolean"
+    if pd.api.types.is_integer_dtype(serie):
+        return "bigint"
+    if pd.api.types.is_float_dtype(serie):
+        return "double precision"
+    return "text"
+
+
+def _columna_binaria(serie: pd.Series, tipo: str) -> tuple:
+    """(largo en bytes de cada valor, -1 si es nulo; bytes de los valores no nulos, concatenados)."""
+    nulos = serie.isna().to_numpy()
+    validos = serie[~nulos]
+
+    if tipo == "text":
+        codificados = [str(v).encode("utf-8") for v in validos]
+        largos_validos = np.fromiter((len(b) for b in codificados), dtype=np.int64, count=len(codificados))
+        datos = np.frombuffer(b"".join(codificados), dtype=np.uint8)
+    else:
+        if tipo == "timestamp":
+            valores = (validos.to_numpy("datetime64[ns]").view("i8") - _EPOCH_POSTGRES_NS) // 1000
+            valores = valores.astype(">i8")
+        elif tipo == "interval":
+            valores = np.zeros(len(validos), dtype=_INTERVAL)
+            valores["microsegundos"] = validos.to_numpy("timedelta64[ns]").view("i8") // 1000
+        elif tipo == "bigint":
+            valores = validos.to_numpy("int64").astype(">i8")
+        elif tipo == "double precision":
+            valores = validos.to_numpy("float64").astype(">f8")
+        else:  # boolean
+            valores = validos.to_numpy(bool).astype(np.uint8)
+        largos_validos = np.full(len(valores), valores.dtype.itemsize, dtype=np.int64)
+        datos = valores.view(np.uint8).reshape(-1)
+
+    largos = np.full(len(serie), -1, dtype=np.int64)
+    largos[~nulos] = largos_validos
+    return largos, datos
+
+
+def _escribir_fijo(buffer: np.ndarray, posiciones: np.ndarray, valores: np.ndarray) -> None:
+    ancho = valores.dtype.itemsize
+    buffer[posiciones[:, None] + np.arange(ancho)] = valores.view(np.uint8).reshape(-1, ancho)
+
+
+def codificar_lote(lote: pd.DataFrame, tipos: dict) -> bytes:
+    """Filas del lote en formato COPY binario (sin encabezado ni marca de fin)."""
+    if lote.empty:
+        return b""
+    columnas = [_columna_binaria(lote[c], tipos[c]) for c in lote.columns]
+    largos_campo = [4 + np.maximum(largos, 0) for largos, _ in columnas]
+    largos_fila = 2 + sum(largos_campo)
+    inicio_fila = np.concatenate(([0], np.cumsum(largos_fila)[:-1]))
+
+    buffer = np.empty(int(largos_fila.sum()), dtype=np.uint8)
+    _escribir_fijo(buffer, inicio_fila, np.full(len(lote), len(columnas), dtype=">i2"))
+    posicion = inicio_fila + 2
+    for (largos, datos), largo_campo in zip(columnas, largos_campo):
+        _escribir_fijo(buffer, posicion, largos.astype(">i4"))
+        if len(datos):
+            validos = largos >= 0
+            largos_validos = largos[validos]
+            # Destino de cada byte: inicio de su valor + su desplazamiento dentro del valor
+            inicio_valor = np.repeat(posicion[validos] + 4, largos_validos)
+            desplazamiento = np.arange(len(datos)) - np.repeat(np.cumsum(largos_validos) - largos_validos, largos_validos)
+            buffer[inicio_valor + desplazamiento] = datos
+        posicion = posicion + largo_campo
+    return buffer.tobytes()
+
+
+class FlujoCopyBinario:
+    """
+    Archivo de solo lectura para cursor.copy_expert: codifica el DataFrame lote a lote a medida
+    que psycopg2 lo va leyendo, con el encabezado al inicio y la marca de fin al final.
+    """
+
+    def __init__(self, df: pd.DataFrame, tamano_lote: int, al_codificar=None):
+        self.tipos = {c: tipo_postgres(df[c]) for c in df.columns}
+        self._partes = self._generar(df, tamano_lote, al_codificar)
+        self._actual = memoryview(b"")
+
+    def _generar(self, df: pd.DataFrame, tamano_lote: int, al_codificar):
+        yield _ENCABEZADO
+        for i in range(0, len(df), tamano_lote):
+            yield codificar_lote(df.iloc[i:i + tamano_lote], self.tipos)
+            if al_codificar is not None:
+                al_codificar(min(i + tamano_lote, len(df)))
+        yield _FIN
+
+    def read(self, size: int = -1) -> bytes:
+        while not len(self._actual):
+            parte = next(self._partes, None)
+            if parte is None:
+                return b""
+            self._actual = memoryview(parte)
+        if size is None or size < 0:
+            size = len(self._actual)
+        dato, self._actual = self._actual[:size], self._actual[size:]
+        return dato.tobytes()
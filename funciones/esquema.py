@@ -0,0 +1,454 @@
+# esquema.py
+
+import argparse
+import os
+import sys
+from datetime import date, timedelta
+
+import sqlalchemy as sa
+from sqlalchemy import text
+from sqlalchemy.dialects.postgresql import INTERVAL
+
+TABLA = "actividades"
+
+# Tipos de las columnas que el Excel trae como texto. Se usan al crear la tabla
+# y para saber qué columnas convertir en una tabla creada con todo TEXT.
+TIPOS_COLUMNAS = {
+    "ID de recurso": sa.Integer,
+    "Fecha Agendamiento": sa.DateTime,
+    "Inicio": sa.DateTime,
+    "Finalización": sa.DateTime,
+    "Duración": INTERVAL,
+}
+
+# (tipo en PostgreSQL, expresión USING para convertir desde texto)
+CONVERSIONES = {
+    "ID de recurso": (
+        "integer",
+        """CASE WHEN trim("ID de recurso") ~ '^\\d+(\\.0+)?$' THEN split_part(trim("ID de recurso"), '.', 1)::integer END""",
+    ),
+    "Fecha Agendamiento": ("timestamp", """NULLIF(trim("Fecha Agendamiento"), '')::timestamp"""),
+    "Inicio": ("timestamp", """NULLIF(trim("Inicio"), '')::timestamp"""),
+    "Finalización": ("timestamp", """NULLIF(trim("Finalización"), '')::timestamp"""),
+    "Duración": ("interval", """NULLIF(trim("Duración"), '')::interval"""),
+}
+
+# El ETL deja 'Propietario de Red' solo como 'entel' u 'onnet' (todo lo que no es onnet es entel)
+VALORES_PROPIETARIO = ("entel", "onnet")
+
+# Columnas normalizadas (minúsculas y sin espacios) que el ETL escribe en cada carga,
+# para que las consultas filtren por igualdad sin aplicar lower()/trim() fila a fila.
+# columna normalizada -> columna original
+COLUMNAS_NORMALIZADAS = {
+    "estado_norm": "Estado de actividad",
+    "tipo_actividad_norm": "Tipo de actividad",
+    "empresa_norm": "Empresa",
+    "recurso_norm": "Recurso",
+}
+
+# Tipos de actividad del universo de calidad (reincidencias y fallas tempranas)
+TIPOS_REPARACION = ('reparación empresa masivo fibra', 'reparación-hogar-fibra', 'reparación 3play light')
+TIPOS_INSTALACION = ('instalación-hogar-fibra', 'instalación-masivo-fibra')
+
+# Clave natural de una actividad: la carga hace UPSERT sobre ella (ver carga_staging.py), así que
+# volver a cargar un Excel reemplaza sus filas en vez de duplicarlas.
+CLAVE_NATURAL = ("ID externo", "Fecha Agendamiento")
+INDICE_CLAVE_NATURAL = f"ux_{TABLA}_clave_natural"
+# Respaldo de las filas que se quitan al crear la clave natural. 'recalculada' queda en false hasta
+# que la carga recalcula las tablas derivadas de sus servicios y días (ver duplicadas_pendientes).
+# El dataset Parquet las conserva (es el archivo de lo leído de cada Excel); volver a cargarlas
+# pasa por el UPSERT de la clave natural, que no las duplica.
+TABLA_DUPLICADAS = f"{TABLA}_duplicadas"
+
+# columna de código en actividades -> (tabla catálogo, columna de texto original)
+CATALOGOS = {
+    "cod_estado_actividad": ("cat_estado_actividad", "Estado de actividad"),
+    "cod_tipo_actividad": ("cat_tipo_actividad", "Tipo de actividad"),
+}
+
+
+def _tipo_actual(conn, columna: str):
+    return conn.execute(
+        text("""
+            SELECT CASE WHEN data_type = 'USER-DEFINED' THEN udt_name ELSE data_type END
+            FROM information_schema.columns
+            WHERE table_schema = 'public' AND table_name = :tabla AND column_name = :columna
+        """),
+        {"tabla": TABLA, "columna": columna},
+    ).scalar()
+
+
+def _convertir_columnas(conn, forzar: bool) -> list:
+    cambios = []
+    for columna, (tipo, expresion) in CONVERSIONES.items():
+        if _tipo_actual(conn, columna) != "text":
+            continue
+
+        if columna == "ID de recurso" and not forzar:
+            # No se pierden IDs en silencio: si hay valores no numéricos se detiene la migración
+            invalidos = conn.execute(text(f"""
+                SELECT DISTINCT "ID de recurso" FROM public.{TABLA}
+                WHERE NULLIF(trim("ID de recurso"), '') IS NOT NULL AND trim("ID de recurso") !~ '^\\d+(\\.0+)?$'
+                LIMIT 10
+            """)).scalars().all()
+            if invalidos:
+                raise ValueError(
+                    f"'ID de recurso' tiene valores no numéricos (ej. {invalidos}). "
+                    "Corríjalos o use --forzar para dejarlos en NULL."
+                )
+
+        print(f"🔧 Convirtiendo \"{columna}\" de text a {tipo}...")
+        conn.execute(text(f'ALTER TABLE public.{TABLA} ALTER COLUMN "{columna}" TYPE {tipo} USING {expresion}'))
+        cambios.append(f"{columna}: text -> {tipo}")
+    return cambios
+
+
+def _convertir_propietario(conn) -> list:
+    valores = ", ".join(f"'{v}'" for v in VALORES_PROPIETARIO)
+    conn.execute(text(f"""
+        DO $$ BEGIN
+            CREATE TYPE propietario_red AS ENUM ({valores});
+        EXCEPTION WHEN duplicate_object THEN NULL;
+        END $$;
+    """))
+    if _tipo_actual(conn, "Propietario de Red") != "text":
+        return []
+
+    print("🔧 Convirtiendo \"Propietario de Red\" al tipo enumerado propietario_red...")
+    conn.execute(text(f"""
+        ALTER TABLE public.{TABLA} ALTER COLUMN "Propietario de Red" TYPE propietario_red
+        USING (CASE WHEN lower(trim(COALESCE("Propietario de Red", ''))) = 'onnet' THEN 'onnet' ELSE 'entel' END)::propietario_red
+    """))
+    return ["Propietario de Red: text -> propietario_red"]
+
+
+def _crear_catalogos(conn) -> list:
+    cambios = []
+    for columna_cod, (catalogo, columna_texto) in CATALOGOS.items():
+        conn.execute(text(f"""
+            CREATE TABLE IF NOT EXISTS public.{catalogo} (
+                cod    smallserial PRIMARY KEY,
+                nombre text NOT NULL UNIQUE
+            )
+        """))
+        if _tipo_actual(conn, columna_cod) is None:
+            print(f"🔧 Agregando columna {columna_cod} (catálogo {catalogo})...")
+            conn.execute(text(f"ALTER TABLE public.{TABLA} ADD COLUMN {columna_cod} smallint REFERENCES public.{catalogo} (cod)"))
+            cambios.append(f"{columna_cod}: nueva columna")
+        # Índice parcial pequeño: solo contiene las filas que aún no tienen código asignado
+        conn.execute(text(f"""
+            CREATE INDEX IF NOT EXISTS ix_{TABLA}_sin_{columna_cod}
+            ON public.{TABLA} ("{columna_texto}") WHERE {columna_cod} IS NULL
+        """))
+    return cambios
+
+
+def _agregar_fecha_dia(conn) -> list:
+    if _tipo_actual(conn, "fecha_agendamiento_dia") is not None:
+        return []
+    print("🔧 Agregando columna fecha_agendamiento_dia (date)...")
+    conn.execute(text(f"""
+        ALTER TABLE public.{TABLA}
+        ADD COLUMN fecha_agendamiento_dia date GENERATED ALWAYS AS ("Fecha Agendamiento"::date) STORED
+    """))
+    return ["fecha_agendamiento_dia: nueva columna"]
+
+
+def _agregar_normalizadas(conn) -> list:
+    cambios = []
+    for col_norm, col_origen in COLUMNAS_NORMALIZADAS.items():
+        if _tipo_actual(conn, col_norm) is not None:
+            continue
+        print(f"🔧 Agregando columna {col_norm} y completando las filas existentes...")
+        conn.execute(text(f"ALTER TABLE public.{TABLA} ADD COLUMN {col_norm} text"))
+        # Las cargas siguientes la escriben desde el ETL; aquí solo se completa el histórico
+        actualizadas = conn.execute(text(f"""
+            UPDATE public.{TABLA} SET {col_norm} = lower(trim("{col_origen}"))
+            WHERE "{col_origen}" IS NOT NULL
+        """)).rowcount
+        cambios.append(f"{col_norm}: nueva columna ({actualizadas:,} filas completadas)")
+    return cambios
+
+
+def _crear_clave_natural(conn) -> list:
+    existe = conn.execute(
+        text("SELECT 1 FROM pg_indexes WHERE schemaname = 'public' AND tablename = :tabla AND indexname = :indice"),
+        {"tabla": TABLA, "indice": INDICE_CLAVE_NATURAL},
+    ).scalar()
+    if existe:
+        return []
+
+    columnas = ", ".join(f'"{c}"' for c in CLAVE_NATURAL)
+    print(f"🔧 Creando la clave natural ({columnas}); los duplicados de cargas repetidas pasan a {TABLA_DUPLICADAS}...")
+    # El respaldo tiene las mismas columnas que 'actividades' (fecha_agendamiento_dia como columna normal)
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS public.{TABLA_DUPLICADAS} (LIKE public.{TABLA})"))
+    conn.execute(text(f"""
+        ALTER TABLE public.{TABLA_DUPLICADAS}
+            ADD COLUMN IF NOT EXISTS eliminada_en timestamp NOT NULL DEFAULT now(),
+            ADD COLUMN IF NOT EXISTS recalculada boolean NOT NULL DEFAULT false
+    """))
+    lista = ", ".join(f'"{c}"' for c in conn.execute(text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = 'public' AND table_name = :tabla ORDER BY ordinal_position"
+    ), {"tabla": TABLA}).scalars())
+
+    # De cada grupo se conserva la fila del Excel más reciente ("Archivo_Origen" es datos_AAAA-MM-DD.xlsx,
+    # así que el orden del nombre es el de las fechas; no se usa ctid, que cambia con los UPDATE).
+    # Entre filas del mismo archivo el orden da igual: son la misma actividad cargada dos veces.
+    duplicadas = conn.execute(text(f"""
+        WITH eliminadas AS (
+            DELETE FROM public.{TABLA} a
+            USING (
+                SELECT ctid, row_number() OVER (
+                    PARTITION BY {columnas} ORDER BY "Archivo_Origen" DESC NULLS LAST, ctid
+                ) AS n
+                FROM public.{TABLA}
+                WHERE {" AND ".join(f'"{c}" IS NOT NULL' for c in CLAVE_NATURAL)}
+            ) d
+            WHERE a.ctid = d.ctid AND d.n > 1
+            RETURNING a.*
+        )
+        INSERT INTO public.{TABLA_DUPLICADAS} ({lista})
+        SELECT {lista} FROM eliminadas
+    """)).rowcount
+    # Las filas sin 'ID externo' quedan fuera del índice (NULL no choca con NULL) y se cargan siempre
+    conn.execute(text(f"CREATE UNIQUE INDEX {INDICE_CLAVE_NATURAL} ON public.{TABLA} ({columnas})"))
+    return [f"{INDICE_CLAVE_NATURAL}: nuevo índice único ({duplicadas:,} filas duplicadas respaldadas en "
+            f"{TABLA_DUPLICADAS} y eliminadas)"]
+
+
+def duplicadas_pendientes(engine: sa.Engine) -> tuple:
+    """
+    (Cod_Servicio, días) de las filas que la migración quitó y cuyas tablas derivadas aún no se
+    recalcularon. Después de recalcularlas hay que llamar a marcar_duplicadas_recalculadas().
+    """
+    if not sa.inspect(engine).has_table(TABLA_DUPLICADAS):
+        return set(), set()
+    with engine.connect() as conn:
+        filas = conn.execute(text(
+            f'SELECT DISTINCT "Cod_Servicio", fecha_agendamiento_dia FROM public.{TABLA_DUPLICADAS} WHERE NOT recalculada'
+        )).all()
+    return ({servicio for servicio, _ in filas if servicio is not None},
+            {fecha for _, fecha in filas if fecha is not None})
+
+
+def marcar_duplicadas_recalculadas(engine: sa.Engine) -> None:
+    if sa.inspect(engine).has_table(TABLA_DUPLICADAS):
+        with engine.begin() as conn:
+            conn.execute(text(f"UPDATE public.{TABLA_DUPLICADAS} SET recalculada = true WHERE NOT recalculada"))
+
+
+def asignar_codigos(conn) -> None:
+    """
+    Registra en los catálogos los estados y tipos de actividad nuevos y asigna su código
+    a las filas que aún no lo tienen. El cargador la llama después de cada carga.
+    """
+    for columna_cod, (catalogo, columna_texto) in CATALOGOS.items():
+        conn.execute(text(f"""
+            INSERT INTO public.{catalogo} (nombre)
+            SELECT DISTINCT lower(trim("{columna_texto}")) FROM public.{TABLA}
+            WHERE {columna_cod} IS NULL AND NULLIF(trim("{columna_texto}"), '') IS NOT NULL
+            EXCEPT
+            SELECT nombre FROM public.{catalogo}
+            ON CONFLICT (nombre) DO NOTHING
+        """))
+        conn.execute(text(f"""
+            UPDATE public.{TABLA} a SET {columna_cod} = c.cod
+            FROM public.{catalogo} c
+            WHERE a.{columna_cod} IS NULL AND c.nombre = lower(trim(a."{columna_texto}"))
+        """))
+
+
+def migrar_esquema(engine: sa.Engine, forzar: bool = False) -> list:
+    """
+    Lleva la tabla 'actividades' a su esquema tipado: IDs enteros, fechas como timestamp,
+    duración como interval, 'Propietario de Red' como enum, catálogos para estado y tipo
+    de actividad, columnas normalizadas para los filtros y el índice único de la clave natural
+    que usa el UPSERT de la carga. Es idempotente: si la tabla ya está migrada no hace nada.
+    Devuelve la lista de cambios aplicados.
+    """
+    if not sa.inspect(engine).has_table(TABLA):
+        return []
+
+    with engine.begin() as conn:
+        cambios = _convertir_columnas(conn, forzar)
+        cambios += _convertir_propietario(conn)
+        cambios += _crear_catalogos(conn)
+        cambios += _agregar_fecha_dia(conn)
+        cambios += _agregar_normalizadas(conn)
+        cambios += _crear_clave_natural(conn)
+        asignar_codigos(conn)
+
+    if cambios:
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            conn.execute(text(f"ANALYZE public.{TABLA}"))
+    return cambios
+
+
+# --- ÍNDICES ---
+# Las funciones de reincidencias y fallas tempranas ordenan por (Cod_Servicio, Fecha Agendamiento)
+# solo las visitas finalizadas de reparación e instalación. Los índices parciales contienen
+# exactamente ese universo: el planner puede recorrerlos ya ordenados y evitar el Sort completo.
+_TIPOS_CALIDAD_SQL = ", ".join(f"'{t}'" for t in TIPOS_REPARACION + TIPOS_INSTALACION)
+_PREDICADO_CALIDAD = f"estado_norm = 'finalizada' AND tipo_actividad_norm IN ({_TIPOS_CALIDAD_SQL})"
+
+INDICES = {
+    f"ix_{TABLA}_servicio_fecha": '("Cod_Servicio", "Fecha Agendamiento")',
+    f"ix_{TABLA}_calidad_servicio_fecha": (
+        '("Cod_Servicio", "Fecha Agendamiento") INCLUDE ("Empresa", "Recurso", "ID de recurso", tipo_actividad_norm) '
+        f"WHERE {_PREDICADO_CALIDAD}"
+    ),
+    f"ix_{TABLA}_calidad_fecha": f'("Fecha Agendamiento") WHERE {_PREDICADO_CALIDAD}',
+    f"ix_{TABLA}_fecha_tipo": '("Fecha Agendamiento", tipo_actividad_norm)',
+    f"ix_{TABLA}_empresa_fecha": '(empresa_norm, "Fecha Agendamiento")',
+}
+
+
+def crear_indices(engine: sa.Engine) -> list:
+    """
+    Crea los índices de INDICES que aún no existen. Se usa CONCURRENTLY para no bloquear
+    la tabla mientras el dashboard la consulta. Devuelve los nombres de los índices creados.
+    """
+    migrar_esquema(engine)  # los índices parciales usan las columnas normalizadas
+
+    with engine.connect() as conn:
+        existentes = set(conn.execute(
+            text("SELECT indexname FROM pg_indexes WHERE schemaname = 'public' AND tablename = :tabla"),
+            {"tabla": TABLA},
+        ).scalars())
+
+    creados = []
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for nombre, definicion in INDICES.items():
+            if nombre in existentes:
+                continue
+            print(f"🔧 Creando índice {nombre}...")
+            conn.execute(text(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {nombre} ON public.{TABLA} {definicion}"))
+            creados.append(nombre)
+        if creados:
+            conn.execute(text(f"ANALYZE public.{TABLA}"))
+    return creados
+
+
+# --- VERIFICACIÓN CON EXPLAIN ---
+class _PlanCapturado(Exception):
+    pass
+
+
+def _indices_en_plan(nodo: dict) -> set:
+    usados = {nodo["Index Name"]} if "Index Name" in nodo else set()
+    for hijo in nodo.get("Plans", []):
+        usados |= _indices_en_plan(hijo)
+    return usados
+
+
+def _recorridos_secuenciales(nodo: dict) -> int:
+    propio = 1 if nodo.get("Node Type") == "Seq Scan" and nodo.get("Relation Name") == TABLA else 0
+    return propio + sum(_recorridos_secuenciales(hijo) for hijo in nodo.get("Plans", []))
+
+
+def capturar_plan(engine: sa.Engine, funcion, *args) -> dict:
+    """
+    Ejecuta 'funcion(engine, *args)' interceptando su primera consulta sobre la tabla:
+    en lugar de ejecutarla se obtiene su EXPLAIN, así se revisa el SQL real de analisis.py
+    sin copiarlo. Devuelve el nodo raíz del plan (o None si la función no consultó la tabla).
+    """
+    planes = []
+
+    def antes_de_ejecutar(conn, cursor, statement, parameters, context, executemany):
+        if TABLA not in statement or planes:
+            return
+        cursor.execute("EXPLAIN (FORMAT JSON) " + statement, parameters)
+        planes.append(cursor.fetchone()[0][0]["Plan"])
+        raise _PlanCapturado()
+
+    sa.event.listen(engine, "before_cursor_execute", antes_de_ejecutar)
+    try:
+        # Sin pasar por la caché de consultas, para que el SQL se ejecute de verdad
+        getattr(funcion, "sin_cache", funcion)(engine, *args)
+    except Exception:
+        # La función se interrumpe a propósito después de capturar el plan
+        if not planes:
+            raise
+    finally:
+        sa.event.remove(engine, "before_cursor_execute", antes_de_ejecutar)
+    return planes[0] if planes else None
+
+
+def verificar_indices(engine: sa.Engine, fecha_inicio: str, fecha_fin: str) -> bool:
+    """
+    Revisa con EXPLAIN que las consultas de analisis.py usen los índices administrados.
+    Imprime un reporte por función y devuelve True si todas usan al menos uno.
+    """
+    from funciones import analisis
+
+    # Los KPIs, rankings y reincidencias/fallas leen visitas_enriquecidas y kpi_diario;
+    # aquí se revisan las consultas que siguen yendo directo a la tabla de actividades.
+    funciones_a_revisar = [
+        analisis.obtener_reparaciones_por_comuna,
+        analisis.obtener_instalaciones_por_comuna,
+        analisis.obtener_datos_causa_falla,
+    ]
+
+    todo_ok = True
+    for funcion in funciones_a_revisar:
+        plan = capturar_plan(engine, funcion, fecha_inicio, fecha_fin)
+        if plan is None:
+            print(f"⚠️  {funcion.__name__}: no se capturó ninguna consulta.")
+            todo_ok = False
+            continue
+
+        usados = _indices_en_plan(plan) & set(INDICES)
+        secuenciales = _recorridos_secuenciales(plan)
+        if usados:
+            print(f"✅ {funcion.__name__}: usa {', '.join(sorted(usados))} (costo {plan['Total Cost']:,.0f})")
+        else:
+            print(f"❌ {funcion.__name__}: no usa los índices administrados (costo {plan['Total Cost']:,.0f})")
+            todo_ok = False
+        if secuenciales:
+            print(f"   ⚠️  {secuenciales} recorrido(s) secuencial(es) sobre {TABLA}")
+    return todo_ok
+
+
+if __name__ == "__main__":
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from funciones.cargar_datos import crear_engine
+
+    parser = argparse.ArgumentParser(description="Migraciones de esquema de la tabla actividades.")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    p_migrar = sub.add_parser("migrar", help="Convierte las columnas TEXT a sus tipos y crea los catálogos.")
+    p_migrar.add_argument("--forzar", action="store_true",
+                          help="Deja en NULL los 'ID de recurso' no numéricos en vez de detenerse.")
+    sub.add_parser("indices", help="Crea los índices para las consultas de reincidencias y fallas tempranas.")
+    p_verificar = sub.add_parser("verificar", help="Revisa con EXPLAIN que las consultas de analisis.py usen los índices.")
+    p_verificar.add_argument("--desde", default=(date.today() - timedelta(days=30)).isoformat())
+    p_verificar.add_argument("--hasta", default=date.today().isoformat())
+    args = parser.parse_args()
+
+    if args.comando == "indices":
+        creados = crear_indices(crear_engine())
+        print(f"🎯 Índices creados: {len(creados)} ({', '.join(creados) or 'todos existían'})")
+    elif args.comando == "verificar":
+        ok = verificar_indices(crear_engine(), args.desde, args.hasta)
+        print("🎯 Todas las consultas usan los índices." if ok else "🎯 Hay consultas que no usan los índices.")
+        sys.exit(0 if ok else 1)
+    elif args.comando == "migrar":
+        engine = crear_engine()
+        cambios = migrar_esquema(engine, forzar=args.forzar)
+        for cambio in cambios:
+            print(f"   ✅ {cambio}")
+        servicios, fechas = duplicadas_pendientes(engine)
+        if servicios or fechas:
+            from funciones.visitas import actualizar_visitas, fechas_de_servicios
+            from funciones.kpi_diario import actualizar_kpi_diario
+            from funciones.ventanas_kpi import actualizar_ventanas
+            from funciones.version_datos import incrementar_version_datos
+
+            actualizar_visitas(engine, servicios)
+            fechas |= fechas_de_servicios(engine, servicios)
+            actualizar_kpi_diario(engine, fechas)
+            actualizar_ventanas(engine, fechas)
+            incrementar_version_datos(engine)
+            marcar_duplicadas_recalculadas(engine)
+            print(f"   ✅ Tablas derivadas recalculadas para {len(servicios):,} servicios y {len(fechas):,} días con duplicados.")
+        print(f"🎯 Migración terminada. Cambios aplicados: {len(cambios)}")
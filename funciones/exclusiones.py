@@ -0,0 +1,268 @@
+# exclusiones.py
+
+import argparse
+import os
+import sys
+from typing import NamedTuple
+
+import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# Permite importar el paquete 'funciones' cuando este archivo se ejecuta como script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from funciones.esquema import TIPOS_REPARACION, TIPOS_INSTALACION
+
+# Registro único de los filtros estándar de los KPIs: recursos excluidos (por ID y por nombre),
+# comunas fuera de la zona y grupos de tipos de actividad. Se guardan en tablas pequeñas de
+# PostgreSQL que todas las consultas usan como subconsulta (sql_* más abajo), en vez de repetir
+# las tuplas en cada función y enviarlas como parámetros. Los valores de aquí solo siembran las
+# tablas la primera vez: después la fuente es la BD. Para excluir un contratista se usa
+# `python funciones/exclusiones.py agregar nombre <nombre>`, que reevalúa dim_recurso y recalcula
+# las tablas derivadas al momento; una fila insertada a mano en la BD se detecta recién en la
+# siguiente carga (sincronizar_dim_recurso), que entonces recalcula todo.
+
+TABLA_EXCL_IDS = "excl_recurso_id"
+TABLA_EXCL_NOMBRES = "excl_recurso_nombre"
+TABLA_EXCL_COMUNAS = "excl_comuna"
+TABLA_GRUPOS_TIPO = "grupo_tipo_actividad"
+TABLA_DIM_RECURSO = "dim_recurso"
+
+IDS_RECURSO_EXCLUIDOS = frozenset({3826, 3824, 3825, 5286, 3823, 3822})
+
+# Cuentas de contratistas: se comparan con lower(trim("Recurso")) completo, no como subcadena
+# (un ILIKE '%bio%' dejaría fuera también a técnicos como "Fabio" o "Rubio")
+NOMBRES_RECURSO_EXCLUIDOS = frozenset({
+    'bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab'
+})
+
+COMUNAS_EXCLUIDAS = frozenset({
+    'algarrobo', 'antofagasta', 'calama', 'calera', 'canete', 'casablanca',
+    'catemu', 'chiguayante', 'chillan', 'chillan viejo', 'cnt', 'concepcion',
+    'conchali|', 'copiapo', 'coquimbo', 'coronel', 'curacavi', 'curico', 'peñalolen',
+    'donihue', 'el monte', 'el quisco', 'el tabo', 'hijuelas', 'la cruz',
+    'las. ondes', 'limache', 'linares', 'los angeles', 'los andes', 'machali',
+    'melipilla', 'nogales', 'none', 'padre las casas', 'villarrica', 'ñuñoa',
+    'pedro aguirres cerda', 'penaflor', 'penco', 'puerto montt', 'quillota',
+    'quilpue', 'rancagua', 'rengo', 'rinconada', 'san antonio', 'san esteban',
+    'san felipe', 'san bernardo', 'san javier', 'san pedro', 'hualpen', 'la serena',
+    'san pedro de la paz', 'santa cruz', 'talca', 'talcahuano', 'temuco',
+    'tiltil', 'tome', 'ura dario urzua', 'valaparaiso', 'villa alemana', 'pichilemu',
+    'villa rica', 'viña del mar', 'x', 'vina del mar', 'olmue', 'calle larga',
+    'concon', 'valparaiso', 'llaillay', 'vallenar', 'panquehue', 'mostazal', 'graneros',
+    'san fernando', 'olivar', 'hualqui', 'iquique', 'santo domingo', 'santa maria', 'olmuhe'
+})
+
+# grupo -> tipos de actividad (tipo_actividad_norm)
+GRUPOS_TIPO_ACTIVIDAD = {
+    "multiskill": frozenset({
+        'instalación-hogar-fibra', 'instalación-masivo-fibra', 'incidencia manual', 'postventa-hogar-fibra',
+        'reparación 3play light', 'postventa-masivo-equipo', 'postventa-masivo-fibra',
+        'reparación empresa masivo fibra', 'reparación-hogar-fibra'
+    }),
+    "reparacion": frozenset(TIPOS_REPARACION),    # mantención
+    "instalacion": frozenset(TIPOS_INSTALACION),  # provisión
+    "certificacion": frozenset({'reparación 3play light', 'reparación-hogar-fibra'}),
+    "instalacion_postventa": frozenset(TIPOS_INSTALACION) | {
+        'postventa-hogar-fibra', 'postventa-masivo-equipo', 'postventa-masivo-fibra'
+    },
+}
+
+# tabla -> (DDL, INSERT de siembra, filas de siembra)
+_TABLAS = {
+    TABLA_EXCL_IDS: (
+        "id integer PRIMARY KEY",
+        f"INSERT INTO public.{TABLA_EXCL_IDS} (id) VALUES (:valor) ON CONFLICT DO NOTHING",
+        [{"valor": v} for v in sorted(IDS_RECURSO_EXCLUIDOS)],
+    ),
+    TABLA_EXCL_NOMBRES: (
+        "nombre text PRIMARY KEY CHECK (nombre = lower(trim(nombre)))",
+        f"INSERT INTO public.{TABLA_EXCL_NOMBRES} (nombre) VALUES (:valor) ON CONFLICT DO NOTHING",
+        [{"valor": v} for v in sorted(NOMBRES_RECURSO_EXCLUIDOS)],
+    ),
+    TABLA_EXCL_COMUNAS: (
+        "comuna text PRIMARY KEY CHECK (comuna = lower(trim(comuna)))",
+        f"INSERT INTO public.{TABLA_EXCL_COMUNAS} (comuna) VALUES (:valor) ON CONFLICT DO NOTHING",
+        [{"valor": v} for v in sorted(COMUNAS_EXCLUIDAS)],
+    ),
+    TABLA_GRUPOS_TIPO: (
+        "grupo text NOT NULL, tipo_actividad_norm text NOT NULL, PRIMARY KEY (grupo, tipo_actividad_norm)",
+        f"INSERT INTO public.{TABLA_GRUPOS_TIPO} (grupo, tipo_actividad_norm) VALUES (:grupo, :valor) ON CONFLICT DO NOTHING",
+        [{"grupo": g, "valor": t} for g, tipos in GRUPOS_TIPO_ACTIVIDAD.items() for t in sorted(tipos)],
+    ),
+}
+
+
+# Dimensión de técnicos: una fila por valor distinto de "Recurso" con la exclusión por nombre ya
+# evaluada. Las consultas filtran por la bandera en vez de normalizar y comparar el nombre en
+# cada fila; la carga la completa solo con los técnicos que trae cada lote.
+_DDL_DIM_RECURSO = f"""
+CREATE TABLE IF NOT EXISTS public.{TABLA_DIM_RECURSO} (
+    "Recurso"               text PRIMARY KEY,
+    es_recurso_excluido     boolean NOT NULL
+)
+"""
+
+# {origen} entrega la columna "Recurso" con los nombres a (re)evaluar
+_SQL_FUSIONAR_DIM_RECURSO = f"""
+INSERT INTO public.{TABLA_DIM_RECURSO} ("Recurso", es_recurso_excluido)
+SELECT r."Recurso", lower(trim(r."Recurso")) IN (SELECT nombre FROM public.{TABLA_EXCL_NOMBRES})
+FROM ({{origen}}) r
+WHERE r."Recurso" IS NOT NULL
+ON CONFLICT ("Recurso") DO UPDATE SET es_recurso_excluido = EXCLUDED.es_recurso_excluido
+"""
+
+# Técnicos cuya bandera ya no coincide con excl_recurso_nombre (nombres agregados o quitados
+# directamente en la BD): se corrigen y se devuelven
+_SQL_SINCRONIZAR_DIM_RECURSO = f"""
+UPDATE public.{TABLA_DIM_RECURSO} d
+SET es_recurso_excluido = NOT d.es_recurso_excluido
+WHERE d.es_recurso_excluido <> (lower(trim(d."Recurso")) IN (SELECT nombre FROM public.{TABLA_EXCL_NOMBRES}))
+RETURNING d."Recurso"
+"""
+
+
+# --- MANTENCIÓN DE LAS TABLAS ---
+def crear_tablas_exclusiones(engine: sa.Engine) -> list:
+    """
+    Crea las tablas del registro que no existen y las siembra con los valores de este archivo.
+    Las que ya existen no se tocan (se respetan los cambios hechos en la BD). Devuelve las tablas creadas.
+    """
+    existentes = set(sa.inspect(engine).get_table_names(schema="public"))
+    creadas = []
+    with engine.begin() as conn:
+        for tabla, (columnas, insertar, filas) in _TABLAS.items():
+            if tabla in existentes:
+                continue
+            conn.execute(text(f"CREATE TABLE IF NOT EXISTS public.{tabla} ({columnas})"))
+            conn.execute(text(insertar), filas)
+            creadas.append(tabla)
+    if TABLA_DIM_RECURSO not in existentes:
+        with engine.begin() as conn:
+            conn.execute(text(_DDL_DIM_RECURSO))
+        creadas.append(TABLA_DIM_RECURSO)
+        if "actividades" in existentes:
+            reconstruir_dim_recurso(engine)
+    return creadas
+
+
+def reconstruir_dim_recurso(engine: sa.Engine) -> int:
+    """
+    Reevalúa la bandera de todos los técnicos de 'actividades' (después de cambiar los nombres
+    excluidos). Devuelve la cantidad de técnicos.
+    """
+    origen = 'SELECT DISTINCT "Recurso" FROM public.actividades'
+    with engine.begin() as conn:
+        conn.execute(text(_DDL_DIM_RECURSO))
+        total = conn.execute(text(_SQL_FUSIONAR_DIM_RECURSO.format(origen=origen))).rowcount
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"ANALYZE public.{TABLA_DIM_RECURSO}"))
+    return total
+
+
+def actualizar_dim_recurso(engine: sa.Engine, recursos) -> int:
+    """
+    Agrega (o reevalúa) los técnicos indicados, una vez por nombre distinto: lo llama la carga con
+    los "Recurso" de cada lote, antes de recalcular las tablas derivadas. Devuelve los técnicos escritos.
+    """
+    recursos = sorted({r for r in recursos if isinstance(r, str)})
+    if not recursos:
+        return 0
+    origen = 'SELECT unnest(CAST(:recursos AS text[])) AS "Recurso"'
+    with engine.begin() as conn:
+        conn.execute(text(_DDL_DIM_RECURSO))
+        return conn.execute(text(_SQL_FUSIONAR_DIM_RECURSO.format(origen=origen)), {"recursos": recursos}).rowcount
+
+
+def sincronizar_dim_recurso(engine: sa.Engine) -> list:
+    """
+    Corrige las banderas que quedaron desfasadas del registro de nombres excluidos (cambios hechos
+    en la BD sin pasar por el CLI). Devuelve los técnicos corregidos: si hay alguno, las tablas
+    derivadas filtraron con la bandera anterior y hay que reconstruirlas.
+    """
+    with engine.begin() as conn:
+        conn.execute(text(_DDL_DIM_RECURSO))
+        return sorted(conn.execute(text(_SQL_SINCRONIZAR_DIM_RECURSO)).scalars())
+
+
+class ConjuntosExclusion(NamedTuple):
+    ids: frozenset
+    nombres: frozenset
+    comunas: frozenset
+
+
+def cargar_exclusiones(engine: sa.Engine) -> ConjuntosExclusion:
+    """Los conjuntos vigentes en la BD, para filtrar en pandas con los mismos valores que el SQL."""
+    with engine.connect() as conn:
+        return ConjuntosExclusion(
+            ids=frozenset(conn.execute(text(f"SELECT id FROM public.{TABLA_EXCL_IDS}")).scalars()),
+            nombres=frozenset(conn.execute(text(f"SELECT nombre FROM public.{TABLA_EXCL_NOMBRES}")).scalars()),
+            comunas=frozenset(conn.execute(text(f"SELECT comuna FROM public.{TABLA_EXCL_COMUNAS}")).scalars()),
+        )
+
+
+def nombres_excluidos(recursos: pd.Series, nombres=NOMBRES_RECURSO_EXCLUIDOS) -> pd.Series:
+    """True para los recursos cuyo nombre es uno de los excluidos (misma regla que el SQL)."""
+    return recursos.str.lower().str.strip().isin(nombres)
+
+
+# --- FRAGMENTOS SQL ---
+# Condiciones para el WHERE; la columna se puede calificar con el alias de la consulta (ej. 'a."Recurso"').
+def sql_sin_ids_excluidos(columna: str = '"ID de recurso"') -> str:
+    # NOT IN (igual que la tupla anterior): las filas sin ID de recurso también quedan fuera
+    return f"{columna} NOT IN (SELECT id FROM public.{TABLA_EXCL_IDS})"
+
+
+def sql_sin_nombres_excluidos(columna: str = '"Recurso"') -> str:
+    # Bandera precalculada en dim_recurso (sin lower/trim por fila). Igual que con los IDs,
+    # las filas sin "Recurso" quedan fuera.
+    return (f"({columna} IS NOT NULL AND {columna} NOT IN "
+            f"(SELECT \"Recurso\" FROM public.{TABLA_DIM_RECURSO} WHERE es_recurso_excluido))")
+
+
+def sql_sin_comunas_excluidas(columna: str = '"Comuna"') -> str:
+    return f"lower(trim({columna})) NOT IN (SELECT comuna FROM public.{TABLA_EXCL_COMUNAS})"
+
+
+def sql_en_grupo(grupo: str, columna: str = "tipo_actividad_norm") -> str:
+    if grupo not in GRUPOS_TIPO_ACTIVIDAD:
+        raise ValueError(f"Grupo de tipos de actividad desconocido: {grupo!r}")
+    return f"{columna} IN (SELECT tipo_actividad_norm FROM public.{TABLA_GRUPOS_TIPO} WHERE grupo = '{grupo}')"
+
+
+if __name__ == "__main__":
+    from funciones.cargar_datos import crear_engine
+    from funciones.visitas import reconstruir_visitas
+    from funciones.kpi_diario import reconstruir_kpi_diario
+    from funciones.ventanas_kpi import reconstruir_ventanas
+    from funciones.version_datos import incrementar_version_datos
+
+    parser = argparse.ArgumentParser(description="Registro de exclusiones de los KPIs.")
+    sub = parser.add_subparsers(dest="comando", required=True)
+    sub.add_parser("crear", help="Crea y siembra las tablas del registro que falten.")
+    sub.add_parser("listar", help="Muestra los valores vigentes.")
+    p_agregar = sub.add_parser("agregar", help="Agrega una exclusión y recalcula las tablas derivadas.")
+    p_agregar.add_argument("tipo", choices=["id", "nombre", "comuna"])
+    p_agregar.add_argument("valor")
+    args = parser.parse_args()
+
+    engine = crear_engine()
+    crear_tablas_exclusiones(engine)
+    if args.comando == "listar":
+        conjuntos = cargar_exclusiones(engine)
+        for nombre, valores in conjuntos._asdict().items():
+            print(f"🔹 {nombre}: {', '.join(str(v) for v in sorted(valores))}")
+    elif args.comando == "agregar":
+        tabla = {"id": TABLA_EXCL_IDS, "nombre": TABLA_EXCL_NOMBRES, "comuna": TABLA_EXCL_COMUNAS}[args.tipo]
+        valor = int(args.valor) if args.tipo == "id" else args.valor.lower().strip()
+        with engine.begin() as conn:
+            conn.execute(text(_TABLAS[tabla][1]), {"valor": valor})
+        # visitas_enriquecidas y kpi_diario guardan las filas ya filtradas: hay que recalcularlas
+        print(f"✅ {args.tipo} '{valor}' excluido. Recalculando tablas derivadas...")
+        if args.tipo == "nombre":
+            reconstruir_dim_recurso(engine)
+        reconstruir_visitas(engine)
+        reconstruir_kpi_diario(engine)
+        reconstruir_ventanas(engine)
+        incrementar_version_datos(engine)
+        print("🎯 Exclusión aplicada.")
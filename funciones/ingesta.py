@@ -0,0 +1,66 @@
+# ingesta.py
+
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+
+def leer_excel_diario(ruta: str) -> tuple:
+    """
+    Lee un Excel diario como texto y lo etiqueta con 'Archivo_Origen' y 'Empresa'.
+    Se ejecuta dentro de un proceso del pool, por eso devuelve el error en vez de lanzarlo.
+    Devuelve (ruta, DataFrame o None, segundos de lectura, mensaje de error o None).
+    """
+    inicio = time.perf_counter()
+    try:
+        df = pd.read_excel(ruta, dtype=str)
+        df["Archivo_Origen"] = os.path.basename(ruta)
+        df["Empresa"] = os.path.basename(os.path.dirname(ruta))
+        return ruta, df, time.perf_counter() - inicio, None
+    except Exception as e:
+        return ruta, None, time.perf_counter() - inicio, str(e)
+
+
+def leer_excels_en_paralelo(rutas: list, num_workers: int = None):
+    """
+    Lee los Excel en un pool de procesos y va entregando cada resultado apenas termina,
+    para que la transformación avance mientras el resto de los archivos se sigue leyendo.
+    Con num_workers=1 (o un solo archivo) se lee en el proceso actual, sin pool.
+    """
+    if num_workers == 1 or len(rutas) <= 1:
+        for ruta in rutas:
+            yield leer_excel_diario(ruta)
+        return
+
+    with ProcessPoolExecutor(max_workers=num_workers) as pool:
+        futuros = [pool.submit(leer_excel_diario, ruta) for ruta in rutas]
+        for futuro in as_completed(futuros):
+            yield futuro.result()
+
+
+def imprimir_reporte_tiempos(tiempos: list, top_n: int = 10) -> None:
+    """
+    Imprime el tiempo de lectura por archivo (los más lentos primero) y el total por empresa.
+    'tiempos' es una lista de tuplas (ruta, segundos).
+    """
+    if not tiempos:
+        return
+
+    df_tiempos = pd.DataFrame(tiempos, columns=["ruta", "segundos"])
+    df_tiempos["archivo"] = df_tiempos["ruta"].map(os.path.basename)
+    df_tiempos["empresa"] = df_tiempos["ruta"].map(lambda r: os.path.basename(os.path.dirname(r)))
+
+    print(f"\n⏱️  Archivos más lentos (top {top_n}):")
+    for fila in df_tiempos.nlargest(top_n, "segundos").itertuples():
+        print(f"   {fila.segundos:7.2f} s  {fila.empresa} / {fila.archivo}")
+
+    resumen = (
+        df_tiempos.groupby("empresa")["segundos"]
+        .agg(archivos="count", total="sum", promedio="mean")
+        .sort_values("total", ascending=False)
+    )
+    print("\n⏱️  Tiempo de lectura por empresa:")
+    for empresa, fila in resumen.iterrows():
+        print(f"   {empresa:<30} {int(fila['archivos']):4d} archivos  {fila['total']:8.2f} s  (prom. {fila['promedio']:.2f} s)")
@@ -0,0 +1,179 @@
+# kpi_diario.py
+
+import argparse
+import os
+import sys
+
+import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# Permite importar el paquete 'funciones' cuando este archivo se ejecuta como script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from funciones.esquema import TIPOS_REPARACION, TIPOS_INSTALACION
+from funciones.visitas import TABLA_VISITAS
+from funciones.exclusiones import GRUPOS_TIPO_ACTIVIDAD, crear_tablas_exclusiones, sql_sin_ids_excluidos
+
+TABLA_KPI_DIARIO = "kpi_diario"
+
+TIPOS_CERTIFICACION = tuple(sorted(GRUPOS_TIPO_ACTIVIDAD["certificacion"]))
+MENSAJE_CERT_PATTERN = "certificación entregada a schaman%"
+ESTADOS_ASIGNADOS = ('finalizada', 'no realizado')
+
+# Tabla de hechos pre-agregada: una fila por día, Empresa, Recurso, Comuna, tipo de actividad
+# y propietario de red. Los IDs de recurso excluidos ya vienen fuera; las exclusiones por nombre
+# se siguen aplicando en cada consulta porque "Recurso" es parte del grano.
+# Las reincidencias y fallas tempranas son las banderas de visitas_enriquecidas (la siguiente
+# visita llegó dentro de 10 días), sin depender del rango consultado.
+_DDL_KPI_DIARIO = f"""
+CREATE TABLE IF NOT EXISTS public.{TABLA_KPI_DIARIO} (
+    fecha                   date,
+    "Empresa"               text,
+    empresa_norm            text,
+    "Recurso"               text,
+    "Comuna"                text,
+    tipo_actividad_norm     text,
+    "Propietario de Red"    text,
+    asignadas               integer NOT NULL,  -- finalizada o no realizado
+    finalizadas             integer NOT NULL,
+    reparaciones            integer NOT NULL,  -- finalizadas de reparación
+    instalaciones           integer NOT NULL,  -- finalizadas de instalación
+    certificables           integer NOT NULL,
+    certificadas            integer NOT NULL,
+    reincidencias           integer NOT NULL,
+    fallas_tempranas        integer NOT NULL,
+    duracion_total          interval,          -- suma de "Duración" de las finalizadas
+    duracion_registros      integer NOT NULL   -- finalizadas con "Duración" informada
+)
+"""
+
+_GRANO = 'fecha, "Empresa", empresa_norm, "Recurso", "Comuna", tipo_actividad_norm, "Propietario de Red"'
+
+# {filtro_actividades} y {filtro_visitas} permiten recalcular solo algunos días.
+_SQL_INSERTAR_KPI_DIARIO = f"""
+INSERT INTO public.{TABLA_KPI_DIARIO} ({_GRANO}, asignadas, finalizadas, reparaciones, instalaciones,
+    certificables, certificadas, reincidencias, fallas_tempranas, duracion_total, duracion_registros)
+SELECT {_GRANO},
+    SUM(asignadas), SUM(finalizadas), SUM(reparaciones), SUM(instalaciones),
+    SUM(certificables), SUM(certificadas), SUM(reincidencias), SUM(fallas_tempranas),
+    SUM(duracion_total), SUM(duracion_registros)
+FROM (
+    SELECT
+        a.fecha_agendamiento_dia AS fecha, a."Empresa", a.empresa_norm, a."Recurso", a."Comuna",
+        a.tipo_actividad_norm, a."Propietario de Red"::text AS "Propietario de Red",
+        COUNT(*) FILTER (WHERE a.estado_norm IN :estados_asignados) AS asignadas,
+        COUNT(*) FILTER (WHERE a.estado_norm = 'finalizada') AS finalizadas,
+        COUNT(*) FILTER (WHERE a.estado_norm = 'finalizada' AND a.tipo_actividad_norm IN :tipos_reparacion) AS reparaciones,
+        COUNT(*) FILTER (WHERE a.estado_norm = 'finalizada' AND a.tipo_actividad_norm IN :tipos_instalacion) AS instalaciones,
+        COUNT(*) FILTER (WHERE a.estado_norm = 'finalizada' AND a.tipo_actividad_norm IN :tipos_certificacion) AS certificables,
+        COUNT(*) FILTER (WHERE a.estado_norm = 'finalizada' AND a.tipo_actividad_norm IN :tipos_certificacion
+                         AND lower(trim(a."Mensaje certificación")) LIKE :mensaje_cert_pattern) AS certificadas,
+        0 AS reincidencias,
+        0 AS fallas_tempranas,
+        SUM(a."Duración") FILTER (WHERE a.estado_norm = 'finalizada') AS duracion_total,
+        COUNT(a."Duración") FILTER (WHERE a.estado_norm = 'finalizada') AS duracion_registros
+    FROM public.actividades a
+    WHERE {sql_sin_ids_excluidos('a."ID de recurso"')}
+      {{filtro_actividades}}
+    GROUP BY 1, 2, 3, 4, 5, 6, 7
+
+    UNION ALL
+
+    SELECT
+        v."Fecha Agendamiento"::date, v."Empresa", v.empresa_norm, v."Recurso", v."Comuna",
+        v.tipo_actividad_norm, v."Propietario de Red",
+        0, 0, 0, 0, 0, 0,
+        COUNT(*) FILTER (WHERE v.es_reincidencia),
+        COUNT(*) FILTER (WHERE v.es_falla_temprana),
+        NULL::interval, 0
+    FROM public.{TABLA_VISITAS} v
+    WHERE (v.es_reincidencia OR v.es_falla_temprana)
+      {{filtro_visitas}}
+    GROUP BY 1, 2, 3, 4, 5, 6, 7
+) partes
+GROUP BY {_GRANO}
+"""
+
+_PARAMS_KPI_DIARIO = {
+    "estados_asignados": ESTADOS_ASIGNADOS,
+    "tipos_reparacion": TIPOS_REPARACION,
+    "tipos_instalacion": TIPOS_INSTALACION,
+    "tipos_certificacion": TIPOS_CERTIFICACION,
+    "mensaje_cert_pattern": MENSAJE_CERT_PATTERN,
+}
+
+
+# --- MANTENCIÓN DE LA TABLA ---
+def crear_tabla_kpi_diario(engine: sa.Engine) -> None:
+    crear_tablas_exclusiones(engine)
+    with engine.begin() as conn:
+        conn.execute(text(_DDL_KPI_DIARIO))
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{TABLA_KPI_DIARIO}_fecha ON public.{TABLA_KPI_DIARIO} (fecha)'))
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{TABLA_KPI_DIARIO}_empresa_fecha ON public.{TABLA_KPI_DIARIO} (empresa_norm, fecha)'))
+
+
+def _analizar(engine: sa.Engine) -> None:
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"ANALYZE public.{TABLA_KPI_DIARIO}"))
+
+
+def reconstruir_kpi_diario(engine: sa.Engine) -> int:
+    """Recalcula la tabla completa desde 'actividades' y 'visitas_enriquecidas'. Devuelve la cantidad de filas."""
+    crear_tabla_kpi_diario(engine)
+    sql = _SQL_INSERTAR_KPI_DIARIO.format(filtro_actividades="", filtro_visitas="")
+    with engine.begin() as conn:
+        conn.execute(text(f"TRUNCATE public.{TABLA_KPI_DIARIO}"))
+        insertadas = conn.execute(text(sql), _PARAMS_KPI_DIARIO).rowcount
+    _analizar(engine)
+    return insertadas
+
+
+def actualizar_kpi_diario(engine: sa.Engine, fechas) -> int:
+    """
+    Recalcula solo los días indicados (fechas de las filas nuevas o eliminadas y de las visitas
+    cuyos indicadores cambiaron). Un valor nulo en 'fechas' recalcula las filas sin fecha.
+    Si la tabla aún no existe o está vacía, se construye completa. Devuelve las filas reescritas.
+    """
+    fechas = set(fechas)
+    if not fechas:
+        return 0
+
+    crear_tabla_kpi_diario(engine)
+    with engine.connect() as conn:
+        vacia = conn.execute(text(f"SELECT NOT EXISTS (SELECT 1 FROM public.{TABLA_KPI_DIARIO})")).scalar()
+    if vacia:
+        return reconstruir_kpi_diario(engine)
+
+    sin_fecha = any(pd.isna(f) for f in fechas)
+    params = dict(_PARAMS_KPI_DIARIO,
+                  fechas=sorted(pd.Timestamp(f).date() for f in fechas if pd.notna(f)),
+                  sin_fecha=sin_fecha)
+
+    def filtro(columna: str) -> str:
+        return f"AND ({columna} = ANY(:fechas) OR (:sin_fecha AND {columna} IS NULL))"
+
+    sql = _SQL_INSERTAR_KPI_DIARIO.format(
+        filtro_actividades=filtro("a.fecha_agendamiento_dia"),
+        filtro_visitas=filtro('v."Fecha Agendamiento"::date'),
+    )
+    with engine.begin() as conn:
+        conn.execute(
+            text(f"DELETE FROM public.{TABLA_KPI_DIARIO} WHERE fecha = ANY(:fechas) OR (:sin_fecha AND fecha IS NULL)"),
+            {"fechas": params["fechas"], "sin_fecha": sin_fecha},
+        )
+        insertadas = conn.execute(text(sql), params).rowcount
+    return insertadas
+
+
+if __name__ == "__main__":
+    from funciones.cargar_datos import crear_engine
+    from funciones.version_datos import incrementar_version_datos
+
+    parser = argparse.ArgumentParser(description="Mantención de la tabla de hechos kpi_diario.")
+    parser.add_argument("comando", choices=["reconstruir"], help="Recalcula la tabla completa.")
+    args = parser.parse_args()
+
+    engine = crear_engine()
+    total = reconstruir_kpi_diario(engine)
+    incrementar_version_datos(engine)
+    print(f"🎯 {TABLA_KPI_DIARIO} reconstruida con {total:,} filas.")
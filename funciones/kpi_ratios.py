@@ -0,0 +1,36 @@
+# kpi_ratios.py
+
+import numpy as np
+import pandas as pd
+
+# Porcentajes y clasificaciones de los KPIs calculados sobre columnas completas (numpy), en vez de
+# df.apply(lambda row: ..., axis=1), que llama a Python una vez por fila. Mismas reglas que las
+# lambdas que reemplaza: si el denominador es 0 (o nulo) el porcentaje es 0.
+
+VERDE = "#388E3C"
+ROJO = "#D32F2F"
+
+
+def porcentaje(numerador: pd.Series, denominador: pd.Series, decimales: int = None) -> pd.Series:
+    """numerador / denominador * 100, fila a fila; 0 donde el denominador no es positivo."""
+    num = numerador.to_numpy(dtype="float64", na_value=np.nan)
+    den = denominador.to_numpy(dtype="float64", na_value=np.nan)
+    resultado = np.zeros(len(num))
+    np.divide(num * 100, den, out=resultado, where=den > 0)
+    if decimales is not None:
+        resultado = resultado.round(decimales)
+    return pd.Series(resultado, index=numerador.index)
+
+
+def clasificar(valores: pd.Series, umbral: float, sobre: str, bajo: str, incluye_umbral: bool = True) -> pd.Series:
+    """Etiqueta 'sobre' si el valor supera el umbral (>= con incluye_umbral, > sin él) y 'bajo' si no."""
+    arreglo = valores.to_numpy(dtype="float64", na_value=np.nan)
+    supera = arreglo >= umbral if incluye_umbral else arreglo > umbral
+    return pd.Series(np.where(supera, sobre, bajo), index=valores.index)
+
+
+def colores_umbral(valores, umbral: float, mayor_es_mejor: bool = True) -> list:
+    """Estilos 'color: ...' para Styler.apply: verde si cumple la meta, rojo si no."""
+    if mayor_es_mejor:
+        return list(clasificar(valores, umbral, f"color: {VERDE}", f"color: {ROJO}"))
+    return list(clasificar(valores, umbral, f"color: {ROJO}", f"color: {VERDE}", incluye_umbral=False))
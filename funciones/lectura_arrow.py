@@ -0,0 +1,62 @@
+# lectura_arrow.py
+
+import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql.base import PGDialect
+
+try:
+    import adbc_driver_postgresql.dbapi as adbc_postgres
+except ImportError:  # la lectura 'arrow' es opcional; sin el driver se usa pd.read_sql
+    adbc_postgres = None
+
+from funciones.conexion import STATEMENT_TIMEOUT_MS
+
+# Lectura alternativa a pd.read_sql: el driver ADBC de PostgreSQL ejecuta la consulta con
+# COPY (...) TO STDOUT (FORMAT binary) y arma las columnas Arrow directamente desde ese flujo,
+# sin crear un objeto Python por celda. El DataFrame queda con columnas respaldadas por Arrow
+# (pd.ArrowDtype), lo que ahorra memoria y tiempo en las consultas anchas de texto.
+# Se elige por llamada: safe_read_sql(..., formato="arrow").
+
+# Dialecto solo para escribir la consulta con los valores incrustados (COPY no acepta
+# parámetros). Con paramstyle 'named' los '%' de los LIKE no se duplican.
+_DIALECTO_LITERAL = PGDialect(paramstyle="named")
+
+# Las conexiones ADBC no pasan por el pool de conexion.py: cada lectura abre la suya con el mismo
+# statement_timeout y la cierra al terminar, así nunca quedan backends abiertos fuera del pool
+# (a lo sumo una por consulta en curso, y esas las limita HILOS_CONSULTAS).
+APPLICATION_NAME = "dashboard_entelrm_arrow"
+
+
+def disponible() -> bool:
+    return adbc_postgres is not None
+
+
+def uri_adbc(engine: sa.Engine) -> str:
+    """URI libpq del engine con statement_timeout y application_name (se ve en pg_stat_activity)."""
+    url = engine.url.set(drivername="postgresql").update_query_dict({
+        "application_name": APPLICATION_NAME,
+        "options": f"-c statement_timeout={STATEMENT_TIMEOUT_MS}",
+    })
+    return url.render_as_string(hide_password=False)
+
+
+def consulta_literal(consulta, params: dict = None) -> str:
+    """SQL final con los valores incrustados y escapados por SQLAlchemy."""
+    nombres = consulta.compile().params.keys()
+    valores = {nombre: valor for nombre, valor in (params or {}).items() if nombre in nombres}
+    if valores:
+        consulta = consulta.bindparams(**valores)
+    sql = str(consulta.compile(dialect=_DIALECTO_LITERAL, compile_kwargs={"literal_binds": True}))
+    # Va dentro de COPY ( ... ): sin ';' final y con salto de línea por si termina en un comentario
+    return sql.rstrip().rstrip(";") + "\n"
+
+
+def leer_arrow(connection, consulta, params: dict = None) -> pd.DataFrame:
+    """Ejecuta la consulta (un text() de SQLAlchemy) por ADBC y devuelve un DataFrame con pd.ArrowDtype."""
+    if adbc_postgres is None:
+        raise ImportError("La lectura 'arrow' necesita adbc-driver-postgresql (pip install adbc-driver-postgresql).")
+    with adbc_postgres.connect(uri_adbc(connection.engine), autocommit=True) as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(consulta_literal(consulta, params))
+            tabla = cursor.fetch_arrow_table()
+    return tabla.to_pandas(types_mapper=pd.ArrowDtype)
@@ -0,0 +1,108 @@
+# manifiesto.py
+
+import hashlib
+import os
+import sqlite3
+from datetime import datetime
+
+# Registro de los Excel ya cargados. Permite saber qué archivos son nuevos consultando
+# solo metadatos (tamaño y fecha de modificación), sin leer el histórico de datos.
+# La clave es la ruta relativa a la carpeta de datos ("<Empresa>/<archivo>.xlsx").
+
+
+def abrir_manifiesto(ruta_db: str) -> sqlite3.Connection:
+    """Abre (y crea si no existe) la base SQLite del manifiesto."""
+    conn = sqlite3.connect(ruta_db)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archivos_ingeridos (
+            ruta        TEXT PRIMARY KEY,
+            tamano      INTEGER NOT NULL,
+            mtime       REAL    NOT NULL,
+            hash        TEXT    NOT NULL,
+            filas       INTEGER,
+            fecha_carga TEXT    NOT NULL
+        )
+    """)
+    conn.commit()
+    return conn
+
+
+def calcular_hash(ruta: str, tamano_bloque: int = 1024 * 1024) -> str:
+    """SHA-256 del contenido del archivo, leído por bloques."""
+    h = hashlib.sha256()
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(tamano_bloque), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def _clave(ruta: str, ruta_base: str) -> str:
+    return os.path.relpath(ruta, ruta_base).replace("\\", "/")
+
+
+def manifiesto_vacio(conn: sqlite3.Connection) -> bool:
+    return conn.execute("SELECT 1 FROM archivos_ingeridos LIMIT 1").fetchone() is None
+
+
+def clasificar_archivos(conn: sqlite3.Connection, rutas: list, ruta_base: str) -> tuple:
+    """
+    Compara los archivos en disco con el manifiesto y devuelve (nuevas, modificadas, firmas):
+    - nuevas: rutas que nunca se cargaron.
+    - modificadas: rutas ya cargadas cuyo contenido cambió (re-exportadas con el mismo nombre).
+    - firmas: {ruta: (tamano, mtime, hash)} de las rutas a cargar, para registrarlas después.
+    El hash solo se calcula cuando el tamaño o la fecha de modificación no coinciden.
+    """
+    registrados = {
+        ruta: (tamano, mtime, hash_)
+        for ruta, tamano, mtime, hash_ in conn.execute("SELECT ruta, tamano, mtime, hash FROM archivos_ingeridos")
+    }
+
+    nuevas, modificadas, firmas = [], [], {}
+    for ruta in rutas:
+        stat = os.stat(ruta)
+        registro = registrados.get(_clave(ruta, ruta_base))
+        if registro is not None and registro[0] == stat.st_size and registro[1] == stat.st_mtime:
+            continue
+
+        hash_ = calcular_hash(ruta)
+        if registro is not None and registro[2] == hash_:
+            # Mismo contenido (ej. el archivo se copió de nuevo): solo se actualizan los metadatos
+            conn.execute(
+                "UPDATE archivos_ingeridos SET tamano = ?, mtime = ? WHERE ruta = ?",
+                (stat.st_size, stat.st_mtime, _clave(ruta, ruta_base)),
+            )
+            continue
+
+        firmas[ruta] = (stat.st_size, stat.st_mtime, hash_)
+        (nuevas if registro is None else modificadas).append(ruta)
+
+    conn.commit()
+    return nuevas, modificadas, firmas
+
+
+def registrar_archivos(conn: sqlite3.Connection, firmas: dict, filas_por_ruta: dict, ruta_base: str) -> None:
+    """Guarda en el manifiesto los archivos que se cargaron correctamente."""
+    fecha_carga = datetime.now().isoformat(timespec="seconds")
+    conn.executemany(
+        "INSERT OR REPLACE INTO archivos_ingeridos (ruta, tamano, mtime, hash, filas, fecha_carga) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (_clave(ruta, ruta_base), tamano, mtime, hash_, filas_por_ruta.get(ruta), fecha_carga)
+            for ruta, (tamano, mtime, hash_) in firmas.items()
+            if ruta in filas_por_ruta
+        ],
+    )
+    conn.commit()
+
+
+def sembrar_manifiesto(conn: sqlite3.Connection, rutas: list, ruta_base: str, ya_cargados: set) -> int:
+    """
+    Registra como ya cargados los archivos de una instalación anterior al manifiesto.
+    'ya_cargados' es un conjunto de tuplas (Empresa, Archivo_Origen) presentes en los datos.
+    """
+    firmas = {}
+    for ruta in rutas:
+        if (os.path.basename(os.path.dirname(ruta)), os.path.basename(ruta)) in ya_cargados:
+            stat = os.stat(ruta)
+            firmas[ruta] = (stat.st_size, stat.st_mtime, calcular_hash(ruta))
+    registrar_archivos(conn, firmas, {ruta: None for ruta in firmas}, ruta_base)
+    return len(firmas)
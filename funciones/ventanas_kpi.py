@@ -0,0 +1,131 @@
+# ventanas_kpi.py
+
+import argparse
+import os
+import sys
+
+import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# Permite importar el paquete 'funciones' cuando este archivo se ejecuta como script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from funciones.kpi_diario import TABLA_KPI_DIARIO
+from funciones.exclusiones import sql_sin_nombres_excluidos
+
+TABLA_VENTANAS = "kpi_ventanas_diarias"
+
+# Casillas diarias de reincidencias y fallas tempranas por empresa y por técnico. Cada visita ya
+# trae evaluada su ventana de 10 días (banderas de visitas_enriquecidas), así que la tasa de un
+# día, de un mes o de una ventana móvil es solo una suma de casillas: no hace falta volver a
+# recorrer las visitas con RANGE BETWEEN INTERVAL '9 days' PRECEDING. Se alimenta de kpi_diario
+# (mismo universo que el Ranking, sin los técnicos excluidos por nombre) y la carga reemplaza
+# solo los días que recibieron datos.
+#   nivel = 'empresa': una fila por día y empresa ("Recurso" nulo).
+#   nivel = 'tecnico': una fila por día, empresa y técnico.
+_DDL_VENTANAS = f"""
+CREATE TABLE IF NOT EXISTS public.{TABLA_VENTANAS} (
+    fecha               date NOT NULL,
+    nivel               text NOT NULL,
+    "Empresa"           text,
+    empresa_norm        text,
+    "Recurso"           text,
+    reparaciones        integer NOT NULL,
+    reincidencias       integer NOT NULL,
+    instalaciones       integer NOT NULL,
+    fallas_tempranas    integer NOT NULL
+)
+"""
+
+# {filtro_fechas} permite recalcular solo algunos días.
+_SQL_INSERTAR_VENTANAS = f"""
+INSERT INTO public.{TABLA_VENTANAS} (fecha, nivel, "Empresa", empresa_norm, "Recurso",
+    reparaciones, reincidencias, instalaciones, fallas_tempranas)
+SELECT
+    fecha,
+    CASE WHEN GROUPING("Recurso") = 1 THEN 'empresa' ELSE 'tecnico' END,
+    "Empresa", empresa_norm, "Recurso",
+    SUM(reparaciones), SUM(reincidencias), SUM(instalaciones), SUM(fallas_tempranas)
+FROM public.{TABLA_KPI_DIARIO}
+WHERE fecha IS NOT NULL
+  AND {sql_sin_nombres_excluidos()}
+  {{filtro_fechas}}
+GROUP BY GROUPING SETS ((fecha, "Empresa", empresa_norm), (fecha, "Empresa", empresa_norm, "Recurso"))
+HAVING SUM(reparaciones) + SUM(instalaciones) + SUM(reincidencias) + SUM(fallas_tempranas) > 0
+"""
+
+# indicador -> (numerador, denominador) en la tabla de casillas
+INDICADORES = {
+    "rt": ("reincidencias", "reparaciones"),
+    "ft": ("fallas_tempranas", "instalaciones"),
+}
+
+
+# --- MANTENCIÓN DE LA TABLA ---
+def crear_tabla_ventanas(engine: sa.Engine) -> None:
+    with engine.begin() as conn:
+        conn.execute(text(_DDL_VENTANAS))
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{TABLA_VENTANAS}_fecha ON public.{TABLA_VENTANAS} (fecha)'))
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{TABLA_VENTANAS}_nivel_empresa_fecha '
+                          f'ON public.{TABLA_VENTANAS} (nivel, empresa_norm, fecha)'))
+
+
+def reconstruir_ventanas(engine: sa.Engine) -> int:
+    """Recalcula todas las casillas desde kpi_diario. Devuelve la cantidad de filas."""
+    crear_tabla_ventanas(engine)
+    with engine.begin() as conn:
+        conn.execute(text(f"TRUNCATE public.{TABLA_VENTANAS}"))
+        insertadas = conn.execute(text(_SQL_INSERTAR_VENTANAS.format(filtro_fechas=""))).rowcount
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"ANALYZE public.{TABLA_VENTANAS}"))
+    return insertadas
+
+
+def actualizar_ventanas(engine: sa.Engine, fechas) -> int:
+    """
+    Reemplaza las casillas de los días indicados (los mismos que se recalcularon en kpi_diario).
+    Cada día se actualiza por separado del resto: el costo depende de los días tocados, no del
+    histórico. Si la tabla aún no existe o está vacía, se construye completa. Devuelve las filas reescritas.
+    """
+    fechas = sorted({pd.Timestamp(f).date() for f in fechas if pd.notna(f)})
+    if not fechas:
+        return 0
+
+    crear_tabla_ventanas(engine)
+    with engine.connect() as conn:
+        vacia = conn.execute(text(f"SELECT NOT EXISTS (SELECT 1 FROM public.{TABLA_VENTANAS})")).scalar()
+    if vacia:
+        return reconstruir_ventanas(engine)
+
+    sql = _SQL_INSERTAR_VENTANAS.format(filtro_fechas="AND fecha = ANY(:fechas)")
+    with engine.begin() as conn:
+        conn.execute(text(f"DELETE FROM public.{TABLA_VENTANAS} WHERE fecha = ANY(:fechas)"), {"fechas": fechas})
+        insertadas = conn.execute(text(sql), {"fechas": fechas}).rowcount
+    return insertadas
+
+
+# --- CONSULTAS ---
+def tasas_mensuales(casillas: pd.DataFrame, indicador: str, por: str) -> pd.DataFrame:
+    """
+    Matriz 'por' x mes con el porcentaje del indicador, a partir de casillas diarias
+    (columnas fecha, 'por' y las del indicador). Las columnas son los meses ('YYYY-MM').
+    """
+    numerador, denominador = INDICADORES[indicador]
+    mes = pd.to_datetime(casillas["fecha"]).dt.strftime("%Y-%m").rename("mes")
+    totales = casillas.groupby([casillas[por], mes])[[numerador, denominador]].sum()
+    porcentaje = (totales[numerador] / totales[denominador].where(totales[denominador] > 0) * 100).round(2)
+    return porcentaje.unstack("mes").rename_axis(columns=None)
+
+
+if __name__ == "__main__":
+    from funciones.cargar_datos import crear_engine
+    from funciones.version_datos import incrementar_version_datos
+
+    parser = argparse.ArgumentParser(description=f"Mantención de la tabla {TABLA_VENTANAS}.")
+    parser.add_argument("comando", choices=["reconstruir"], help="Recalcula todas las casillas desde kpi_diario.")
+    args = parser.parse_args()
+
+    engine = crear_engine()
+    total = reconstruir_ventanas(engine)
+    incrementar_version_datos(engine)
+    print(f"🎯 {TABLA_VENTANAS} reconstruida con {total:,} filas.")
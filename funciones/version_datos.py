@@ -0,0 +1,38 @@
+# version_datos.py
+
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# Contador que identifica el estado de los datos cargados. cargar_datos.py lo incrementa al
+# terminar cada carga, así los resultados guardados en caché se invalidan apenas llegan datos nuevos.
+TABLA_VERSION = "version_datos"
+
+_DDL_VERSION = f"""
+CREATE TABLE IF NOT EXISTS public.{TABLA_VERSION} (
+    id          smallint PRIMARY KEY CHECK (id = 1),
+    version     bigint NOT NULL,
+    actualizado timestamptz NOT NULL DEFAULT now()
+)
+"""
+
+
+def obtener_version_datos(engine: sa.Engine) -> int:
+    """Versión actual de los datos (0 si todavía no se registró ninguna carga)."""
+    try:
+        with engine.connect() as conn:
+            version = conn.execute(text(f"SELECT version FROM public.{TABLA_VERSION} WHERE id = 1")).scalar()
+    except sa.exc.ProgrammingError:
+        # La tabla se crea en la primera carga que la incrementa
+        return 0
+    return version or 0
+
+
+def incrementar_version_datos(engine: sa.Engine) -> int:
+    """Marca que los datos cambiaron. Devuelve la nueva versión."""
+    with engine.begin() as conn:
+        conn.execute(text(_DDL_VERSION))
+        return conn.execute(text(f"""
+            INSERT INTO public.{TABLA_VERSION} (id, version) VALUES (1, 1)
+            ON CONFLICT (id) DO UPDATE SET version = {TABLA_VERSION}.version + 1, actualizado = now()
+            RETURNING version
+        """)).scalar()
@@ -0,0 +1,208 @@
+# visitas.py
+
+import argparse
+import os
+import sys
+
+import pandas as pd
+import sqlalchemy as sa
+from sqlalchemy import text
+
+# Permite importar el paquete 'funciones' cuando este archivo se ejecuta como script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from funciones.esquema import TIPOS_REPARACION, TIPOS_INSTALACION
+from funciones.exclusiones import crear_tablas_exclusiones, sql_sin_ids_excluidos, sql_sin_nombres_excluidos
+
+TABLA_VISITAS = "visitas_enriquecidas"
+
+# La tabla guarda, para cada visita finalizada de reparación o instalación (con los filtros
+# estándar del Ranking), su posición en la secuencia de visitas del Cod_Servicio en TODO el
+# histórico: la visita anterior y la siguiente, tanto entre todas las visitas como solo entre
+# reparaciones. Con eso cualquier rango de fechas se resuelve sin funciones de ventana:
+#   - "primera visita del período"  <=> no hay visita anterior, o la anterior es previa al inicio.
+#   - "siguiente visita del período" <=> la siguiente existe y no pasa del fin.
+_DDL_VISITAS = f"""
+CREATE TABLE IF NOT EXISTS public.{TABLA_VISITAS} (
+    "Cod_Servicio"          text NOT NULL,
+    "Fecha Agendamiento"    timestamp,
+    "Empresa"               text,
+    empresa_norm            text,
+    "Recurso"               text,
+    "ID de recurso"         integer,
+    "Comuna"                text,
+    "Propietario de Red"    text,
+    "Tipo de actividad"     text,
+    tipo_actividad_norm     text,
+    "Observación"           text,
+    "Acción realizada"      text,
+    "Nombre Cliente"        text,
+    "Dirección"             text,
+    "Mensaje certificación" text,
+    es_reparacion           boolean NOT NULL,
+    es_instalacion          boolean NOT NULL,
+    fecha_anterior          timestamp,  -- visita anterior (reparación o instalación)
+    fecha_siguiente         timestamp,  -- visita siguiente (reparación o instalación)
+    tipo_siguiente          text,
+    fecha_anterior_rep      timestamp,  -- solo en reparaciones: reparación anterior
+    fecha_siguiente_rep     timestamp,  -- solo en reparaciones: reparación siguiente
+    es_reincidencia         boolean NOT NULL,  -- la siguiente reparación llegó dentro de 10 días
+    es_falla_temprana       boolean NOT NULL   -- instalación seguida de una reparación dentro de 10 días
+)
+"""
+
+_COLUMNAS_VISITAS = """
+    "Cod_Servicio", "Fecha Agendamiento", "Empresa", empresa_norm, "Recurso", "ID de recurso",
+    "Comuna", "Propietario de Red", "Tipo de actividad", tipo_actividad_norm,
+    "Observación", "Acción realizada", "Nombre Cliente", "Dirección", "Mensaje certificación",
+    es_reparacion, es_instalacion, fecha_anterior, fecha_siguiente, tipo_siguiente,
+    fecha_anterior_rep, fecha_siguiente_rep, es_reincidencia, es_falla_temprana
+"""
+
+# {filtro_servicios} permite recalcular solo algunos Cod_Servicio. Las ventanas se
+# particionan por Cod_Servicio, así que recalcular un servicio completo da el mismo
+# resultado que recalcular toda la tabla.
+_SQL_INSERTAR_VISITAS = f"""
+INSERT INTO public.{TABLA_VISITAS} ({_COLUMNAS_VISITAS})
+WITH universo AS (
+    SELECT
+        a."Cod_Servicio", a."Fecha Agendamiento", a."Empresa", a.empresa_norm, a."Recurso", a."ID de recurso",
+        a."Comuna", a."Propietario de Red"::text AS "Propietario de Red", a."Tipo de actividad", a.tipo_actividad_norm,
+        a."Observación", a."Acción realizada", a."Nombre Cliente", a."Dirección", a."Mensaje certificación",
+        a.tipo_actividad_norm IN :tipos_reparacion AS es_reparacion,
+        a.tipo_actividad_norm IN :tipos_instalacion AS es_instalacion
+    FROM public.actividades a
+    WHERE a.estado_norm = 'finalizada'
+      AND a.tipo_actividad_norm IN :todos_tipos
+      AND a."Cod_Servicio" IS NOT NULL
+      AND {sql_sin_ids_excluidos('a."ID de recurso"')}
+      AND {sql_sin_nombres_excluidos('a."Recurso"')}
+      {{filtro_servicios}}
+),
+con_secuencia AS (
+    SELECT
+        u.*,
+        LAG("Fecha Agendamiento") OVER w AS fecha_anterior,
+        LEAD("Fecha Agendamiento") OVER w AS fecha_siguiente,
+        LEAD(tipo_actividad_norm) OVER w AS tipo_siguiente,
+        CASE WHEN es_reparacion THEN LAG("Fecha Agendamiento") OVER w_tipo END AS fecha_anterior_rep,
+        CASE WHEN es_reparacion THEN LEAD("Fecha Agendamiento") OVER w_tipo END AS fecha_siguiente_rep
+    FROM universo u
+    WINDOW w AS (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento"),
+           w_tipo AS (PARTITION BY "Cod_Servicio", es_reparacion ORDER BY "Fecha Agendamiento")
+)
+SELECT
+    "Cod_Servicio", "Fecha Agendamiento", "Empresa", empresa_norm, "Recurso", "ID de recurso",
+    "Comuna", "Propietario de Red", "Tipo de actividad", tipo_actividad_norm,
+    "Observación", "Acción realizada", "Nombre Cliente", "Dirección", "Mensaje certificación",
+    es_reparacion, es_instalacion, fecha_anterior, fecha_siguiente, tipo_siguiente,
+    fecha_anterior_rep, fecha_siguiente_rep,
+    COALESCE(es_reparacion AND fecha_siguiente_rep <= "Fecha Agendamiento" + INTERVAL '10 days', false),
+    COALESCE(es_instalacion AND fecha_siguiente <= "Fecha Agendamiento" + INTERVAL '10 days'
+             AND tipo_siguiente IN :tipos_reparacion, false)
+FROM con_secuencia
+"""
+
+_PARAMS_UNIVERSO = {
+    "tipos_reparacion": TIPOS_REPARACION,
+    "tipos_instalacion": TIPOS_INSTALACION,
+    "todos_tipos": TIPOS_REPARACION + TIPOS_INSTALACION,
+}
+
+
+# --- CONDICIONES PARA LAS CONSULTAS DE analisis.py ---
+# Equivalen a la lógica original (ROW_NUMBER = 1 y LEAD dentro del rango de fechas),
+# pero sobre columnas ya calculadas. Usan los parámetros :f_inicio y :f_fin.
+def condicion_reincidencia(con_rango: bool = True, param_inicio: str = "f_inicio") -> str:
+    """Reparación que fue la primera del período y cuya siguiente reparación del período llegó en <= 10 días."""
+    if not con_rango:
+        return "(es_reincidencia AND fecha_anterior_rep IS NULL)"
+    return (f"(es_reincidencia AND (fecha_anterior_rep IS NULL OR fecha_anterior_rep < :{param_inicio}) "
+            "AND fecha_siguiente_rep <= :f_fin)")
+
+
+def condicion_falla_temprana(con_rango: bool = True, param_inicio: str = "f_inicio", solo_primera: bool = True) -> str:
+    """Instalación (primera visita del período) seguida de una reparación del período en <= 10 días."""
+    if not con_rango:
+        return "(es_falla_temprana AND fecha_anterior IS NULL)" if solo_primera else "es_falla_temprana"
+    primera = f" AND (fecha_anterior IS NULL OR fecha_anterior < :{param_inicio})" if solo_primera else ""
+    return f"(es_falla_temprana{primera} AND fecha_siguiente <= :f_fin)"
+
+
+# --- MANTENCIÓN DE LA TABLA ---
+def crear_tabla_visitas(engine: sa.Engine) -> None:
+    crear_tablas_exclusiones(engine)
+    with engine.begin() as conn:
+        conn.execute(text(_DDL_VISITAS))
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{TABLA_VISITAS}_servicio ON public.{TABLA_VISITAS} ("Cod_Servicio")'))
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{TABLA_VISITAS}_fecha ON public.{TABLA_VISITAS} ("Fecha Agendamiento")'))
+        conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{TABLA_VISITAS}_empresa_fecha ON public.{TABLA_VISITAS} (empresa_norm, "Fecha Agendamiento")'))
+
+
+def reconstruir_visitas(engine: sa.Engine) -> int:
+    """Recalcula la tabla completa desde 'actividades'. Devuelve la cantidad de visitas."""
+    crear_tabla_visitas(engine)
+    with engine.begin() as conn:
+        conn.execute(text(f"TRUNCATE public.{TABLA_VISITAS}"))
+        insertadas = conn.execute(text(_SQL_INSERTAR_VISITAS.format(filtro_servicios="")), _PARAMS_UNIVERSO).rowcount
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"ANALYZE public.{TABLA_VISITAS}"))
+    return insertadas
+
+
+def actualizar_visitas(engine: sa.Engine, servicios) -> int:
+    """
+    Recalcula solo los Cod_Servicio indicados (los que recibieron filas nuevas o eliminadas).
+    Si la tabla aún no existe o está vacía, se construye completa.
+    Devuelve la cantidad de visitas reescritas.
+    """
+    servicios = sorted({str(s) for s in servicios if pd.notna(s)})
+    if not servicios:
+        return 0
+
+    crear_tabla_visitas(engine)
+    with engine.connect() as conn:
+        vacia = conn.execute(text(f"SELECT NOT EXISTS (SELECT 1 FROM public.{TABLA_VISITAS})")).scalar()
+    if vacia:
+        return reconstruir_visitas(engine)
+
+    with engine.begin() as conn:
+        conn.execute(text('CREATE TEMP TABLE tmp_servicios_tocados ("Cod_Servicio" text PRIMARY KEY) ON COMMIT DROP'))
+        conn.execute(
+            text('INSERT INTO tmp_servicios_tocados ("Cod_Servicio") VALUES (:cod)'),
+            [{"cod": s} for s in servicios],
+        )
+        conn.execute(text("ANALYZE tmp_servicios_tocados"))
+        conn.execute(text(f"""
+            DELETE FROM public.{TABLA_VISITAS} v
+            USING tmp_servicios_tocados t
+            WHERE v."Cod_Servicio" = t."Cod_Servicio"
+        """))
+        filtro = 'AND a."Cod_Servicio" IN (SELECT "Cod_Servicio" FROM tmp_servicios_tocados)'
+        insertadas = conn.execute(text(_SQL_INSERTAR_VISITAS.format(filtro_servicios=filtro)), _PARAMS_UNIVERSO).rowcount
+    return insertadas
+
+
+def fechas_de_servicios(engine: sa.Engine, servicios) -> set:
+    """Días con visitas de los Cod_Servicio indicados (sus indicadores pudieron cambiar al recalcularlos)."""
+    servicios = sorted({str(s) for s in servicios if pd.notna(s)})
+    if not servicios:
+        return set()
+    with engine.connect() as conn:
+        return set(conn.execute(
+            text(f'SELECT DISTINCT "Fecha Agendamiento"::date FROM public.{TABLA_VISITAS} WHERE "Cod_Servicio" = ANY(:servicios)'),
+            {"servicios": servicios},
+        ).scalars())
+
+
+if __name__ == "__main__":
+    from funciones.cargar_datos import crear_engine
+    from funciones.version_datos import incrementar_version_datos
+
+    parser = argparse.ArgumentParser(description="Mantención de la tabla visitas_enriquecidas.")
+    parser.add_argument("comando", choices=["reconstruir"], help="Recalcula la tabla completa desde actividades.")
+    args = parser.parse_args()
+
+    engine = crear_engine()
+    total = reconstruir_visitas(engine)
+    incrementar_version_datos(engine)
+    print(f"🎯 {TABLA_VISITAS} reconstruida con {total:,} visitas.")
@@ -1,11 +1,12 @@
 # Guardar como: diagnostico_final.py
 import pandas as pd
 import os
+from funciones.almacen_parquet import leer_dataset
 
 # --- CONFIGURACIÓN ---
 # Asegúrate de que esta ruta sea la correcta
 ruta_base_datos = r"C:\Users\alex_\Downloads\Proyecto_EntelRM\Datos"
-ruta_parquet = os.path.join(ruta_base_datos, "datos_unificados.parquet")
+ruta_dataset = os.path.join(ruta_base_datos, "datos_unificados")
 TARGET_ACTIVITY = 'instalación-hogar-fibra'
 
 print("==========================================================")
@@ -13,11 +14,11 @@ print("--- INICIANDO DIAGNÓSTICO FINAL ---")
 print(f"Analizando la actividad: '{TARGET_ACTIVITY}'")
 print("==========================================================")
 
-if not os.path.exists(ruta_parquet):
-    print(f"❌ ERROR: No se encuentra el archivo Parquet en {ruta_parquet}")
+if not os.path.isdir(ruta_dataset):
+    print(f"❌ ERROR: No se encuentra el dataset Parquet en {ruta_dataset}")
 else:
     # --- Carga y Limpieza Básica ---
-    df = pd.read_parquet(ruta_parquet)
+    df = leer_dataset(ruta_dataset)
     # Normalizamos las columnas clave para una comparación consistente
     df['Propietario de Red'] = df['Propietario de Red'].fillna('VACIO').str.lower().str.strip()
     df['Tipo de actividad'] = df['Tipo de actividad'].fillna('').str.lower().str.strip()
@@ -2,6 +2,7 @@
 import pandas as pd
 import sqlalchemy as sa
 from sqlalchemy.sql import text
+from funciones.conexion import crear_engine
 from datetime import datetime
 
 # --- LÓGICA DE RANKING (La función que irá en analisis.py) ---
@@ -15,7 +16,7 @@ def obtener_ranking_tecnicos_final(engine: sa.Engine, fecha_inicio: str, fecha_f
     tipos_certificacion = ('reparación 3play light', 'reparación-hogar-fibra')
     estados_asignados = ('finalizada', 'no realizado')
     mensaje_cert_pattern = "certificación entregada a schaman%"
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
+    ids_excl = (3826, 3824, 3825, 5286, 3823, 3822)
     noms_excl_patterns = [f'%{nom}%' for nom in ('bio', 'sice', 'rex', 'rielecom', 'famer', 'hometelcom', 'zener', 'prointel', 'soportevision', 'telsycab')]
 
     query = """
@@ -31,7 +32,7 @@ def obtener_ranking_tecnicos_final(engine: sa.Engine, fecha_inicio: str, fecha_f
             LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
         FROM public.actividades
         WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND (:f_fin::date + INTERVAL '10 days')
-          AND "ID de recurso"::text NOT IN :ids_excl
+          AND "ID de recurso" NOT IN :ids_excl
           AND "Recurso" NOT ILIKE ANY (ARRAY[:noms_excl_patterns])
     ),
     kpis_brutos_por_tecnico AS (
@@ -107,15 +108,9 @@ def obtener_ranking_tecnicos_final(engine: sa.Engine, fecha_inicio: str, fecha_f
 
 # --- EJECUCIÓN DE LA PRUEBA ---
 if __name__ == "__main__":
-    # --- Configura tu conexión a la base de datos aquí ---
-    DB_USER = "postgres"
-    DB_PASSWORD = "postgres"
-    DB_HOST = "localhost"
-    DB_PORT = "5432"
-    DB_NAME = "entelrm"
-    
+    # --- La conexión se configura en funciones/conexion.py (o DB_CONNECTION_STRING) ---
     try:
-        engine = sa.create_engine(f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
+        engine = crear_engine(application_name="prueba_ranking")
         print("✅ Conexión a la base de datos exitosa.")
     except Exception as e:
         print(f"❌ Error de conexión: {e}")
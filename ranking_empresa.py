@@ -2,6 +2,7 @@
 import pandas as pd
 import sqlalchemy as sa
 from sqlalchemy.sql import text
+from funciones.conexion import crear_engine
 from datetime import date, timedelta, datetime
 
 # --- TU FUNCIÓN A PROBAR ---
@@ -15,7 +16,7 @@ def obtener_ranking_empresas(engine: sa.Engine, fecha_inicio: str, fecha_fin: st
     tipos_instalacion = ('instalación-hogar-fibra', 'instalación-masivo-fibra')
     tipos_certificacion = ('reparación 3play light', 'reparación-hogar-fibra')
     mensaje_cert_pattern = "certificación entregada a schaman%"
-    ids_excl = tuple(str(i) for i in (3826, 3824, 3825, 5286, 3823, 3822))
+    ids_excl = (3826, 3824, 3825, 5286, 3823, 3822)
 
     query = """
     WITH base_data AS (
@@ -31,7 +32,7 @@ def obtener_ranking_empresas(engine: sa.Engine, fecha_inicio: str, fecha_fin: st
         FROM public.actividades
         WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin
           AND lower("Estado de actividad") = 'finalizada'
-          AND "ID de recurso"::text NOT IN :ids_excl
+          AND "ID de recurso" NOT IN :ids_excl
           AND NOT (
                   lower("Recurso") LIKE '%bio%' OR lower("Recurso") LIKE '%sice%' OR lower("Recurso") LIKE '%rex%' OR
                   lower("Recurso") LIKE '%rielecom%' OR lower("Recurso") LIKE '%famer%' OR lower("Recurso") LIKE '%hometelcom%' OR
@@ -136,15 +137,9 @@ def obtener_ranking_empresas(engine: sa.Engine, fecha_inicio: str, fecha_fin: st
 
 # --- EJECUCIÓN DE LA PRUEBA ---
 if __name__ == "__main__":
-    # --- Configura tu conexión a la base de datos aquí ---
-    DB_USER = "postgres"
-    DB_PASSWORD = "postgres"
-    DB_HOST = "localhost"
-    DB_PORT = "5432"
-    DB_NAME = "entelrm"
-    
+    # --- La conexión se configura en funciones/conexion.py (o DB_CONNECTION_STRING) ---
     try:
-        engine = sa.create_engine(f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}")
+        engine = crear_engine(application_name="prueba_ranking")
         print("✅ Conexión a la base de datos exitosa.")
     except Exception as e:
         print(f"❌ Error de conexión: {e}")
@@ -4,6 +4,7 @@ import streamlit as st
 import pandas as pd
 import sqlalchemy as sa
 from sqlalchemy import text
+from funciones.conexion import crear_engine
 from datetime import datetime, timedelta
 import plotly.express as px
 
@@ -27,14 +28,8 @@ st.markdown("""
 # --- 2. CONEXIÓN A LA BASE DE DATOS ---
 @st.cache_resource
 def get_db_engine():
-    usuario_pg = "postgres"
-    password_pg = "postgres" 
-    host_pg = "localhost"
-    puerto_pg = "5432"
-    base_datos_pg = "entelrm"
-    conexion_pg_str = f"postgresql+psycopg2://{usuario_pg}:{password_pg}@{host_pg}:{puerto_pg}/{base_datos_pg}"
     try:
-        engine = sa.create_engine(conexion_pg_str)
+        engine = crear_engine(application_name="dashboard_reincidencias")
         with engine.connect() as connection: pass
         return engine
     except Exception as e:
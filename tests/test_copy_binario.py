@@ -0,0 +1,122 @@
+# test_copy_binario.py
+# Comprueba el escritor de COPY binario contra los bytes que espera PostgreSQL
+# (https://www.postgresql.org/docs/current/sql-copy.html, Binary Format).
+# La ida y vuelta por un COPY real solo corre con PRUEBAS_DB_URL definida.
+
+import os
+import struct
+import sys
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from funciones.copy_binario import FlujoCopyBinario, codificar_lote, tipo_postgres
+
+NULO = struct.pack(">i", -1)
+
+
+def campo(datos: bytes) -> bytes:
+    return struct.pack(">i", len(datos)) + datos
+
+
+@pytest.fixture
+def df_tipos():
+    return pd.DataFrame({
+        "texto": ["ab", None, "ñandú"],
+        "entero": pd.array([1, None, -2], dtype="Int64"),
+        "fecha": pd.to_datetime(["2000-01-01 00:00:01", None, "1999-12-31 23:59:59"]),
+        "duracion": pd.to_timedelta(["1.5s", None, "2 days 00:00:03"]),
+        "bandera": [True, False, True],
+        "real": [1.0, np.nan, -0.5],
+    })
+
+
+def test_tipo_postgres(df_tipos):
+    assert {c: tipo_postgres(df_tipos[c]) for c in df_tipos.columns} == {
+        "texto": "text",
+        "entero": "bigint",
+        "fecha": "timestamp",
+        "duracion": "interval",
+        "bandera": "boolean",
+        "real": "double precision",
+    }
+    # Con nulos, un booleano no se puede codificar como boolean: va como texto
+    assert tipo_postgres(pd.Series([True, None], dtype="object")) == "text"
+
+
+def test_codificar_lote_bytes_esperados(df_tipos):
+    tipos = {c: tipo_postgres(df_tipos[c]) for c in df_tipos.columns}
+    esperado = (
+        struct.pack(">h", 6)
+        + campo(b"ab")
+        + campo(struct.pack(">q", 1))
+        + campo(struct.pack(">q", 1_000_000))                  # 1 s después de 2000-01-01
+        + campo(struct.pack(">qii", 1_500_000, 0, 0))          # microsegundos, días, meses
+        + campo(b"\x01")
+        + campo(struct.pack(">d", 1.0))
+
+        + struct.pack(">h", 6)
+        + NULO + NULO + NULO + NULO
+        + campo(b"\x00")
+        + NULO
+
+        + struct.pack(">h", 6)
+        + campo("ñandú".encode("utf-8"))
+        + campo(struct.pack(">q", -2))
+        + campo(struct.pack(">q", -1_000_000))                 # antes del epoch de PostgreSQL
+        + campo(struct.pack(">qii", (2 * 86_400 + 3) * 1_000_000, 0, 0))
+        + campo(b"\x01")
+        + campo(struct.pack(">d", -0.5))
+    )
+    assert codificar_lote(df_tipos, tipos) == esperado
+
+
+def test_codificar_lote_vacio(df_tipos):
+    tipos = {c: tipo_postgres(df_tipos[c]) for c in df_tipos.columns}
+    assert codificar_lote(df_tipos.head(0), tipos) == b""
+
+
+def test_flujo_encabezado_lotes_y_fin(df_tipos):
+    tipos = {c: tipo_postgres(df_tipos[c]) for c in df_tipos.columns}
+    avances = []
+    flujo = FlujoCopyBinario(df_tipos, tamano_lote=2, al_codificar=avances.append)
+
+    partes = []
+    while True:
+        parte = flujo.read(7)  # lecturas cortas: el flujo debe cortar y unir los lotes sin perder bytes
+        if not parte:
+            break
+        partes.append(parte)
+
+    encabezado = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+    cuerpo = codificar_lote(df_tipos.iloc[0:2], tipos) + codificar_lote(df_tipos.iloc[2:3], tipos)
+    assert b"".join(partes) == encabezado + cuerpo + struct.pack(">h", -1)
+    assert avances == [2, 3]
+
+
+@pytest.mark.skipif(not os.environ.get("PRUEBAS_DB_URL"), reason="sin PRUEBAS_DB_URL no hay PostgreSQL de prueba")
+def test_ida_y_vuelta_por_copy(df_tipos):
+    import sqlalchemy as sa
+
+    engine = sa.create_engine(os.environ["PRUEBAS_DB_URL"])
+    flujo = FlujoCopyBinario(df_tipos, tamano_lote=2)
+    columnas = ", ".join(f'"{c}" {t}' for c, t in flujo.tipos.items())
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"CREATE TEMP TABLE prueba_copy ({columnas})")
+            cursor.copy_expert("COPY prueba_copy FROM STDIN (FORMAT binary)", flujo)
+            cursor.execute("SELECT * FROM prueba_copy")
+            filas = cursor.fetchall()
+    finally:
+        conn.rollback()
+        conn.close()
+
+    assert filas == [
+        ("ab", 1, datetime(2000, 1, 1, 0, 0, 1), timedelta(seconds=1.5), True, 1.0),
+        (None, None, None, None, False, None),
+        ("ñandú", -2, datetime(1999, 12, 31, 23, 59, 59), timedelta(days=2, seconds=3), True, -0.5),
+    ]
@@ -0,0 +1,191 @@
+# test_equivalencia_rt_ft.py
+# Las reincidencias y fallas tempranas del Ranking salen de las banderas de visitas_enriquecidas
+# más condiciones de rango (condicion_reincidencia / condicion_falla_temprana). Aquí se comparan,
+# por técnico, con la consulta original de ventanas (ROW_NUMBER = 1 y LEAD dentro del período)
+# sobre un 'actividades' pequeño con los casos de borde. Corre en una BD temporal creada desde
+# PRUEBAS_DB_URL (se necesita permiso CREATEDB).
+
+import os
+import sys
+import uuid
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+pytestmark = pytest.mark.skipif(not os.environ.get("PRUEBAS_DB_URL"), reason="sin PRUEBAS_DB_URL no hay PostgreSQL de prueba")
+
+REP = "reparación-hogar-fibra"
+INS = "instalación-hogar-fibra"
+
+_DDL_ACTIVIDADES = """
+CREATE TABLE public.actividades (
+    "Cod_Servicio"          text,
+    "Fecha Agendamiento"    timestamp,
+    "Empresa"               text,
+    empresa_norm            text,
+    "Recurso"               text,
+    "ID de recurso"         integer,
+    "Comuna"                text,
+    "Propietario de Red"    text,
+    "Tipo de actividad"     text,
+    tipo_actividad_norm     text,
+    estado_norm             text,
+    "Observación"           text,
+    "Acción realizada"      text,
+    "Nombre Cliente"        text,
+    "Dirección"             text,
+    "Mensaje certificación" text,
+    "Duración"              interval,
+    fecha_agendamiento_dia  date GENERATED ALWAYS AS ("Fecha Agendamiento"::date) STORED
+)
+"""
+
+# (servicio, fecha, técnico, empresa, tipo); el período principal es marzo de 2025
+VISITAS = [
+    # Reparación previa al inicio: la primera del período es la del 03-03 y reincide el 03-08
+    ("S1", "2025-02-25 10:00", "Ana", "E1", REP),
+    ("S1", "2025-03-03 10:00", "Ana", "E1", REP),
+    ("S1", "2025-03-08 10:00", "Beto", "E2", REP),
+    # La siguiente reparación cae después del fin: no cuenta
+    ("S2", "2025-03-28 10:00", "Beto", "E2", REP),
+    ("S2", "2025-04-02 10:00", "Beto", "E2", REP),
+    # Exactamente 10 días: cuenta
+    ("S3", "2025-03-05 08:00", "Ana", "E1", REP),
+    ("S3", "2025-03-15 08:00", "Beto", "E2", REP),
+    # 10 días y un minuto: no cuenta
+    ("S4", "2025-03-05 08:00", "Beto", "E2", REP),
+    ("S4", "2025-03-15 08:01", "Ana", "E1", REP),
+    # Instalación seguida de una reparación: falla temprana
+    ("S5", "2025-03-10 09:00", "Caro", "E1", INS),
+    ("S5", "2025-03-14 09:00", "Beto", "E2", REP),
+    # Instalación y reparación a exactamente 10 días: falla temprana
+    ("S6", "2025-03-10 09:00", "Caro", "E1", INS),
+    ("S6", "2025-03-20 09:00", "Ana", "E1", REP),
+    # Instalación previa al inicio: no cuenta
+    ("S7", "2025-02-27 09:00", "Caro", "E1", INS),
+    ("S7", "2025-03-02 09:00", "Ana", "E1", REP),
+    # La siguiente visita es otra instalación: no es falla temprana
+    ("S8", "2025-03-12 09:00", "Caro", "E1", INS),
+    ("S8", "2025-03-14 09:00", "Caro", "E1", INS),
+    ("S8", "2025-03-16 09:00", "Beto", "E2", REP),
+    # La instalación no es la primera visita del período; las reparaciones reinciden en 5 días
+    ("S9", "2025-03-01 00:00", "Ana", "E1", REP),
+    ("S9", "2025-03-03 09:00", "Caro", "E1", INS),
+    ("S9", "2025-03-06 00:00", "Beto", "E2", REP),
+    # Reparación después del fin: no es falla temprana
+    ("S10", "2025-03-25 09:00", "Caro", "E1", INS),
+    ("S10", "2025-04-01 09:00", "Beto", "E2", REP),
+]
+
+# Consulta original (antes de visitas_enriquecidas), sin los filtros de exclusión: el fixture no los usa
+_SQL_VENTANAS = """
+WITH base_calidad_reincidencia AS (
+    SELECT "Recurso", "Fecha Agendamiento",
+           FIRST_VALUE("Empresa") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as primera_empresa_servicio,
+           ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita,
+           LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
+    FROM public.actividades
+    WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin AND estado_norm = 'finalizada'
+      AND tipo_actividad_norm IN :tipos_reparacion
+),
+base_calidad_falla_temprana AS (
+    SELECT "Recurso", "Fecha Agendamiento", tipo_actividad_norm as tipo_actividad,
+           FIRST_VALUE("Empresa") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as primera_empresa_servicio,
+           ROW_NUMBER() OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as orden_visita,
+           LEAD(tipo_actividad_norm) OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as tipo_siguiente_visita,
+           LEAD("Fecha Agendamiento") OVER (PARTITION BY "Cod_Servicio" ORDER BY "Fecha Agendamiento") as fecha_siguiente_visita
+    FROM public.actividades
+    WHERE "Fecha Agendamiento" BETWEEN :f_inicio AND :f_fin AND estado_norm = 'finalizada'
+      AND (tipo_actividad_norm IN :tipos_reparacion OR tipo_actividad_norm IN :tipos_instalacion)
+)
+SELECT "Recurso", primera_empresa_servicio as "Empresa", 'rt' AS indicador, COUNT(*) AS total
+FROM base_calidad_reincidencia
+WHERE orden_visita = 1 AND fecha_siguiente_visita IS NOT NULL AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days'
+GROUP BY 1, 2
+UNION ALL
+SELECT "Recurso", primera_empresa_servicio, 'ft', COUNT(*)
+FROM base_calidad_falla_temprana
+WHERE tipo_actividad IN :tipos_instalacion AND orden_visita = 1 AND fecha_siguiente_visita IS NOT NULL
+  AND fecha_siguiente_visita <= "Fecha Agendamiento" + INTERVAL '10 days' AND tipo_siguiente_visita IN :tipos_reparacion
+GROUP BY 1, 2
+"""
+
+
+@pytest.fixture(scope="module")
+def engine():
+    import sqlalchemy as sa
+    from sqlalchemy import text
+    from funciones.exclusiones import actualizar_dim_recurso, crear_tablas_exclusiones
+    from funciones.kpi_diario import reconstruir_kpi_diario
+    from funciones.visitas import reconstruir_visitas
+
+    url = sa.make_url(os.environ["PRUEBAS_DB_URL"])
+    nombre_bd = f"prueba_rt_ft_{uuid.uuid4().hex[:8]}"
+    admin = sa.create_engine(url, isolation_level="AUTOCOMMIT")
+    with admin.connect() as conn:
+        conn.execute(text(f"CREATE DATABASE {nombre_bd}"))
+    engine = sa.create_engine(url.set(database=nombre_bd))
+    try:
+        with engine.begin() as conn:
+            conn.execute(text(_DDL_ACTIVIDADES))
+            conn.execute(text("""
+                INSERT INTO public.actividades ("Cod_Servicio", "Fecha Agendamiento", "Empresa", empresa_norm,
+                    "Recurso", "ID de recurso", "Comuna", "Tipo de actividad", tipo_actividad_norm, estado_norm)
+                VALUES (:servicio, :fecha, :empresa, lower(:empresa), :recurso, :id_recurso, 'santiago',
+                    :tipo, :tipo, 'finalizada')
+            """), [
+                {"servicio": s, "fecha": f, "recurso": r, "empresa": e, "tipo": t, "id_recurso": i}
+                for i, (s, f, r, e, t) in enumerate(VISITAS, start=1)
+            ])
+        # Mismo orden que cargar_datos.py: registro, dimensión de técnicos y tablas derivadas
+        crear_tablas_exclusiones(engine)
+        actualizar_dim_recurso(engine, {v[2] for v in VISITAS})
+        reconstruir_visitas(engine)
+        reconstruir_kpi_diario(engine)
+        yield engine
+    finally:
+        engine.dispose()
+        with admin.connect() as conn:
+            conn.execute(text(f"DROP DATABASE IF EXISTS {nombre_bd}"))
+        admin.dispose()
+
+
+def _conteos_ventanas(engine, f_inicio: str, f_fin: str) -> dict:
+    from funciones.analisis import safe_read_sql
+    from funciones.esquema import TIPOS_INSTALACION, TIPOS_REPARACION
+
+    params = {"f_inicio": f_inicio, "f_fin": f_fin,
+              "tipos_reparacion": TIPOS_REPARACION, "tipos_instalacion": TIPOS_INSTALACION}
+    with engine.connect() as conn:
+        df = safe_read_sql(conn, _SQL_VENTANAS, params)
+    return {(r.Recurso, r.Empresa, r.indicador): r.total for r in df.itertuples()}
+
+
+def _conteos_actuales(engine, f_inicio: str, f_fin: str) -> dict:
+    from funciones.analisis import _calcular_kpis_tecnicos
+
+    df = _calcular_kpis_tecnicos(engine, f_inicio, f_fin)
+    conteos = {}
+    for r in df.itertuples():
+        if r.total_reincidencias:
+            conteos[(r.Recurso, r.Empresa, "rt")] = r.total_reincidencias
+        if r.total_fallas_tempranas:
+            conteos[(r.Recurso, r.Empresa, "ft")] = r.total_fallas_tempranas
+    return conteos
+
+
+def test_conteos_esperados_marzo(engine):
+    # S1, S3 y S9 para Ana; S5 y S6 para Caro
+    assert _conteos_actuales(engine, "2025-03-01", "2025-03-31") == {("Ana", "E1", "rt"): 3, ("Caro", "E1", "ft"): 2}
+
+
+@pytest.mark.parametrize("f_inicio, f_fin", [
+    ("2025-03-01", "2025-03-31"),
+    ("2025-03-02", "2025-03-31"),  # S9 y S7 pierden su primera visita: la siguiente pasa a ser la primera
+    ("2025-03-04", "2025-03-15"),  # S3 y S4 en el borde del fin; S1 con su anterior antes del inicio
+    ("2025-03-10", "2025-03-14"),  # S5 dentro, S6 con la reparación fuera del período
+    ("2025-02-20", "2025-04-30"),  # todo el histórico
+])
+def test_iguales_a_la_consulta_de_ventanas(engine, f_inicio, f_fin):
+    assert _conteos_actuales(engine, f_inicio, f_fin) == _conteos_ventanas(engine, f_inicio, f_fin)